@@ -141,3 +141,4 @@ paths.add(pathname="config", path=paths["workspace"] / "config", createMissing=T
 paths.add(pathname="logs", path=paths["workspace"] / "logs", createMissing=True)
 paths.add(pathname="snapshots", path=paths["logs"] / "snapshots", createMissing=True)
 
+paths.add(pathname="cache", path=paths["workspace"] / "cache", createMissing=True)
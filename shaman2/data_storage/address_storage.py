@@ -0,0 +1,118 @@
+import atexit
+import json
+import re
+from datetime import datetime
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+
+
+# Folds case, whitespace and punctuation out of a raw address string, so that trivially different spellings of the
+# same address ("123 Main St., Houston TX" vs "123 main st houston, tx") share a single cache key.
+def normalizeAddressText(rawAddressString : str):
+    normalizedAddress = re.sub(r"[^\w\s]"," ",str(rawAddressString).lower())
+    return re.sub(r"\s+"," ",normalizedAddress).strip()
+
+
+# This class stores a persistent cache of fully validated addresses, keyed on normalized raw address text, so that
+# addresses users ship to repeatedly (like OpCo sites) skip GPT and Nominatim entirely. Entries expire after
+# maxAgeDays, and the least recently used entries are evicted once there are more than maxEntries. Also tracks the
+# hit/miss rate of the cache. Usage stamps from hits are only written out with the next save (or at shutdown), so
+# cache hits never touch the disk.
+class AddressValidationCache:
+
+    def __init__(self,cacheFilePath=None,maxEntries=5000,maxAgeDays=180):
+        self.cacheFilePath = cacheFilePath if cacheFilePath else paths["cache"] / "address_validation.json"
+        self.maxEntries = maxEntries
+        self.maxAgeDays = maxAgeDays
+        self.addresses = {}
+        self.hits = 0
+        self.misses = 0
+        self.__unsavedUsage = False
+
+        self.load()
+
+    # Returns a copy of the cached validated address for the given raw address string, or None if it isn't cached
+    # (or is stale). Counts toward the hit/miss rate.
+    def get(self,rawAddressString : str):
+        addressKey = normalizeAddressText(rawAddressString)
+        cachedEntry = self.addresses.get(addressKey)
+        if cachedEntry and (datetime.now() - datetime.fromisoformat(cachedEntry["Cached"])).days >= self.maxAgeDays:
+            self.addresses.pop(addressKey)
+            cachedEntry = None
+
+        if cachedEntry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        cachedEntry["LastUsed"] = datetime.now().isoformat()
+        cachedEntry["Uses"] = cachedEntry.get("Uses",0) + 1
+        self.__unsavedUsage = True
+        return dict(cachedEntry["Address"])
+
+    # Returns True if a fresh validated address is cached for the given raw address string, without counting as a lookup.
+    def __contains__(self, rawAddressString):
+        cachedEntry = self.addresses.get(normalizeAddressText(rawAddressString))
+        return cachedEntry is not None and (datetime.now() - datetime.fromisoformat(cachedEntry["Cached"])).days < self.maxAgeDays
+
+    # Adder method for storing a fully validated address under its raw address string.
+    def addAddress(self,rawAddressString : str,validatedAddress : dict):
+        currentTime = datetime.now().isoformat()
+        self.addresses[normalizeAddressText(rawAddressString)] = {"Address": dict(validatedAddress),"Cached": currentTime,
+                                                                  "LastUsed": currentTime,"Uses": 0}
+        self.__evict()
+        self.save()
+    # Removes the cached address for the given raw address string, in case it turned out to be wrong.
+    def removeAddress(self,rawAddressString : str):
+        if self.addresses.pop(normalizeAddressText(rawAddressString),None):
+            self.save()
+
+    # Returns a simple report string of this session's hit/miss rates.
+    def getStatsReport(self):
+        totalLookups = self.hits + self.misses
+        hitRate = (self.hits / totalLookups * 100) if totalLookups else 0
+        return (f"Address validation cache: {self.hits} hits, {self.misses} misses ({hitRate:.1f}% hit rate over "
+                f"{totalLookups} lookups, {len(self.addresses)} cached addresses).")
+
+    #region === Helpers ===
+
+    # Drops expired entries, then the least recently used entries until there are at most maxEntries.
+    def __evict(self):
+        self.addresses = {addressKey: cachedEntry for addressKey,cachedEntry in self.addresses.items()
+                          if (datetime.now() - datetime.fromisoformat(cachedEntry["Cached"])).days < self.maxAgeDays}
+        if len(self.addresses) > self.maxEntries:
+            evictedCount = len(self.addresses) - self.maxEntries
+            for addressKey in sorted(self.addresses,key=lambda thisKey: self.addresses[thisKey]["LastUsed"])[:evictedCount]:
+                self.addresses.pop(addressKey)
+            log.info(f"Evicted {evictedCount} least recently used addresses from the address validation cache.")
+
+    #endregion === Helpers ===
+
+    #region === Persistence ===
+
+    # Loads the cache from its file, if it exists.
+    def load(self):
+        if not self.cacheFilePath.exists():
+            return False
+        try:
+            with open(self.cacheFilePath,"r") as f:
+                self.addresses = json.load(f).get("Addresses",{})
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"Couldn't load address validation cache from '{self.cacheFilePath}', starting fresh: {e}")
+            return False
+        return True
+    # Saves the cache to its file, through a temporary file so a crash mid-write can't corrupt it.
+    def save(self):
+        temporaryFilePath = self.cacheFilePath.with_suffix(".tmp")
+        with open(temporaryFilePath,"w") as f:
+            json.dump({"Addresses": self.addresses},f,indent=4)
+        temporaryFilePath.replace(self.cacheFilePath)
+        self.__unsavedUsage = False
+    # Saves the cache only if hits have updated usage stamps since the last save.
+    def saveUsage(self):
+        if self.__unsavedUsage:
+            self.save()
+
+    #endregion === Persistence ===
+
+addressValidationCache = AddressValidationCache()
+atexit.register(addressValidationCache.saveUsage)
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+
+
+# This class stores a local, persistent index of Baka orders read from the order history, keyed by reference number,
+# so that Bell order lookups within a batch don't each need their own trip through the order history.
+class BakaOrderIndex:
+
+    def __init__(self,indexFilePath=None):
+        self.indexFilePath = indexFilePath if indexFilePath else paths["cache"] / "baka_order_index.json"
+        self.orders = {}
+        self.lastSync = None
+
+        self.load()
+
+    # Simple getter methods for accessing object like a dictionary.
+    def __getitem__(self, item):
+        return self.orders[str(item).strip().upper()]
+    def __contains__(self, item):
+        return str(item).strip().upper() in self.orders.keys()
+    def get(self,orderNumber,default=None):
+        return self.orders.get(str(orderNumber).strip().upper(),default)
+
+    # Adder method for storing a read order.
+    def addOrder(self,orderNumber,orderDict : dict):
+        self.orders[str(orderNumber).strip().upper()] = orderDict
+
+    # Marks the index as freshly synced.
+    def markSynced(self):
+        self.lastSync = datetime.now()
+    # Returns True if the index hasn't been synced in the last maxAgeSeconds.
+    def isStale(self,maxAgeSeconds):
+        return self.lastSync is None or (datetime.now() - self.lastSync).total_seconds() > maxAgeSeconds
+
+    #region === Persistence ===
+
+    # Loads the index from its file, if it exists.
+    def load(self):
+        if not self.indexFilePath.exists():
+            return False
+        try:
+            with open(self.indexFilePath,"r") as f:
+                rawIndex = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"Couldn't load Baka order index from '{self.indexFilePath}', starting fresh: {e}")
+            return False
+
+        self.orders = rawIndex.get("Orders",{})
+        self.lastSync = datetime.fromisoformat(rawIndex["LastSync"]) if rawIndex.get("LastSync") else None
+        return True
+    # Saves the index to its file.
+    def save(self):
+        rawIndex = {"LastSync": self.lastSync.isoformat() if self.lastSync else None,
+                    "Orders": self.orders}
+        with open(self.indexFilePath,"w") as f:
+            json.dump(rawIndex,f,indent=4)
+
+    #endregion === Persistence ===
+
+bakaOrderIndex = BakaOrderIndex()
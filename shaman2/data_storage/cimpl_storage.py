@@ -109,9 +109,9 @@ class CimplWO:
                     log.error(_error)
                     raise _error
                 else:
-                    # If the user makes changes, reload the cimpl mappings program-wide to accommodate new changes and
+                    # If the user makes changes, sync just the cimpl mappings program-wide to accommodate new changes and
                     # try to read it again.
-                    syscoData.reload()
+                    syscoData.reload(tabName="CimplMappings",incremental=True,requiredKey=cleanedHardwareName)
                     return getSafeHardwareMapping(hardwareName=hardwareName,hardwareType=hardwareType)
 
         # First, we build simple lists of all devices and accessories that are requested in the hardware info,
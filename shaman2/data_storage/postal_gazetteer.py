@@ -0,0 +1,320 @@
+import csv
+import mmap
+import random
+import re
+import struct
+import time
+import zlib
+from collections import Counter
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+
+
+# Layout of the packed gazetteer file. Everything is little endian:
+#   Header        - magic, version, regionCount, then the offsets of each section and the city record count, then
+#                   which source the file was built from (shipped or refreshed) and the CRC32 of the shipped CSV.
+#   Region table  - regionCount records of (string offset, string length), each string being "Code|Name|Country".
+#   Zip3 table    - 1000 bytes, one region index per US zip3 prefix (000-999).
+#   FSA table     - 6760 bytes, one region index per Canadian FSA (letter, digit, letter).
+#   City index    - cityCount records of (5 byte postal key, string offset, string length), sorted by postal key,
+#                   each string being "City1|City2|...".
+#   Strings       - every string above, as one UTF-8 blob.
+# Region index 255 means the prefix is unknown.
+GAZETTEER_MAGIC = b"SHGZ"
+GAZETTEER_VERSION = 2
+GAZETTEER_HEADER = struct.Struct("<4sHHIIIIIIBI")
+GAZETTEER_SOURCE_SHIPPED = 0
+GAZETTEER_SOURCE_REFRESHED = 1
+GAZETTEER_REGION_RECORD = struct.Struct("<IH")
+GAZETTEER_CITY_RECORD = struct.Struct("<5sIH")
+UNKNOWN_REGION_INDEX = 255
+ZIP3_TABLE_SIZE = 1000
+FSA_TABLE_SIZE = 26 * 10 * 26
+
+# Helper functions to convert a US zip3 or Canadian FSA into its position in the packed tables.
+def zip3ToIndex(zip3 : str):
+    return int(zip3)
+def fsaToIndex(fsa : str):
+    return (ord(fsa[0]) - 65) * 260 + int(fsa[1]) * 26 + (ord(fsa[2]) - 65)
+def indexToFSA(fsaIndex : int):
+    return f"{chr(65 + fsaIndex // 260)}{fsaIndex % 260 // 26}{chr(65 + fsaIndex % 26)}"
+
+# Cleans any US zip (12345, 12345-6789, 2134) or Canadian postal code (M5V 3L9, m5v3l9, M5V) into a tuple of
+# (country, prefix, postalKey), where postalKey is the full zip or FSA used for city lookups. Returns None if the
+# given string isn't recognizable as either.
+def parsePostalCode(postalCode):
+    postalCode = re.sub(r"[\s-]","",str(postalCode).strip().upper())
+    usMatch = re.fullmatch(r"(\d{3,5})(\d{4})?",postalCode)
+    if usMatch:
+        zipCode = usMatch.group(1).zfill(5)
+        return "US", zipCode[:3], zipCode
+    canadaMatch = re.fullmatch(r"([A-Z]\d[A-Z])(\d[A-Z]\d)?",postalCode)
+    if canadaMatch:
+        return "CA", canadaMatch.group(1), canadaMatch.group(1)
+    return None
+
+
+# This class is an offline US/Canada postal code gazetteer, mapping zip3 prefixes and Canadian FSAs to their
+# state/province (and optionally full zips and FSAs to their cities) without any network calls. The data lives in a
+# compact packed binary file that's memory-mapped, so loading is near-instant and each lookup is a single table read.
+#
+# The packed file is built from sourceFilePath (a CSV of prefix ranges shipped in assets), and rebuilt automatically
+# whenever that CSV's contents change. Use refresh() to rebuild it from GeoNames postal code dumps, which adds city
+# lists - a refreshed file is marked as such in its header, and is never replaced by an automatic shipped rebuild.
+class PostalGazetteer:
+
+    def __init__(self,gazetteerFilePath=None,sourceFilePath=None):
+        self.gazetteerFilePath = gazetteerFilePath if gazetteerFilePath else paths["cache"] / "postal_gazetteer.bin"
+        self.sourceFilePath = sourceFilePath if sourceFilePath else paths["assets"] / "gazetteer" / "postal_prefixes.csv"
+
+        self.regions = []
+        self.cityCount = 0
+        self.__file = None
+        self.__mappedFile = None
+        self.__zip3Offset = None
+        self.__fsaOffset = None
+        self.__cityIndexOffset = None
+        self.__stringsOffset = None
+
+        self.load()
+
+    #region === Lookups ===
+
+    # Returns the two letter state/province code (like "TX" or "ON") for the given postal code, or None if unknown.
+    def getRegionCode(self,postalCode):
+        region = self.__getRegion(postalCode)
+        return region[0] if region else None
+    # Returns the full state/province name (like "Texas" or "Ontario") for the given postal code, or None if unknown.
+    def getRegionName(self,postalCode):
+        region = self.__getRegion(postalCode)
+        return region[1] if region else None
+    # Returns the country code ("US" or "CA") for the given postal code, or None if unknown.
+    def getCountry(self,postalCode):
+        region = self.__getRegion(postalCode)
+        return region[2] if region else None
+    # Returns the list of cities for the given full zip (or Canadian FSA). Empty if the gazetteer has no city data
+    # for it, which is always the case until refresh() has been run with a GeoNames dump.
+    def getCities(self,postalCode):
+        parsedPostalCode = parsePostalCode(postalCode)
+        if parsedPostalCode is None or self.cityCount == 0:
+            return []
+        postalKey = parsedPostalCode[2].encode("ascii").ljust(5)
+
+        lowIndex, highIndex = 0, self.cityCount
+        while lowIndex < highIndex:
+            middleIndex = (lowIndex + highIndex) // 2
+            recordKey, stringOffset, stringLength = GAZETTEER_CITY_RECORD.unpack_from(self.__mappedFile,self.__cityIndexOffset + middleIndex * GAZETTEER_CITY_RECORD.size)
+            if recordKey < postalKey:
+                lowIndex = middleIndex + 1
+            elif recordKey > postalKey:
+                highIndex = middleIndex
+            else:
+                return self.__readString(stringOffset,stringLength).split("|")
+        return []
+
+    # Helper method that returns the (code, name, country) of the region for the given postal code.
+    def __getRegion(self,postalCode):
+        parsedPostalCode = parsePostalCode(postalCode)
+        if parsedPostalCode is None:
+            return None
+        country, prefix, _ = parsedPostalCode
+        if country == "US":
+            regionIndex = self.__mappedFile[self.__zip3Offset + zip3ToIndex(prefix)]
+        else:
+            regionIndex = self.__mappedFile[self.__fsaOffset + fsaToIndex(prefix)]
+        return self.regions[regionIndex] if regionIndex != UNKNOWN_REGION_INDEX else None
+    # Helper method to read a single string from the strings section.
+    def __readString(self,stringOffset,stringLength):
+        return self.__mappedFile[self.__stringsOffset + stringOffset:self.__stringsOffset + stringOffset + stringLength].decode("utf-8")
+
+    #endregion === Lookups ===
+
+    #region === Building ===
+
+    # Rebuilds the packed gazetteer from one or more GeoNames postal code dumps (the tab separated US.txt and CA.txt
+    # from download.geonames.org/export/zip), layered on top of the shipped prefix ranges. Each prefix takes the region
+    # most of its postal codes fall in, and every zip/FSA gets its list of cities.
+    def refresh(self,dataFilePaths : list):
+        prefixRegions = self.__readSourcePrefixRegions()
+        regionNames = self.__readSourceRegionNames()
+        prefixRegionVotes = {}
+        postalCities = {}
+        for dataFilePath in dataFilePaths:
+            with open(dataFilePath,"r",encoding="utf-8") as f:
+                for row in csv.reader(f,delimiter="\t"):
+                    if len(row) < 5 or not row[4]:
+                        continue
+                    parsedPostalCode = parsePostalCode(row[1])
+                    if parsedPostalCode is None or parsedPostalCode[0] != row[0].strip().upper():
+                        continue
+                    country, prefix, postalKey = parsedPostalCode
+                    regionKey = (row[4].strip().upper(),country)
+                    # Some dumps use numeric admin codes, so these are matched to a known region by name instead.
+                    if not re.fullmatch(r"[A-Z]{2}",regionKey[0]):
+                        regionKey = next((knownRegionKey for knownRegionKey,regionName in regionNames.items()
+                                          if knownRegionKey[1] == country and regionName.lower() == row[3].strip().lower()),None)
+                        if regionKey is None:
+                            continue
+                    regionNames.setdefault(regionKey,row[3].strip())
+                    prefixRegionVotes.setdefault((country,prefix),Counter())[regionKey] += 1
+                    thisPostalCities = postalCities.setdefault(postalKey,[])
+                    if row[2].strip() and row[2].strip() not in thisPostalCities:
+                        thisPostalCities.append(row[2].strip())
+
+        for (country,prefix),regionVotes in prefixRegionVotes.items():
+            prefixRegions[(country,prefix)] = regionVotes.most_common(1)[0][0]
+
+        self.close()
+        self.__writeGazetteerFile(prefixRegions=prefixRegions,regionNames=regionNames,postalCities=postalCities,
+                                  sourceType=GAZETTEER_SOURCE_REFRESHED)
+        log.info(f"Refreshed postal gazetteer with {len(prefixRegions)} prefixes and {len(postalCities)} city lists.")
+        self.load()
+
+    # Helper method that reads the shipped prefix ranges into a dict of (country, prefix) -> (regionCode, country).
+    def __readSourcePrefixRegions(self):
+        prefixRegions = {}
+        with open(self.sourceFilePath,"r",encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                country = row["Country"].strip().upper()
+                regionKey = (row["RegionCode"].strip().upper(),country)
+                if country == "US":
+                    for prefixIndex in range(zip3ToIndex(row["PrefixStart"]),zip3ToIndex(row["PrefixEnd"]) + 1):
+                        prefixRegions[(country,f"{prefixIndex:03}")] = regionKey
+                else:
+                    for prefixIndex in range(fsaToIndex(row["PrefixStart"].upper()),fsaToIndex(row["PrefixEnd"].upper()) + 1):
+                        prefixRegions[(country,indexToFSA(prefixIndex))] = regionKey
+        return prefixRegions
+    # Helper method that reads the shipped region names into a dict of (regionCode, country) -> regionName.
+    def __readSourceRegionNames(self):
+        with open(self.sourceFilePath,"r",encoding="utf-8") as f:
+            return {(row["RegionCode"].strip().upper(),row["Country"].strip().upper()): row["RegionName"].strip()
+                    for row in csv.DictReader(f)}
+    # Helper method that returns the CRC32 of the shipped CSV, used to tell whether it's changed since the last build.
+    def __readSourceChecksum(self):
+        return zlib.crc32(self.sourceFilePath.read_bytes()) if self.sourceFilePath.exists() else 0
+
+    # Helper method that packs the given data into the gazetteer file format described at the top of this file.
+    def __writeGazetteerFile(self,prefixRegions : dict,regionNames : dict,postalCities : dict = None,outputFilePath=None,
+                             sourceType=GAZETTEER_SOURCE_SHIPPED):
+        postalCities = postalCities if postalCities else {}
+        outputFilePath = outputFilePath if outputFilePath else self.gazetteerFilePath
+        regionKeys = sorted(set(prefixRegions.values()) | set(regionNames.keys()))
+        if len(regionKeys) >= UNKNOWN_REGION_INDEX:
+            error = ValueError(f"Postal gazetteer can't hold more than {UNKNOWN_REGION_INDEX - 1} regions (got {len(regionKeys)}).")
+            log.error(error)
+            raise error
+        regionIndices = {regionKey: regionIndex for regionIndex,regionKey in enumerate(regionKeys)}
+
+        strings = bytearray()
+        def addString(stringValue):
+            encodedString = stringValue.encode("utf-8")
+            stringOffset = len(strings)
+            strings.extend(encodedString)
+            return stringOffset, len(encodedString)
+
+        regionTable = bytearray()
+        for regionCode,country in regionKeys:
+            regionTable.extend(GAZETTEER_REGION_RECORD.pack(*addString(f"{regionCode}|{regionNames.get((regionCode,country),regionCode)}|{country}")))
+
+        zip3Table = bytearray([UNKNOWN_REGION_INDEX] * ZIP3_TABLE_SIZE)
+        fsaTable = bytearray([UNKNOWN_REGION_INDEX] * FSA_TABLE_SIZE)
+        for (country,prefix),regionKey in prefixRegions.items():
+            if country == "US":
+                zip3Table[zip3ToIndex(prefix)] = regionIndices[regionKey]
+            else:
+                fsaTable[fsaToIndex(prefix)] = regionIndices[regionKey]
+
+        cityIndex = bytearray()
+        for postalKey in sorted(postalCities.keys()):
+            cityIndex.extend(GAZETTEER_CITY_RECORD.pack(postalKey.encode("ascii").ljust(5),*addString("|".join(postalCities[postalKey]))))
+
+        regionTableOffset = GAZETTEER_HEADER.size
+        zip3Offset = regionTableOffset + len(regionTable)
+        fsaOffset = zip3Offset + len(zip3Table)
+        cityIndexOffset = fsaOffset + len(fsaTable)
+        stringsOffset = cityIndexOffset + len(cityIndex)
+        header = GAZETTEER_HEADER.pack(GAZETTEER_MAGIC,GAZETTEER_VERSION,len(regionKeys),regionTableOffset,zip3Offset,
+                                       fsaOffset,len(postalCities),cityIndexOffset,stringsOffset,sourceType,
+                                       self.__readSourceChecksum())
+
+        temporaryFilePath = outputFilePath.with_suffix(".tmp")
+        with open(temporaryFilePath,"wb") as f:
+            f.write(header + regionTable + zip3Table + fsaTable + cityIndex + strings)
+        temporaryFilePath.replace(outputFilePath)
+
+    #endregion === Building ===
+
+    #region === Benchmarking ===
+
+    # Times a build of the gazetteer from the shipped source (to a scratch file, so any refreshed data is kept), a cold
+    # load of the current gazetteer file, and lookupCount random state lookups, returning a simple report string.
+    def benchmark(self,lookupCount=100000,seed=0):
+        scratchFilePath = self.gazetteerFilePath.with_suffix(".benchmark")
+        startTime = time.perf_counter()
+        self.__writeGazetteerFile(prefixRegions=self.__readSourcePrefixRegions(),regionNames=self.__readSourceRegionNames(),
+                                  outputFilePath=scratchFilePath)
+        buildTime = time.perf_counter() - startTime
+        scratchFilePath.unlink()
+
+        self.close()
+        startTime = time.perf_counter()
+        self.load()
+        loadTime = time.perf_counter() - startTime
+
+        seededRandom = random.Random(seed)
+        postalCodes = [f"{seededRandom.randrange(100000):05}" if seededRandom.random() < 0.8 else
+                       f"{indexToFSA(seededRandom.randrange(FSA_TABLE_SIZE))} {seededRandom.randrange(10)}A{seededRandom.randrange(10)}"
+                       for _ in range(lookupCount)]
+        startTime = time.perf_counter()
+        resolvedCount = sum(1 for postalCode in postalCodes if self.getRegionCode(postalCode) is not None)
+        lookupTime = time.perf_counter() - startTime
+
+        return (f"Postal gazetteer: built in {buildTime * 1000:.2f}ms, loaded in {loadTime * 1000:.2f}ms, "
+                f"{lookupCount} lookups in {lookupTime * 1000:.2f}ms ({lookupTime / lookupCount * 1000000:.2f}us each, "
+                f"{resolvedCount} resolved). File size: {self.gazetteerFilePath.stat().st_size} bytes.")
+
+    #endregion === Benchmarking ===
+
+    #region === Persistence ===
+
+    # Maps the packed gazetteer file into memory, first (re)building it from the shipped source if it's missing, from
+    # an older format version, or was built from a shipped CSV that has since changed. Refreshed files are kept as-is.
+    def load(self):
+        if not self.gazetteerFilePath.exists():
+            self.__writeGazetteerFile(prefixRegions=self.__readSourcePrefixRegions(),regionNames=self.__readSourceRegionNames())
+
+        self.__file = open(self.gazetteerFilePath,"rb")
+        self.__mappedFile = mmap.mmap(self.__file.fileno(),0,access=mmap.ACCESS_READ)
+        (magic, version, regionCount, regionTableOffset, self.__zip3Offset, self.__fsaOffset,
+         self.cityCount, self.__cityIndexOffset, self.__stringsOffset, sourceType, sourceChecksum) = GAZETTEER_HEADER.unpack_from(self.__mappedFile,0)
+        if magic != GAZETTEER_MAGIC or version != GAZETTEER_VERSION:
+            log.warning(f"Postal gazetteer at '{self.gazetteerFilePath}' is outdated or corrupt, rebuilding it.")
+            self.close()
+            self.gazetteerFilePath.unlink()
+            return self.load()
+        if sourceChecksum != self.__readSourceChecksum() and self.sourceFilePath.exists():
+            if sourceType == GAZETTEER_SOURCE_SHIPPED:
+                log.info(f"Shipped postal prefixes at '{self.sourceFilePath}' have changed, rebuilding the postal gazetteer.")
+                self.close()
+                self.gazetteerFilePath.unlink()
+                return self.load()
+            log.info(f"Shipped postal prefixes at '{self.sourceFilePath}' have changed since the postal gazetteer was "
+                     f"refreshed. Keeping the refreshed data - run refresh() again to layer it onto the new prefixes.")
+
+        self.regions = []
+        for regionIndex in range(regionCount):
+            stringOffset, stringLength = GAZETTEER_REGION_RECORD.unpack_from(self.__mappedFile,regionTableOffset + regionIndex * GAZETTEER_REGION_RECORD.size)
+            self.regions.append(tuple(self.__readString(stringOffset,stringLength).split("|")))
+        return True
+    # Unmaps the gazetteer file, so that it can be rebuilt.
+    def close(self):
+        if self.__mappedFile is not None:
+            self.__mappedFile.close()
+            self.__mappedFile = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    #endregion === Persistence ===
+
+postalGazetteer = PostalGazetteer()
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+
+
+# This class stores a local, persistent index of Rogers "Order ... Closed" emails from the SysOrdBox, keyed by order
+# number, so that Rogers order lookups don't each need their own Outlook search.
+class RogersOrderIndex:
+
+    def __init__(self,indexFilePath=None):
+        self.indexFilePath = indexFilePath if indexFilePath else paths["cache"] / "rogers_order_index.json"
+        self.orders = {}
+        self.indexedConvIDs = set()
+        self.lastSync = None
+
+        self.load()
+
+    # Simple getter methods for accessing object like a dictionary.
+    def __getitem__(self, item):
+        return self.orders[str(item)]
+    def __contains__(self, item):
+        return str(item) in self.orders.keys()
+    def get(self,orderNumber,default=None):
+        return self.orders.get(str(orderNumber),default)
+
+    # Adder method for storing a parsed order, along with the ConvID of the email it was read from.
+    def addOrder(self,orderNumber,orderDict : dict,convID=None):
+        self.orders[str(orderNumber)] = orderDict
+        if convID:
+            self.indexedConvIDs.add(convID)
+    # Simply returns whether the email with the given ConvID has already been read into the index.
+    def hasConvID(self,convID):
+        return convID in self.indexedConvIDs
+
+    # Marks the index as freshly synced.
+    def markSynced(self):
+        self.lastSync = datetime.now()
+    # Returns True if the index hasn't been synced in the last maxAgeSeconds.
+    def isStale(self,maxAgeSeconds):
+        return self.lastSync is None or (datetime.now() - self.lastSync).total_seconds() > maxAgeSeconds
+
+    #region === Persistence ===
+
+    # Loads the index from its file, if it exists.
+    def load(self):
+        if not self.indexFilePath.exists():
+            return False
+        try:
+            with open(self.indexFilePath,"r") as f:
+                rawIndex = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"Couldn't load Rogers order index from '{self.indexFilePath}', starting fresh: {e}")
+            return False
+
+        self.orders = rawIndex.get("Orders",{})
+        self.indexedConvIDs = set(rawIndex.get("IndexedConvIDs",[]))
+        self.lastSync = datetime.fromisoformat(rawIndex["LastSync"]) if rawIndex.get("LastSync") else None
+        return True
+    # Saves the index to its file.
+    def save(self):
+        rawIndex = {"LastSync": self.lastSync.isoformat() if self.lastSync else None,
+                    "IndexedConvIDs": sorted(self.indexedConvIDs),
+                    "Orders": self.orders}
+        with open(self.indexFilePath,"w") as f:
+            json.dump(rawIndex,f,indent=4)
+
+    #endregion === Persistence ===
+
+rogersOrderIndex = RogersOrderIndex()
@@ -0,0 +1,165 @@
+from collections.abc import Mapping
+from datetime import datetime
+import hashlib
+import json
+from fnmatch import fnmatch
+from shaman2.common.logger import log
+
+
+# Helper functions to coerce a single raw sheet string into each supported column type.
+def coerceStr(rawValue : str):
+    return rawValue
+def coerceBool(rawValue : str):
+    return rawValue.strip().upper() == "TRUE"
+def coerceList(rawValue : str):
+    return [item.strip() for item in rawValue.split(",") if item.strip()]
+def coerceDate(rawValue : str):
+    for dateFormat in ("%m/%d/%Y","%Y-%m-%d"):
+        try:
+            return datetime.strptime(rawValue.strip(),dateFormat)
+        except ValueError:
+            pass
+    return None
+def coerceInt(rawValue : str):
+    try:
+        return int(rawValue.strip())
+    except ValueError:
+        return None
+def coerceFloat(rawValue : str):
+    try:
+        return float(rawValue.strip().replace(",","").lstrip("$"))
+    except ValueError:
+        return None
+COLUMN_TYPE_COERCERS = {"str": coerceStr, "bool": coerceBool, "list": coerceList, "date": coerceDate,
+                        "int": coerceInt, "float": coerceFloat}
+
+# Returns a stable content hash of a single raw sheet row, ignoring trailing empty cells (which the Sheets API omits).
+def hashRawRow(row : list):
+    row = [str(value) for value in row]
+    while row and row[-1] == "":
+        row.pop()
+    return hashlib.sha1(json.dumps(row).encode("utf-8")).hexdigest()
+
+
+# A single row of a SheetTable. Rows are lightweight views into the table's columns (nothing is copied), and behave
+# like a read-only dictionary of header -> value.
+class SheetRow(Mapping):
+
+    __slots__ = ("__table","__rowIndex")
+
+    def __init__(self,table,rowIndex : int):
+        self.__table = table
+        self.__rowIndex = rowIndex
+
+    def __getitem__(self, item):
+        return self.__table.getCell(rowIndex=self.__rowIndex,columnName=item)
+    def __iter__(self):
+        return iter(self.__table.headers)
+    def __len__(self):
+        return len(self.__table.headers)
+    def __repr__(self):
+        return f"SheetRow({self.toDict()})"
+
+    # Returns a plain dict copy of this row.
+    def toDict(self):
+        return {header: self[header] for header in self.__table.headers}
+
+
+# This class stores a full sheet column-wise (one list per column), with every value coerced to its column's type
+# once at load, and an optional hash index on a unique key column. It behaves like the dict-of-dicts that
+# SheetSync.getFullSheet returns with a keyColumn (key -> row) if a keyColumn is given, or like a list of rows if not.
+#
+# columnTypes maps column names (or fnmatch patterns, like "Available (*)") to one of the COLUMN_TYPE_COERCERS. Any
+# column that isn't matched stays a plain string.
+class SheetTable(Mapping):
+
+    def __init__(self,headers : list,rows : list = None,keyColumn : str = None,columnTypes : dict = None):
+        self.headers = list(headers)
+        self.keyColumn = keyColumn
+        self.columnTypes = columnTypes if columnTypes else {}
+
+        self.__columnIndices = {header: index for index,header in enumerate(self.headers)}
+        self.__coercers = [COLUMN_TYPE_COERCERS[self.getColumnType(header)] for header in self.headers]
+        self.columns = [[] for _ in self.headers]
+        self.__keyIndex = {}
+        self.rowCount = 0
+        # Tracks the raw rows read from the sheet (which can differ from rowCount when keys repeat), and the hash of
+        # the last one, so callers can detect whether the sheet changed beyond simple appends.
+        self.rawRowCount = 0
+        self.lastRawRowHash = None
+
+        if keyColumn is not None and keyColumn not in self.__columnIndices:
+            error = ValueError(f"Key column '{keyColumn}' isn't a header of this sheet.")
+            log.error(error)
+            raise error
+
+        self.appendRows(rows if rows else [])
+
+    # Returns the type name for the given column, matching columnTypes exactly first, then by pattern.
+    def getColumnType(self,columnName):
+        if columnName in self.columnTypes:
+            return self.columnTypes[columnName]
+        for pattern,columnType in self.columnTypes.items():
+            if fnmatch(columnName,pattern):
+                return columnType
+        return "str"
+
+    #region === Access ===
+
+    # With a keyColumn, the table is accessed like a dict of key -> row. Otherwise, it's accessed like a list of rows.
+    def __getitem__(self, item):
+        if self.keyColumn is None:
+            if item < 0:
+                item += self.rowCount
+            if not 0 <= item < self.rowCount:
+                raise IndexError(item)
+            return SheetRow(self,item)
+        return SheetRow(self,self.__keyIndex[item])
+    def __iter__(self):
+        if self.keyColumn is None:
+            return (SheetRow(self,rowIndex) for rowIndex in range(self.rowCount))
+        return iter(self.__keyIndex)
+    def __len__(self):
+        return self.rowCount
+    def __contains__(self, item):
+        if self.keyColumn is None:
+            return any(row == item for row in self)
+        return item in self.__keyIndex
+
+    # Returns the coerced value at the given row and column.
+    def getCell(self,rowIndex : int,columnName : str):
+        return self.columns[self.__columnIndices[columnName]][rowIndex]
+    # Returns the full list of coerced values for the given column.
+    def getColumn(self,columnName : str):
+        return self.columns[self.__columnIndices[columnName]]
+    # Returns a view of the row at the given (0-based, below the header) position, regardless of keyColumn.
+    def getRow(self,rowIndex : int):
+        return SheetRow(self,rowIndex)
+
+    #endregion === Access ===
+
+    #region === Updating ===
+
+    # Appends the given raw rows (lists of strings, in header order) to the table, coercing each value and updating
+    # the key index. Rows with a key that already exists replace the existing row in place.
+    def appendRows(self,rows : list):
+        keyColumnIndex = self.__columnIndices[self.keyColumn] if self.keyColumn is not None else None
+        for row in rows:
+            self.rawRowCount += 1
+            self.lastRawRowHash = hashRawRow(row)
+            coercedRow = [self.__coercers[columnIndex](row[columnIndex] if columnIndex < len(row) else "")
+                          for columnIndex in range(len(self.headers))]
+
+            if keyColumnIndex is not None and coercedRow[keyColumnIndex] in self.__keyIndex:
+                existingRowIndex = self.__keyIndex[coercedRow[keyColumnIndex]]
+                for columnIndex,value in enumerate(coercedRow):
+                    self.columns[columnIndex][existingRowIndex] = value
+                continue
+
+            for columnIndex,value in enumerate(coercedRow):
+                self.columns[columnIndex].append(value)
+            if keyColumnIndex is not None:
+                self.__keyIndex[coercedRow[keyColumnIndex]] = self.rowCount
+            self.rowCount += 1
+
+    #endregion === Updating ===
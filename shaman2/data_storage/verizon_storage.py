@@ -0,0 +1,196 @@
+import json
+from datetime import datetime
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+from shaman2.data_storage.postal_gazetteer import postalGazetteer
+
+
+# This class stores a local, persistent cache of Verizon product pages for each deviceID and accessoryID, so that
+# orders can load a product directly instead of searching the catalog for it every time.
+class VerizonCatalogCache:
+
+    def __init__(self,cacheFilePath=None,maxAgeDays=14):
+        self.cacheFilePath = cacheFilePath if cacheFilePath else paths["cache"] / "verizon_catalog.json"
+        self.maxAgeDays = maxAgeDays
+        self.catalog = {"Devices": {}, "Accessories": {}}
+
+        self.load()
+
+    # Getter methods for cached product entries, which return None if the product isn't cached or is stale. Devices
+    # are cached separately per orderPath, as NewInstall and Upgrade product pages differ.
+    def getDevice(self,deviceID,orderPath="NewInstall"):
+        return self.__getFreshEntry(self.catalog["Devices"].get(deviceID,{}).get(orderPath))
+    def getAccessory(self,accessoryID):
+        return self.__getFreshEntry(self.catalog["Accessories"].get(accessoryID))
+
+    # Adder methods for recording a product's page, along with its SKU and selected options.
+    def addDevice(self,deviceID,url,orderPath="NewInstall",sku=None,color=None,size=None):
+        self.catalog["Devices"].setdefault(deviceID,{})[orderPath] = {"URL": url, "SKU": sku, "Color": color, "Size": size,
+                                                                      "Cached": datetime.now().isoformat()}
+        self.save()
+    def addAccessory(self,accessoryID,url,sku=None,color=None):
+        self.catalog["Accessories"][accessoryID] = {"URL": url, "SKU": sku, "Color": color, "Cached": datetime.now().isoformat()}
+        self.save()
+
+    # Records the color and size that were selected for an already cached device.
+    def setDeviceOptions(self,deviceID,orderPath="NewInstall",color=None,size=None):
+        cachedDevice = self.catalog["Devices"].get(deviceID,{}).get(orderPath)
+        if cachedDevice and (cachedDevice.get("Color") != color or cachedDevice.get("Size") != size):
+            cachedDevice["Color"] = color
+            cachedDevice["Size"] = size
+            self.save()
+
+    # Removal methods, used when a cached product page fails to load so that the next order searches for it again.
+    def removeDevice(self,deviceID,orderPath="NewInstall"):
+        if self.catalog["Devices"].get(deviceID,{}).pop(orderPath,None):
+            log.info(f"Removed stale Verizon catalog entry for device '{deviceID}' ({orderPath}).")
+            self.save()
+    def removeAccessory(self,accessoryID):
+        if self.catalog["Accessories"].pop(accessoryID,None):
+            log.info(f"Removed stale Verizon catalog entry for accessory '{accessoryID}'.")
+            self.save()
+
+    #region === Helpers ===
+
+    # Returns the given entry only if it was cached within maxAgeDays.
+    def __getFreshEntry(self,entry):
+        if not entry:
+            return None
+        if (datetime.now() - datetime.fromisoformat(entry["Cached"])).days >= self.maxAgeDays:
+            return None
+        return entry
+
+    #endregion === Helpers ===
+
+    #region === Persistence ===
+
+    # Loads the catalog from its file, if it exists.
+    def load(self):
+        if not self.cacheFilePath.exists():
+            return False
+        try:
+            with open(self.cacheFilePath,"r") as f:
+                rawCatalog = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"Couldn't load Verizon catalog cache from '{self.cacheFilePath}', starting fresh: {e}")
+            return False
+
+        self.catalog["Devices"] = rawCatalog.get("Devices",{})
+        self.catalog["Accessories"] = rawCatalog.get("Accessories",{})
+        return True
+    # Saves the catalog to its file.
+    def save(self):
+        with open(self.cacheFilePath,"w") as f:
+            json.dump(self.catalog,f,indent=4)
+
+    #endregion === Persistence ===
+
+verizonCatalog = VerizonCatalogCache()
+
+
+# This class stores a learned, persistent cache of which area codes Verizon offers for each zip code, and which nearby
+# zip codes have worked as fallbacks for zips that had no numbers available. Also tracks the hit/miss rate of the cache.
+class AreaCodeCache:
+
+    def __init__(self,cacheFilePath=None,sequentialFallbackRange=5,noNumbersExpiryDays=7):
+        self.cacheFilePath = cacheFilePath if cacheFilePath else paths["cache"] / "verizon_area_codes.json"
+        self.sequentialFallbackRange = sequentialFallbackRange
+        self.noNumbersExpiryDays = noNumbersExpiryDays
+        self.zips = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    # Returns the ordered list of zip codes to try for the given zipCode: the zip itself (unless it's known to have no
+    # numbers), then its learned fallbacks, then known-good zips sharing its zip3 prefix, and finally sequential zips
+    # within the same state.
+    def getCandidateZips(self,zipCode):
+        zipCode = str(zipCode).split("-")[0].strip().zfill(5)
+        thisZip = self.zips.get(zipCode,{})
+
+        candidateZips = [] if self.__hasNoNumbers(zipCode) else [zipCode]
+        candidateZips.extend(thisZip.get("Fallbacks",[]))
+        candidateZips.extend(sorted((cachedZip for cachedZip,cachedInfo in self.zips.items()
+                                     if cachedZip[:3] == zipCode[:3] and cachedInfo.get("AreaCodes") and not self.__hasNoNumbers(cachedZip)),
+                                    key=lambda cachedZip: abs(int(cachedZip) - int(zipCode))))
+        # Sequential zips are only tried if they're in the same state, which is checked locally through the gazetteer.
+        zipState = postalGazetteer.getRegionCode(zipCode)
+        for offset in range(1,self.sequentialFallbackRange + 1):
+            for sequentialZip in (int(zipCode) + offset, int(zipCode) - offset):
+                if 0 < sequentialZip < 100000 and (zipState is None or postalGazetteer.getRegionCode(f"{sequentialZip:05}") == zipState):
+                    candidateZips.append(f"{sequentialZip:05}")
+        # Zips recently seen with no numbers are skipped, unless there's nothing else left to try.
+        finalCandidateZips = []
+        for candidateZip in candidateZips:
+            if candidateZip not in finalCandidateZips and not self.__hasNoNumbers(candidateZip):
+                finalCandidateZips.append(candidateZip)
+        if not finalCandidateZips:
+            finalCandidateZips.append(zipCode)
+        return finalCandidateZips
+    # Returns the known-good area codes for the given zip, most recently used first.
+    def getAreaCodes(self,zipCode):
+        return list(self.zips.get(str(zipCode).zfill(5),{}).get("AreaCodes",[]))
+
+    # Records that the given areaCode was successfully selected for zipCode. If this was a fallback for originalZipCode,
+    # that's recorded as well.
+    def recordAreaCode(self,zipCode,areaCode,originalZipCode=None):
+        thisZip = self.zips.setdefault(str(zipCode).zfill(5),{})
+        thisZip["AreaCodes"] = [areaCode] + [cachedCode for cachedCode in thisZip.get("AreaCodes",[]) if cachedCode != areaCode]
+        thisZip["NoNumbers"] = False
+        thisZip["LastChecked"] = datetime.now().isoformat()
+        if originalZipCode and str(originalZipCode).zfill(5) != str(zipCode).zfill(5):
+            originalZip = self.zips.setdefault(str(originalZipCode).zfill(5),{})
+            originalZip["Fallbacks"] = [str(zipCode).zfill(5)] + [fallbackZip for fallbackZip in originalZip.get("Fallbacks",[]) if fallbackZip != str(zipCode).zfill(5)]
+        self.save()
+    # Records that Verizon reported no numbers available for the given zipCode.
+    def recordNoNumbers(self,zipCode):
+        thisZip = self.zips.setdefault(str(zipCode).zfill(5),{})
+        thisZip["NoNumbers"] = True
+        thisZip["LastChecked"] = datetime.now().isoformat()
+        self.save()
+
+    # Records whether a single area code lookup was a cache hit (the first zip and cached area code worked) or a miss.
+    def recordLookup(self,hit : bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+    # Returns a simple report string of this session's hit/miss rates.
+    def getStatsReport(self):
+        totalLookups = self.hits + self.misses
+        hitRate = (self.hits / totalLookups * 100) if totalLookups else 0
+        return f"Area code cache: {self.hits} hits, {self.misses} misses ({hitRate:.1f}% hit rate over {totalLookups} lookups)."
+
+    #region === Helpers ===
+
+    # Returns True if Verizon reported no numbers for the given zip within the last noNumbersExpiryDays.
+    def __hasNoNumbers(self,zipCode):
+        thisZip = self.zips.get(zipCode,{})
+        if not thisZip.get("NoNumbers"):
+            return False
+        return (datetime.now() - datetime.fromisoformat(thisZip["LastChecked"])).days < self.noNumbersExpiryDays
+
+    #endregion === Helpers ===
+
+    #region === Persistence ===
+
+    # Loads the cache from its file, if it exists.
+    def load(self):
+        if not self.cacheFilePath.exists():
+            return False
+        try:
+            with open(self.cacheFilePath,"r") as f:
+                self.zips = json.load(f).get("Zips",{})
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning(f"Couldn't load area code cache from '{self.cacheFilePath}', starting fresh: {e}")
+            return False
+        return True
+    # Saves the cache to its file.
+    def save(self):
+        with open(self.cacheFilePath,"w") as f:
+            json.dump({"Zips": self.zips},f,indent=4)
+
+    #endregion === Persistence ===
+
+areaCodeCache = AreaCodeCache()
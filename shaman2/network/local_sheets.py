@@ -0,0 +1,364 @@
+import collections
+import copy
+import json
+import random
+import re
+import threading
+import time
+import httplib2
+from googleapiclient.errors import HttpError
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+
+
+# Helper functions to convert between column letters and (1-based) column indices.
+def columnLetterToIndex(columnLetter : str):
+    columnIndex = 0
+    for character in columnLetter.upper():
+        columnIndex = columnIndex * 26 + (ord(character) - 64)
+    return columnIndex
+def columnIndexToLetter(columnIndex : int):
+    columnLetter = ""
+    while columnIndex > 0:
+        columnIndex, remainder = divmod(columnIndex - 1, 26)
+        columnLetter = chr(65 + remainder) + columnLetter
+    return columnLetter
+
+# Helper function to build the same HttpError that googleapiclient raises for a failed request.
+def buildHttpError(statusCode : int,message : str,status : str):
+    response = httplib2.Response({"status": statusCode})
+    response.reason = status
+    content = json.dumps({"error": {"code": statusCode,"message": message,"status": status}}).encode("utf-8")
+    return HttpError(resp=response,content=content)
+
+
+# A single deferred call against the local store. Like googleapiclient's HttpRequest, nothing happens until execute().
+class LocalSheetsRequest:
+
+    def __init__(self,service,methodName : str,isWrite : bool,function):
+        self.service = service
+        self.methodName = methodName
+        self.isWrite = isWrite
+        self.function = function
+
+    def execute(self):
+        return self.service.executeRequest(self)
+
+
+# Mirrors service.spreadsheets().values()
+class LocalSheetsValuesResource:
+
+    def __init__(self,service):
+        self.service = service
+
+    def get(self,spreadsheetId,range,majorDimension="ROWS",**kwargs):
+        return LocalSheetsRequest(self.service,"values.get",False,
+                                  lambda: self.service.getValues(spreadsheetId,range,majorDimension))
+    def batchGet(self,spreadsheetId,ranges,majorDimension="ROWS",**kwargs):
+        return LocalSheetsRequest(self.service,"values.batchGet",False,
+                                  lambda: {"spreadsheetId": spreadsheetId,
+                                           "valueRanges": [self.service.getValues(spreadsheetId,thisRange,majorDimension) for thisRange in ranges]})
+    def append(self,spreadsheetId,range,body,valueInputOption="USER_ENTERED",insertDataOption="INSERT_ROWS",**kwargs):
+        return LocalSheetsRequest(self.service,"values.append",True,
+                                  lambda: self.service.appendValues(spreadsheetId,range,body.get("values",[])))
+
+
+# Mirrors service.spreadsheets()
+class LocalSpreadsheetsResource:
+
+    def __init__(self,service):
+        self.service = service
+
+    def get(self,spreadsheetId,fields=None,**kwargs):
+        return LocalSheetsRequest(self.service,"spreadsheets.get",False,
+                                  lambda: self.service.getSpreadsheet(spreadsheetId,fields))
+    def batchUpdate(self,spreadsheetId,body,**kwargs):
+        return LocalSheetsRequest(self.service,"spreadsheets.batchUpdate",True,
+                                  lambda: self.service.batchUpdate(spreadsheetId,body.get("requests",[])))
+    def values(self):
+        return LocalSheetsValuesResource(self.service)
+
+
+# This class is an offline stand-in for the Google Sheets API service returned by buildSheetsAPIService, implementing
+# only the subset SheetSync uses (spreadsheets.get, values.get/batchGet/append and batchUpdate deleteDimension) over
+# a local JSON file. Every request can be delayed by a configurable latency, and rejected with a 429 (exactly like
+# Google) when it exceeds the configured per-minute read/write quotas or randomly at quotaErrorRate, so batching
+# and caching changes can be benchmarked reproducibly. Counts of every executed request are kept in requestCounts.
+class LocalSheetsService:
+
+    def __init__(self,storeFilePath=None,latency=0.0,latencyJitter=0.0,readQuotaPerMinute=None,writeQuotaPerMinute=None,
+                 quotaErrorRate=0.0,seed=None):
+        self.storeFilePath = storeFilePath if storeFilePath else paths["cache"] / "local_sheets.json"
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.readQuotaPerMinute = readQuotaPerMinute
+        self.writeQuotaPerMinute = writeQuotaPerMinute
+        self.quotaErrorRate = quotaErrorRate
+
+        self.storedSpreadsheets = {}
+        self.requestCounts = collections.Counter()
+        self.rejectedRequestCounts = collections.Counter()
+        self.__random = random.Random(seed)
+        self.__readTimes = collections.deque()
+        self.__writeTimes = collections.deque()
+        self.__lock = threading.RLock()
+
+        self.load()
+
+    def spreadsheets(self):
+        return LocalSpreadsheetsResource(self)
+
+    #region === Request Handling ===
+
+    # Executes the given request against the local store, applying latency and quota injection first.
+    def executeRequest(self,request : LocalSheetsRequest):
+        thisLatency = self.latency + (self.__random.uniform(0,self.latencyJitter) if self.latencyJitter else 0)
+        if thisLatency > 0:
+            time.sleep(thisLatency)
+
+        with self.__lock:
+            self.__checkQuota(request)
+            self.requestCounts[request.methodName] += 1
+            result = request.function()
+            if request.isWrite:
+                self.save()
+            return copy.deepcopy(result)
+
+    # Helper method that raises a 429 if this request would exceed its per-minute quota, or is randomly chosen to fail.
+    def __checkQuota(self,request : LocalSheetsRequest):
+        requestTimes = self.__writeTimes if request.isWrite else self.__readTimes
+        quotaPerMinute = self.writeQuotaPerMinute if request.isWrite else self.readQuotaPerMinute
+
+        currentTime = time.time()
+        while requestTimes and currentTime - requestTimes[0] > 60:
+            requestTimes.popleft()
+        if ((quotaPerMinute is not None and len(requestTimes) >= quotaPerMinute) or
+                (self.quotaErrorRate and self.__random.random() < self.quotaErrorRate)):
+            self.rejectedRequestCounts[request.methodName] += 1
+            raise buildHttpError(429,f"Quota exceeded for '{request.methodName}' on the local Sheets store.","RESOURCE_EXHAUSTED")
+        requestTimes.append(currentTime)
+
+    # Resets all request counts and quota windows, for use between benchmark runs.
+    def resetStats(self):
+        with self.__lock:
+            self.requestCounts.clear()
+            self.rejectedRequestCounts.clear()
+            self.__readTimes.clear()
+            self.__writeTimes.clear()
+
+    #endregion === Request Handling ===
+
+    #region === API Methods ===
+
+    # spreadsheets.get, with basic support for a fields mask like "sheets.properties".
+    def getSpreadsheet(self,spreadsheetID,fields=None):
+        spreadsheet = self.__getSpreadsheet(spreadsheetID)
+        response = {"spreadsheetId": spreadsheetID,
+                    "properties": {"title": spreadsheet["Title"]},
+                    "sheets": [{"properties": self.__getSheetProperties(sheet)} for sheet in spreadsheet["Sheets"]]}
+        if not fields:
+            return response
+
+        maskedResponse = {}
+        for fieldPath in fields.split(","):
+            self.__applyFieldMask(response,maskedResponse,fieldPath.strip().split("."))
+        return maskedResponse
+
+    # values.get, returning the same trimmed (no trailing empty cells or rows) response shape as Google.
+    def getValues(self,spreadsheetID,rangeString,majorDimension="ROWS"):
+        sheet, startRow, startColumn, endRow, endColumn = self.__parseRange(spreadsheetID,rangeString)
+        endRow = min(endRow,len(sheet["Values"])) if endRow is not None else len(sheet["Values"])
+        endColumn = endColumn if endColumn is not None else max([len(row) for row in sheet["Values"]] + [0])
+
+        values = [[row[columnIndex] if columnIndex < len(row) else "" for columnIndex in range(startColumn - 1,endColumn)]
+                  for row in sheet["Values"][startRow - 1:endRow]]
+        if majorDimension == "COLUMNS":
+            values = [list(column) for column in zip(*values)]
+        values = self.__trimValues(values)
+
+        response = {"range": self.__buildRangeString(sheet["Title"],startRow,startColumn,endRow,endColumn),
+                    "majorDimension": majorDimension}
+        if values:
+            response["values"] = values
+        return response
+
+    # values.append, always inserting the new rows directly below the last non-empty row of the sheet.
+    def appendValues(self,spreadsheetID,rangeString,values : list):
+        sheet, startRow, startColumn, endRow, endColumn = self.__parseRange(spreadsheetID,rangeString)
+        while sheet["Values"] and not any(str(value) for value in sheet["Values"][-1]):
+            sheet["Values"].pop()
+
+        firstNewRow = len(sheet["Values"]) + 1
+        for row in values:
+            sheet["Values"].append([""] * (startColumn - 1) + [self.__toCellString(value) for value in row])
+        sheet["RowCount"] = max(sheet["RowCount"],len(sheet["Values"]))
+        widestRow = max([len(row) for row in values] + [1])
+        sheet["ColumnCount"] = max(sheet["ColumnCount"],startColumn - 1 + widestRow)
+
+        updatedRange = self.__buildRangeString(sheet["Title"],firstNewRow,startColumn,len(sheet["Values"]),startColumn + widestRow - 1)
+        return {"spreadsheetId": spreadsheetID,
+                "tableRange": self.__buildRangeString(sheet["Title"],1,startColumn,firstNewRow - 1,startColumn + widestRow - 1),
+                "updates": {"spreadsheetId": spreadsheetID,"updatedRange": updatedRange,"updatedRows": len(values),
+                            "updatedCells": sum(len(row) for row in values)}}
+
+    # spreadsheets.batchUpdate. Only deleteDimension is supported, and requests are applied in order, like Google.
+    def batchUpdate(self,spreadsheetID,requests : list):
+        spreadsheet = self.__getSpreadsheet(spreadsheetID)
+        replies = []
+        for thisRequest in requests:
+            if "deleteDimension" not in thisRequest:
+                raise buildHttpError(400,f"Unsupported batchUpdate request on the local Sheets store: {list(thisRequest.keys())}","INVALID_ARGUMENT")
+            dimensionRange = thisRequest["deleteDimension"]["range"]
+            sheet = next((sheet for sheet in spreadsheet["Sheets"] if sheet["SheetID"] == dimensionRange["sheetId"]),None)
+            if sheet is None:
+                raise buildHttpError(400,f"No grid with id: {dimensionRange['sheetId']}","INVALID_ARGUMENT")
+
+            startIndex = dimensionRange.get("startIndex",0)
+            if dimensionRange["dimension"] == "ROWS":
+                endIndex = dimensionRange.get("endIndex",sheet["RowCount"])
+                del sheet["Values"][startIndex:endIndex]
+                sheet["RowCount"] -= min(endIndex,sheet["RowCount"]) - startIndex
+            else:
+                endIndex = dimensionRange.get("endIndex",sheet["ColumnCount"])
+                for row in sheet["Values"]:
+                    del row[startIndex:endIndex]
+                sheet["ColumnCount"] -= min(endIndex,sheet["ColumnCount"]) - startIndex
+            replies.append({})
+        return {"spreadsheetId": spreadsheetID,"replies": replies}
+
+    #endregion === API Methods ===
+
+    #region === Store Management ===
+
+    # Adds (or replaces) a spreadsheet in the local store, given a dict of sheetName -> list of row-lists.
+    def setSpreadsheet(self,spreadsheetID,sheets : dict,title="Local Spreadsheet"):
+        with self.__lock:
+            self.storedSpreadsheets[spreadsheetID] = {"Title": title,"Sheets": []}
+            for sheetIndex,(sheetName,values) in enumerate(sheets.items()):
+                values = [[self.__toCellString(value) for value in row] for row in values]
+                self.storedSpreadsheets[spreadsheetID]["Sheets"].append({"SheetID": sheetIndex,"Title": sheetName,"Values": values,
+                                                                   "RowCount": max(len(values),1000),
+                                                                   "ColumnCount": max([len(row) for row in values] + [26])})
+            self.save()
+    # Copies every tab of the given spreadsheet from a live Sheets service (like buildSheetsAPIService()) into the
+    # local store, so that it can be worked on offline.
+    def importSpreadsheet(self,sourceService,spreadsheetID):
+        sheetMetadata = sourceService.spreadsheets().get(spreadsheetId=spreadsheetID,fields="properties.title,sheets.properties").execute()
+        sheetTitles = [sheet["properties"]["title"] for sheet in sheetMetadata.get("sheets",[])]
+        valueRanges = sourceService.spreadsheets().values().batchGet(spreadsheetId=spreadsheetID,
+                                                                     ranges=[f"'{sheetTitle}'" for sheetTitle in sheetTitles]).execute()
+        self.setSpreadsheet(spreadsheetID=spreadsheetID,title=sheetMetadata.get("properties",{}).get("title","Local Spreadsheet"),
+                            sheets={sheetTitle: valueRange.get("values",[])
+                                    for sheetTitle,valueRange in zip(sheetTitles,valueRanges.get("valueRanges",[]))})
+        log.info(f"Imported {len(sheetTitles)} sheets of spreadsheet '{spreadsheetID}' into the local Sheets store.")
+
+    # Helper method to get a spreadsheet from the store, raising a 404 like Google if it doesn't exist.
+    def __getSpreadsheet(self,spreadsheetID):
+        if spreadsheetID not in self.storedSpreadsheets:
+            raise buildHttpError(404,f"Requested entity '{spreadsheetID}' was not found in the local Sheets store.","NOT_FOUND")
+        return self.storedSpreadsheets[spreadsheetID]
+    # Helper method to build the Google-style properties of a single stored sheet.
+    def __getSheetProperties(self,sheet):
+        return {"sheetId": sheet["SheetID"],"title": sheet["Title"],"index": sheet["SheetID"],"sheetType": "GRID",
+                "gridProperties": {"rowCount": sheet["RowCount"],"columnCount": sheet["ColumnCount"]}}
+    # Helper method to copy the value at fieldPath (a list of keys) from source into destination, through lists.
+    def __applyFieldMask(self,source,destination,fieldPath : list):
+        thisField = fieldPath[0]
+        if thisField not in source:
+            return
+        if len(fieldPath) == 1:
+            destination[thisField] = source[thisField]
+        elif type(source[thisField]) is list:
+            destinationList = destination.setdefault(thisField,[{} for _ in source[thisField]])
+            for sourceItem,destinationItem in zip(source[thisField],destinationList):
+                self.__applyFieldMask(sourceItem,destinationItem,fieldPath[1:])
+        else:
+            self.__applyFieldMask(source[thisField],destination.setdefault(thisField,{}),fieldPath[1:])
+
+    # Helper method to parse an A1 range ("Sheet", "Sheet!A:XX", "Sheet!1:1", "Sheet!A5:XX", "Sheet!B2") into its
+    # sheet and 1-based bounds. Unbounded ends are returned as None.
+    def __parseRange(self,spreadsheetID,rangeString : str):
+        spreadsheet = self.__getSpreadsheet(spreadsheetID)
+        sheetName, _, cellRange = rangeString.rpartition("!") if "!" in rangeString else (rangeString,"","")
+        sheetName = sheetName.strip("'")
+        sheet = next((sheet for sheet in spreadsheet["Sheets"] if sheet["Title"] == sheetName),None)
+        if sheet is None:
+            raise buildHttpError(400,f"Unable to parse range: {rangeString}","INVALID_ARGUMENT")
+        if not cellRange:
+            return sheet, 1, 1, None, None
+
+        startReference, _, endReference = cellRange.partition(":")
+        endReference = endReference if endReference else startReference
+        startMatch = re.fullmatch(r"([A-Za-z]*)(\d*)",startReference)
+        endMatch = re.fullmatch(r"([A-Za-z]*)(\d*)",endReference)
+        if startMatch is None or endMatch is None:
+            raise buildHttpError(400,f"Unable to parse range: {rangeString}","INVALID_ARGUMENT")
+
+        startColumn = columnLetterToIndex(startMatch.group(1)) if startMatch.group(1) else 1
+        startRow = int(startMatch.group(2)) if startMatch.group(2) else 1
+        endColumn = columnLetterToIndex(endMatch.group(1)) if endMatch.group(1) else None
+        endRow = int(endMatch.group(2)) if endMatch.group(2) else None
+        return sheet, startRow, startColumn, endRow, endColumn
+
+    # Helper method to build an A1 range string for a response.
+    def __buildRangeString(self,sheetTitle,startRow,startColumn,endRow,endColumn):
+        quotedTitle = f"'{sheetTitle}'" if re.search(r"[^A-Za-z0-9_]",sheetTitle) else sheetTitle
+        return f"{quotedTitle}!{columnIndexToLetter(startColumn)}{startRow}:{columnIndexToLetter(max(endColumn,startColumn))}{max(endRow,startRow)}"
+    # Helper method to remove trailing empty cells from each row, and trailing empty rows, like Google does.
+    def __trimValues(self,values : list):
+        trimmedValues = []
+        for row in values:
+            row = list(row)
+            while row and row[-1] == "":
+                row.pop()
+            trimmedValues.append(row)
+        while trimmedValues and not trimmedValues[-1]:
+            trimmedValues.pop()
+        return trimmedValues
+    # Helper method to store a single value the way Google displays a USER_ENTERED value.
+    def __toCellString(self,value):
+        if type(value) is bool:
+            return "TRUE" if value else "FALSE"
+        return "" if value is None else str(value)
+
+    #endregion === Store Management ===
+
+    #region === Persistence ===
+
+    # Loads the local store from storeFilePath, if it exists.
+    def load(self):
+        if not self.storeFilePath.exists():
+            return False
+        try:
+            with open(self.storeFilePath,"r") as f:
+                self.storedSpreadsheets = json.load(f).get("Spreadsheets",{})
+        except (json.JSONDecodeError, OSError) as e:
+            log.error(f"Couldn't load local Sheets store from '{self.storeFilePath}': {e}")
+            return False
+        return True
+    # Saves the local store to storeFilePath.
+    def save(self):
+        temporaryFilePath = self.storeFilePath.with_suffix(".tmp")
+        with open(temporaryFilePath,"w") as f:
+            json.dump({"Spreadsheets": self.storedSpreadsheets},f,indent=4)
+        temporaryFilePath.replace(self.storeFilePath)
+
+    #endregion === Persistence ===
+
+# Local services are shared per store file, so every SheetSync (including the write queue's) sees the same data.
+__localSheetsServices = {}
+# Returns the shared LocalSheetsService for the given settings (usually the [google.localSheets] table of main.toml).
+def getLocalSheetsService(localSheetsConfig : dict = None):
+    localSheetsConfig = localSheetsConfig if localSheetsConfig else {}
+    storeFilePath = paths["cache"] / localSheetsConfig.get("storeFile","local_sheets.json")
+    if storeFilePath not in __localSheetsServices:
+        readQuotaPerMinute = localSheetsConfig.get("readQuotaPerMinute",0)
+        writeQuotaPerMinute = localSheetsConfig.get("writeQuotaPerMinute",0)
+        __localSheetsServices[storeFilePath] = LocalSheetsService(storeFilePath=storeFilePath,
+                                                                  latency=float(localSheetsConfig.get("latency",0.0)),
+                                                                  latencyJitter=float(localSheetsConfig.get("latencyJitter",0.0)),
+                                                                  readQuotaPerMinute=int(readQuotaPerMinute) if readQuotaPerMinute else None,
+                                                                  writeQuotaPerMinute=int(writeQuotaPerMinute) if writeQuotaPerMinute else None,
+                                                                  quotaErrorRate=float(localSheetsConfig.get("quotaErrorRate",0.0)),
+                                                                  seed=localSheetsConfig.get("seed",None))
+    return __localSheetsServices[storeFilePath]
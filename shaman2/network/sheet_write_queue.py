@@ -0,0 +1,203 @@
+import atexit
+import json
+import threading
+from googleapiclient.errors import HttpError
+from shaman2.common.logger import log
+from shaman2.common.paths import paths
+from shaman2.network.sheets_sync import SheetSync, syscoSheet
+
+
+# This class is a write-behind queue for a SheetSync, so that callers (like the ordering loops) never block on
+# Google Sheets. Queued appends and removals are persisted to disk as soon as they're queued, then flushed on a
+# background thread once maxPendingOps are waiting, flushInterval seconds have passed, or the program shuts down.
+# Every flush coalesces all appends to a tab into a single append call, and all removals from a tab into a single
+# removal call. Ops whose call fails with a non-retryable error are quarantined (kept in the queue file for manual
+# review, but never replayed), so they can't block every op queued after them.
+class SheetWriteQueue:
+
+    def __init__(self,sheetSync : SheetSync,queueFilePath=None,maxPendingOps=25,flushInterval=30,retryBackoff=60):
+        self.sheetSync = sheetSync
+        self.queueFilePath = queueFilePath if queueFilePath else paths["cache"] / "sheet_write_queue.json"
+        self.maxPendingOps = maxPendingOps
+        self.flushInterval = flushInterval
+        self.retryBackoff = retryBackoff
+
+        self.pendingOps = []
+        self.quarantinedOps = []
+        self.__queueLock = threading.Lock()
+        self.__flushLock = threading.Lock()
+        self.__flushRequested = threading.Event()
+        self.__stopRequested = threading.Event()
+        self.__flushThread = None
+
+        # Recover anything that didn't get flushed last run.
+        self.load()
+        if self.pendingOps:
+            log.warning(f"Recovered {len(self.pendingOps)} unflushed Google Sheets operations from '{self.queueFilePath}'.")
+            self.start()
+
+    #region === Queueing ===
+
+    # Queues the given list of row-lists to be appended to sheetName.
+    def queueAppend(self,sheetName,rows : list):
+        self.__queueOp({"Type": "Append","SheetName": sheetName,"Rows": rows})
+    # Queues every row on sheetName whose columnName value is one of keys to be removed.
+    def queueRemove(self,sheetName,columnName,keys : (str,list)):
+        keys = [keys] if type(keys) is str else list(keys)
+        self.__queueOp({"Type": "Remove","SheetName": sheetName,"ColumnName": columnName,"Keys": keys})
+
+    # Helper method to add a single op to the queue, persist it, and wake up the flush thread if needed.
+    def __queueOp(self,op : dict):
+        with self.__queueLock:
+            self.pendingOps.append(op)
+            self.save()
+            pendingCount = len(self.pendingOps)
+        self.start()
+        if pendingCount >= self.maxPendingOps:
+            self.__flushRequested.set()
+
+    #endregion === Queueing ===
+
+    #region === Flushing ===
+
+    # Starts the background flush thread, if it isn't already running.
+    def start(self):
+        if self.__flushThread is not None and self.__flushThread.is_alive():
+            return
+        self.__stopRequested.clear()
+        self.__flushThread = threading.Thread(target=self.__flushLoop,name="SheetWriteQueue",daemon=True)
+        self.__flushThread.start()
+    # Stops the background flush thread, and flushes anything still pending on the calling thread.
+    def shutdown(self):
+        self.__stopRequested.set()
+        self.__flushRequested.set()
+        if self.__flushThread is not None:
+            self.__flushThread.join(timeout=30)
+        if self.pendingOps:
+            self.flush()
+
+    # Flushes all currently pending ops to Google, coalescing them into as few calls as possible. Ops queued while
+    # the flush is running are left for the next one. Returns True if everything flushed successfully. On failure,
+    # the unflushed ops stay queued (and persisted) to be retried. As appends aren't idempotent, the ops behind each
+    # call are dropped from the persisted queue right after that call succeeds, so a crash mid-flush never replays
+    # an append that already landed.
+    def flush(self):
+        with self.__flushLock:
+            with self.__queueLock:
+                opsToFlush = list(self.pendingOps)
+            if not opsToFlush:
+                return True
+
+            flushedOps = []
+            try:
+                for batchOps in self.__coalesceOps(opsToFlush):
+                    appendsBySheet = {}
+                    removalsBySheet = {}
+                    for op in batchOps:
+                        if op["Type"] == "Append":
+                            appendsBySheet.setdefault(op["SheetName"],[]).append(op)
+                        else:
+                            removalsBySheet.setdefault((op["SheetName"],op["ColumnName"]),[]).append(op)
+
+                    for sheetName,appendOps in appendsBySheet.items():
+                        try:
+                            self.sheetSync.addRows(sheetName,[row for op in appendOps for row in op["Rows"]])
+                        except Exception as e:
+                            if self.__isRetryableError(e):
+                                raise e
+                            self.__quarantine(appendOps,e)
+                            continue
+                        self.__markFlushed(appendOps)
+                        flushedOps.extend(appendOps)
+                    for (sheetName,columnName),removeOps in removalsBySheet.items():
+                        try:
+                            self.sheetSync.removeRowsByKeys(sheetName=sheetName,columnName=columnName,
+                                                            keys=set(key for op in removeOps for key in op["Keys"]))
+                        except Exception as e:
+                            if self.__isRetryableError(e):
+                                raise e
+                            self.__quarantine(removeOps,e)
+                            continue
+                        self.__markFlushed(removeOps)
+                        flushedOps.extend(removeOps)
+            except Exception as e:
+                log.error(f"Failed to flush Google Sheets write queue, will retry: {e}")
+                return False
+
+            log.info(f"Flushed {len(flushedOps)} queued Google Sheets operations.")
+            return True
+
+    # Helper method that removes the given (just flushed) ops from the queue, and persists the queue immediately.
+    def __markFlushed(self,ops : list):
+        flushedOpIDs = set(id(op) for op in ops)
+        with self.__queueLock:
+            self.pendingOps = [op for op in self.pendingOps if id(op) not in flushedOpIDs]
+            self.save()
+
+    # Helper method that moves the given ops, whose call failed with a non-retryable error, out of the queue and into
+    # quarantine, and persists the queue immediately.
+    def __quarantine(self,ops : list,error : Exception):
+        log.error(f"Quarantining {len(ops)} Google Sheets operations on '{ops[0]['SheetName']}' after a non-retryable error "
+                  f"(kept in '{self.queueFilePath}' for review): {error}")
+        quarantinedOpIDs = set(id(op) for op in ops)
+        with self.__queueLock:
+            self.pendingOps = [op for op in self.pendingOps if id(op) not in quarantinedOpIDs]
+            self.quarantinedOps.extend({**op,"Error": str(error)} for op in ops)
+            self.save()
+    # Helper method that decides whether a failed call is worth retrying. Google errors are only retried on rate limits
+    # (429) and server errors (5xx), as any other 4xx (bad ranges, renamed tabs) would fail the same way every time, as
+    # would our own validation errors (like a missing column). Anything else, like a network failure, is retried.
+    def __isRetryableError(self,error : Exception):
+        if isinstance(error,HttpError):
+            return error.resp.status == 429 or error.resp.status >= 500
+        return not isinstance(error,(ValueError,KeyError))
+
+    # Helper method that splits the given ops into consecutive batches which are safe to coalesce. A new batch starts
+    # whenever an op would reorder an append and a removal on the same sheet.
+    def __coalesceOps(self,ops : list):
+        batches = [[]]
+        for op in ops:
+            if any(existingOp["SheetName"] == op["SheetName"] and existingOp["Type"] != op["Type"] for existingOp in batches[-1]):
+                batches.append([])
+            batches[-1].append(op)
+        return [batch for batch in batches if batch]
+
+    # Background loop that flushes on size (via __flushRequested), on time, or on shutdown.
+    def __flushLoop(self):
+        while not self.__stopRequested.is_set():
+            self.__flushRequested.wait(timeout=self.flushInterval)
+            self.__flushRequested.clear()
+            if self.__stopRequested.is_set():
+                break
+            if self.pendingOps and not self.flush():
+                self.__stopRequested.wait(timeout=self.retryBackoff)
+
+    #endregion === Flushing ===
+
+    #region === Persistence ===
+
+    # Loads any persisted, unflushed ops from the queue file, if it exists.
+    def load(self):
+        if not self.queueFilePath.exists():
+            return False
+        try:
+            with open(self.queueFilePath,"r") as f:
+                rawQueue = json.load(f)
+            self.pendingOps = rawQueue.get("PendingOps",[])
+            self.quarantinedOps = rawQueue.get("QuarantinedOps",[])
+        except (json.JSONDecodeError, OSError) as e:
+            log.error(f"Couldn't load Google Sheets write queue from '{self.queueFilePath}': {e}")
+            return False
+        return True
+    # Saves all pending ops to the queue file, so nothing is lost on a crash.
+    def save(self):
+        temporaryFilePath = self.queueFilePath.with_suffix(".tmp")
+        with open(temporaryFilePath,"w") as f:
+            json.dump({"PendingOps": self.pendingOps,"QuarantinedOps": self.quarantinedOps},f,indent=4)
+        temporaryFilePath.replace(self.queueFilePath)
+
+    #endregion === Persistence ===
+
+# The queue gets its own SheetSync (and so its own Google service), as the API client isn't safe to share across threads.
+syscoSheetWriteQueue = SheetWriteQueue(SheetSync(spreadsheetID=syscoSheet.spreadsheetID))
+atexit.register(syscoSheetWriteQueue.shutdown)
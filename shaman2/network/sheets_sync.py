@@ -1,29 +1,82 @@
+from googleapiclient.errors import HttpError
 from shaman2.network.google_auth import buildSheetsAPIService
+from shaman2.network.local_sheets import getLocalSheetsService
 from shaman2.common.config import mainConfig
+from shaman2.common.logger import log
+from shaman2.data_storage.sheet_table import SheetTable, hashRawRow
 import time
 
+# Builds the Sheets service selected by sheetsBackend in the google section of main.toml - either the live Google API
+# ("google", the default) or the offline local store ("local"), configured by the [google.localSheets] table.
+def buildConfiguredSheetsService():
+    sheetsBackend = mainConfig["google"].get("sheetsBackend","google")
+    if sheetsBackend == "google":
+        return buildSheetsAPIService()
+    elif sheetsBackend == "local":
+        return getLocalSheetsService(mainConfig["google"].get("localSheets",{}))
+    else:
+        error = ValueError(f"Invalid sheetsBackend '{sheetsBackend}' in main.toml, expected 'google' or 'local'.")
+        log.error(error)
+        raise error
+
 class SheetSync:
 
-    # Simple init method sets up google service and sets spreadsheetID.
-    def __init__(self,googleService = None,spreadsheetID = None):
+    # Simple init method sets up google service and sets spreadsheetID. Sheet metadata (tab titles, IDs and grid
+    # properties) is cached for metadataTTL seconds, since it almost never changes between calls.
+    def __init__(self,googleService = None,spreadsheetID = None,metadataTTL = 120):
         if not googleService:
-            self.googleService = buildSheetsAPIService()
+            self.googleService = buildConfiguredSheetsService()
         else:
             self.googleService = googleService
         self.spreadsheetID = spreadsheetID
 
         self.fullSheet = None
 
+        self.metadataTTL = metadataTTL
+        self.__sheetProperties = None
+        self.__sheetPropertiesFetchTime = None
+        self.__headerRows = {}
+
+    #region === Metadata ===
+
+    # Returns a dict of sheetName -> sheet properties for every tab, fetching only the sheet properties from Google
+    # if the cached copy is missing or older than metadataTTL.
+    def getSheetProperties(self,forceRefresh=False):
+        if (forceRefresh or self.__sheetProperties is None or
+                time.time() - self.__sheetPropertiesFetchTime > self.metadataTTL):
+            sheetMetadata = self.googleService.spreadsheets().get(spreadsheetId=self.spreadsheetID,fields="sheets.properties").execute()
+            self.__sheetProperties = {sheet["properties"]["title"]: sheet["properties"] for sheet in sheetMetadata.get("sheets",[])}
+            self.__sheetPropertiesFetchTime = time.time()
+        return self.__sheetProperties
+    # Returns the properties of a single sheet, refreshing the cache once in case the sheet was added since the
+    # last fetch. Returns None if the sheet doesn't exist.
+    def getSingleSheetProperties(self,sheetName):
+        sheetProperties = self.getSheetProperties()
+        if sheetName not in sheetProperties:
+            sheetProperties = self.getSheetProperties(forceRefresh=True)
+        return sheetProperties.get(sheetName)
+    # Drops the cached sheet metadata, forcing the next metadata lookup to go to Google. Should be called after
+    # anything that adds, removes, renames or resizes tabs.
+    def invalidateMetadataCache(self):
+        self.__sheetProperties = None
+        self.__sheetPropertiesFetchTime = None
+        self.__headerRows = {}
+
+    #endregion === Metadata ===
+
     # This method reads the full, current sheet with the given name from the given spreadsheetID, formats it, and returns
     # it as a neat Pythonic data structure. Assumes that the top row is a header. If keyColumn is specified, it returns
-    # it as a dictionary as a list, assuming that the given column contains a unique key.
-    def getFullSheet(self, sheetName: str,keyColumn = None):
+    # it as a dictionary as a list, assuming that the given column contains a unique key. If asTable is True, it's
+    # instead returned as a column-oriented SheetTable, with values coerced according to columnTypes.
+    def getFullSheet(self, sheetName: str,keyColumn = None,asTable = False,columnTypes : dict = None):
         sheets = self.googleService.spreadsheets()
         targetRange = f'{sheetName}!{self.getSheetColumns(sheetName=sheetName)}'
         result = sheets.values().get(spreadsheetId=self.spreadsheetID, range=targetRange).execute()
         values = result.get('values', [])
 
         headerVals = values[0]
+        if asTable:
+            return SheetTable(headers=headerVals,rows=values[1:],keyColumn=keyColumn,columnTypes=columnTypes)
         returnList = []
         for row in values[1:]:
             thisRowDict = {}
@@ -44,36 +97,22 @@ class SheetSync:
 
     # Simply returns a range of columns on the given sheetName
     def getSheetColumns(self, sheetName):
-        # Helper function to calculate column name, given a column index
-        def getColumnName(index):
-            column_name = ""
-            while index > 0:
-                index, remainder = divmod(index - 1, 26)
-                column_name = chr(65 + remainder) + column_name
-            return column_name
-        sheet_metadata = self.googleService.spreadsheets().get(spreadsheetId=self.spreadsheetID).execute()
-        sheets = sheet_metadata.get('sheets', '')
-        for sheet in sheets:
-            if sheet['properties']['title'] == sheetName:
-                columnCount = sheet['properties']['gridProperties']['columnCount']
-                lastColumnName = getColumnName(columnCount)  # Get the correct last column name
-                rangeString = f'A:{lastColumnName}'
-                return rangeString
+        sheetProperties = self.getSingleSheetProperties(sheetName=sheetName)
+        if sheetProperties is not None:
+            columnCount = sheetProperties['gridProperties']['columnCount']
+            lastColumnName = self.getColumnName(columnCount)  # Get the correct last column name
+            rangeString = f'A:{lastColumnName}'
+            return rangeString
         return None
     # Simply returns the sheetID, given the sheetName
     def getSheetIDByName(self, sheetName):
-        # Retrieve metadata about the spreadsheet
-        spreadsheet = self.googleService.spreadsheets().get(spreadsheetId=self.spreadsheetID).execute()
-        sheets = spreadsheet.get('sheets', '')
-
-        # Search for the sheet name and return its ID
-        for sheet in sheets:
-            if sheet['properties']['title'] == sheetName:
-                return sheet['properties']['sheetId']
+        sheetProperties = self.getSingleSheetProperties(sheetName=sheetName)
+        if sheetProperties is not None:
+            return sheetProperties['sheetId']
         raise ValueError(f"sheetName with name '{sheetName}' not found in DeepEnd Spreadsheet!!")
 
     # Methods allowing for the addition and removal of rows for the given sheetName. addRows expects a list of row-lists,
-    # removeRows simply expects a 1d list of keys and a column name to search and delete for.
+    # removeRows simply expects a 1d list of keys (or a single key) and a column name to search and delete for.
     def addRows(self,sheetName, values):
         body = {
             'values': values
@@ -88,62 +127,108 @@ class SheetSync:
         ).execute()
         print(f"Rows added: {result.get('updates').get('updatedRange')}")
     def removeRows(self, sheetName, columnName, values):
-        rowsToRemove = []
+        return self.removeRowsByKeys(sheetName=sheetName,columnName=columnName,keys=values)
+    # Removes every row on sheetName whose value in columnName is one of the given keys (a single key string, or any
+    # collection of keys). Row positions are freshly resolved with a single read of just that column, and all
+    # deletions are sent in one batchUpdate. Returns the number of rows removed.
+    def removeRowsByKeys(self, sheetName, columnName, keys):
+        keys = {keys} if type(keys) is str else set(keys)
+        keys = {str(key).strip() for key in keys}
 
-        # Generating a raw list of row numbers needed to be deleted
-        for index, existingRow in enumerate(self.fullSheet):
-            # print(f"{index} | {existingRow} | {existingRow[columnName]}")
-            if existingRow[columnName] in values:
-                rowsToRemove.append(index + 2)
+        # Find the key column's letter from the (cached) header row.
+        headerRow = self.getHeaderRow(sheetName=sheetName)
+        if columnName not in headerRow:
+            error = ValueError(f"Column '{columnName}' not found on sheet '{sheetName}'")
+            log.error(error)
+            raise error
+        columnLetter = self.getColumnName(headerRow.index(columnName) + 1)
 
-        # Condense row numbers into runs wherever possible
-        rowsToRemove.sort()
+        # Read only the key column, then collect the (0-based) index of every matching row below the header.
+        keyColumnRequest = self.googleService.spreadsheets().values().get(spreadsheetId=self.spreadsheetID,
+                                                                          range=f"{sheetName}!{columnLetter}:{columnLetter}",
+                                                                          majorDimension="COLUMNS")
+        keyColumnValues = self.__executeWithBackoff(keyColumnRequest).get("values",[[]])
+        keyColumnValues = keyColumnValues[0] if keyColumnValues else []
+        rowIndicesToRemove = [rowIndex for rowIndex,value in enumerate(keyColumnValues)
+                              if rowIndex > 0 and str(value).strip() in keys]
+        if not rowIndicesToRemove:
+            return 0
+
+        # Condense row indices into runs, deleting from the bottom up so earlier deletions don't shift later ones.
         rowRangesToRemove = []
-        currentStart = rowsToRemove[0]
-        currentEnd = rowsToRemove[0]
-        for index in rowsToRemove[1:]:
-            if index == currentEnd + 1:
-                currentEnd = index
+        for rowIndex in sorted(rowIndicesToRemove):
+            if rowRangesToRemove and rowIndex == rowRangesToRemove[-1][1]:
+                rowRangesToRemove[-1][1] = rowIndex + 1
             else:
-                rowRangesToRemove.append((currentStart, currentEnd))
-                currentStart = index
-                currentEnd = index
-        rowRangesToRemove.append((currentStart, currentEnd))
-
-        # Sort in descending order to avoid accidental deletions
-        rowRangesToRemove.sort(key=lambda x: x[0], reverse=True)
+                rowRangesToRemove.append([rowIndex,rowIndex + 1])
+        rowRangesToRemove.reverse()
 
-        # Actually requesting the removals
-        requests = []
         thisSheetID = self.getSheetIDByName(sheetName=sheetName)
-        for startRow, endRow in rowRangesToRemove:
-            requests.append({
-                'deleteDimension': {
-                    'range': {
-                        'sheetId': thisSheetID,
-                        'dimension': 'ROWS',
-                        'startIndex': startRow - 1,
-                        'endIndex': endRow
-                    }
-                }
-            })
-
-        # If the number of deletion requests is very large, split into multiple batches
-        if len(requests) > 100:
-            # Implement batching logic here, split `requests` into chunks of 100
-            counter = 0
-            for start in range(0, len(requests), 100):
-                end = start + 100
-                batch_requests = requests[start:end]
-                self.googleService.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheetID,
-                                                          body={'requests': batch_requests}).execute()
-                counter += 1
-                print(f"Processed batch {counter} of removals...")
-                time.sleep(5)
-        else:
-            body = {'requests': requests}
-            response = self.googleService.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheetID, body=body).execute()
-            print(f"Batch delete completed, total ranges: {len(rowRangesToRemove)}")
+        requests = [{'deleteDimension': {'range': {'sheetId': thisSheetID,'dimension': 'ROWS','startIndex': startIndex,'endIndex': endIndex}}}
+                    for startIndex,endIndex in rowRangesToRemove]
+        batchUpdateRequest = self.googleService.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheetID,body={'requests': requests})
+        self.__executeWithBackoff(batchUpdateRequest)
+        print(f"Batch delete completed, removed {len(rowIndicesToRemove)} rows in {len(rowRangesToRemove)} ranges.")
+        return len(rowIndicesToRemove)
+
+    # Reads the header row and every row from startRow (1-based, as shown in Sheets) down, in a single batchGet.
+    # Returns a tuple of (headerRow, rows).
+    def getHeaderAndRowsFrom(self, sheetName, startRow : int):
+        lastColumnName = self.getSheetColumns(sheetName=sheetName).split(":")[1]
+        batchGetRequest = self.googleService.spreadsheets().values().batchGet(spreadsheetId=self.spreadsheetID,
+                                                                              ranges=[f"{sheetName}!1:1",f"{sheetName}!A{startRow}:{lastColumnName}"])
+        valueRanges = self.__executeWithBackoff(batchGetRequest).get("valueRanges",[])
+        headerValues = valueRanges[0].get("values",[[]]) if len(valueRanges) > 0 else [[]]
+        rowValues = valueRanges[1].get("values",[]) if len(valueRanges) > 1 else []
+        return (headerValues[0] if headerValues else []),rowValues
+
+    # Returns the header row of the given sheet, cached alongside the sheet metadata.
+    def getHeaderRow(self, sheetName):
+        cachedHeaderRow = self.__headerRows.get(sheetName)
+        if cachedHeaderRow is not None and time.time() - cachedHeaderRow[0] <= self.metadataTTL:
+            return cachedHeaderRow[1]
+        headerRequest = self.googleService.spreadsheets().values().get(spreadsheetId=self.spreadsheetID,range=f"{sheetName}!1:1")
+        headerValues = self.__executeWithBackoff(headerRequest).get("values",[[]])
+        headerRow = headerValues[0] if headerValues else []
+        self.__headerRows[sheetName] = (time.time(),headerRow)
+        return headerRow
+
+    # Helper function to calculate column name, given a (1-based) column index
+    def getColumnName(self, index):
+        column_name = ""
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            column_name = chr(65 + remainder) + column_name
+        return column_name
+
+    # Helper method to execute a Google API request, retrying with exponential backoff ONLY when Google responds with
+    # 429 (rate limited). Any other error is raised immediately.
+    def __executeWithBackoff(self, request, maxRetries=6, initialBackoff=1):
+        backoff = initialBackoff
+        for attempt in range(maxRetries + 1):
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status != 429 or attempt == maxRetries:
+                    raise e
+                log.warning(f"Google Sheets rate limited the request, retrying in {backoff}s.")
+                time.sleep(backoff)
+                backoff *= 2
+
+# Column types for each sysco data tab, so that list and boolean columns are parsed once at load instead of by
+# every caller.
+SYSCO_DATA_COLUMN_TYPES = {"Devices": {"Orderable Carriers": "list", "* Features": "list", "* AlwaysOrder Accessories": "list"},
+                           "Accessories": {"Available (*)": "bool", "Compatible Devices": "list"},
+                           "CimplMappings": {},
+                           "Carriers": {},
+                           "Plans/Features": {"TMA IsBaseCost": "bool", "BuildOnCarrier": "bool", "WriteToTMA": "bool"}}
+
+# The key column of each sysco data tab.
+SYSCO_DATA_KEY_COLUMNS = {"Devices": "DeviceID",
+                          "Accessories": "AccessoryID",
+                          "CimplMappings": "Cimpl Entry",
+                          "Carriers": "Carrier",
+                          "Plans/Features": "PlanID"}
 
 # Helper class just to allow the sysco data object to be reloaded from anywhere.
 class __SyscoDataClass:
@@ -153,14 +238,46 @@ class __SyscoDataClass:
         self.data = None
         self.reload()
 
-    # Using the sysco spreadsheet, this downloads and updates all sysco data.
-    def reload(self):
-        _syscoData = {"Devices": self.__syscoSheet.getFullSheet("Devices", keyColumn="DeviceID"),
-                      "Accessories": self.__syscoSheet.getFullSheet("Accessories", keyColumn="AccessoryID"),
-                      "CimplMappings": self.__syscoSheet.getFullSheet("CimplMappings", keyColumn="Cimpl Entry"),
-                      "Carriers": self.__syscoSheet.getFullSheet("Carriers", keyColumn="Carrier"),
-                      "Plans/Features": self.__syscoSheet.getFullSheet("Plans/Features", keyColumn="PlanID")}
-        self.data = _syscoData
+    # Using the sysco spreadsheet, this downloads and updates all sysco data, or just the given tabName. With
+    # incremental, only rows appended since the last sync are fetched (along with the header and the last known row,
+    # in one request) and added to the existing table and its key index. Only the header and last known row are
+    # compared, so edits to any other existing row can't be detected this way - the full tab is re-downloaded
+    # whenever no new rows were appended, or if requiredKey (the key the caller is reloading for) still isn't in the
+    # tab after the incremental sync.
+    def reload(self,tabName : str = None,incremental=False,requiredKey : str = None):
+        if self.data is None:
+            self.data = {}
+        tabNames = [tabName] if tabName is not None else list(SYSCO_DATA_KEY_COLUMNS.keys())
+
+        for thisTabName in tabNames:
+            if incremental and thisTabName in self.data and self.__syncAppendedRows(thisTabName):
+                if requiredKey is None or requiredKey in self.data[thisTabName]:
+                    continue
+                log.info(f"Key '{requiredKey}' still missing from sysco data tab '{thisTabName}' after incremental sync, fully reloading.")
+            self.data[thisTabName] = self.__syscoSheet.getFullSheet(thisTabName,keyColumn=SYSCO_DATA_KEY_COLUMNS[thisTabName],
+                                                                    asTable=True,columnTypes=SYSCO_DATA_COLUMN_TYPES[thisTabName])
+
+    # Helper method that tries to bring the given tab up to date by appending only new rows. Returns False if there
+    # were no new rows (as the tab may have been edited in place instead), or if the tab changed in any other way, in
+    # which case it needs a full reload.
+    def __syncAppendedRows(self,tabName):
+        existingTable = self.data[tabName]
+        # Row 1 is the header, so the last known row is at rawRowCount + 1.
+        lastKnownRowNumber = existingTable.rawRowCount + 1
+        headerRow, rows = self.__syscoSheet.getHeaderAndRowsFrom(sheetName=tabName,startRow=max(lastKnownRowNumber,2))
+
+        if headerRow != existingTable.headers:
+            return False
+        if existingTable.rawRowCount > 0:
+            if not rows or hashRawRow(rows[0]) != existingTable.lastRawRowHash:
+                return False
+            rows = rows[1:]
+        if not rows:
+            return False
+
+        existingTable.appendRows(rows)
+        log.info(f"Incrementally synced sysco data tab '{tabName}' with {len(rows)} new rows.")
+        return True
 
     def __getitem__(self, item):
         return self.data[item]
@@ -2,13 +2,18 @@ import time
 from shaman2.common.config import mainConfig
 from shaman2.common.logger import log
 from shaman2.network.sheets_sync import syscoSheet, syscoData
+from shaman2.network.sheet_write_queue import syscoSheetWriteQueue
 
 
 
 
 # This method stores the contents of an SCTASK order on the orders spreadsheet listed
-# in mainConfig.
-def storeSCTASKToGoogle(taskNumber,orderNumber,userName,deviceID,datePlaced):
+# in mainConfig. With useWriteQueue, the row is queued on the write-behind queue instead of
+# being written immediately.
+def storeSCTASKToGoogle(taskNumber,orderNumber,userName,deviceID,datePlaced,useWriteQueue=True):
+    if useWriteQueue:
+        syscoSheetWriteQueue.queueAppend(mainConfig["google"]["snowSubSheet"],[[taskNumber,orderNumber,userName,syscoData["Devices"][deviceID]["TMA Model"],datePlaced]])
+        return True
     for i in range(5):
         try:
             syscoSheet.addRows(mainConfig["google"]["snowSubSheet"],[[taskNumber,orderNumber,userName,syscoData["Devices"][deviceID]["TMA Model"],datePlaced]])
@@ -18,8 +23,9 @@ def storeSCTASKToGoogle(taskNumber,orderNumber,userName,deviceID,datePlaced):
             time.sleep(3)
     return False
 
-# This method "archives" the SCTASK number given from active orders to history on the sheet.
-def archiveSCTASKOnGoogle(taskNumber,closedBy,serviceNumber,fullSCTASKSheet = None):
+# This method "archives" the SCTASK number given from active orders to history on the sheet. With
+# useWriteQueue, both the archive append and the active removal are queued on the write-behind queue.
+def archiveSCTASKOnGoogle(taskNumber,closedBy,serviceNumber,fullSCTASKSheet = None,useWriteQueue=True):
     if not fullSCTASKSheet:
         fullSCTASKSheet = downloadSCTASKs()
 
@@ -32,6 +38,11 @@ def archiveSCTASKOnGoogle(taskNumber,closedBy,serviceNumber,fullSCTASKSheet = No
         log.error(error)
         raise error
 
+    if useWriteQueue:
+        syscoSheetWriteQueue.queueAppend("SCTASKArchive",[[taskNumber,targetTask["Order"],targetTask["User"],targetTask["Device"],targetTask["Date Placed"],closedBy,serviceNumber]])
+        syscoSheetWriteQueue.queueRemove(sheetName=mainConfig["google"]["snowSubSheet"],columnName="ServiceNow Ticket",keys=[taskNumber])
+        return True
+
     # First, add the sctask to the archive
     for i in range(5):
         try:
@@ -42,14 +53,21 @@ def archiveSCTASKOnGoogle(taskNumber,closedBy,serviceNumber,fullSCTASKSheet = No
     # Then, remove the sctask from the active document.
     for i in range(5):
         try:
-            syscoSheet.removeRows(sheetName=mainConfig["google"]["snowSubSheet"],columnName="ServiceNow Ticket",values=taskNumber)
+            syscoSheet.removeRowsByKeys(sheetName=mainConfig["google"]["snowSubSheet"],columnName="ServiceNow Ticket",keys=[taskNumber])
             return True
         except Exception as e:
             time.sleep(3)
     return False
 
-# This method downloads the full list of active SCTASK orders and returns it as a dictionary.
+# This method downloads the full list of active SCTASK orders and returns it as a dictionary. Any
+# queued writes are flushed first (retrying a few times), so the download reflects them.
 def downloadSCTASKs():
+    for i in range(5):
+        if syscoSheetWriteQueue.flush():
+            break
+        time.sleep(3)
+    else:
+        log.warning(f"Couldn't flush {len(syscoSheetWriteQueue.pendingOps)} queued Google Sheets writes - downloaded SCTASKs won't reflect them.")
     for i in range(5):
         try:
             return syscoSheet.getFullSheet(mainConfig["google"]["snowSubSheet"])
@@ -1,5 +1,5 @@
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 from selenium.webdriver.common.by import By
 from shaman2.selenium.browser import Browser
@@ -16,10 +16,13 @@ from shaman2.common.config import mainConfig
 from shaman2.common.logger import log
 from shaman2.common.paths import paths
 from shaman2.network.sheets_sync import syscoData
+from shaman2.data_storage.rogers_storage import rogersOrderIndex
+from shaman2.data_storage.baka_storage import bakaOrderIndex
 from shaman2.utilities.shaman_utils import convertServiceIDFormat,convertStateFormat, consoleUserWarning, validateCarrier
 from shaman2.utilities.async_sound import playsoundAsync
-from shaman2.utilities.address_validation import validateAddress
+from shaman2.utilities.address_validation import validateAddress, prefetchAddresses
 from shaman2.utilities.misc import isNumber
+from shaman2.utilities.action_handler import ActionResult, StatusCode
 
 DEFAULT_SNOW_IPHONE = "iPhone14_128GB"
 DEFAULT_SNOW_ANDROID = "GalaxyS24_128GB"
@@ -52,19 +55,18 @@ def standardizeToDateObject(dateString,carrier):
 def getPlansAndFeatures(deviceID,carrier):
     carrier = validateCarrier(carrier)
     mainPlanID = syscoData["Devices"][deviceID][f"{carrier} Plan"]
-    featureIDs = syscoData["Devices"][deviceID][f"{carrier} Features"].split(",") if syscoData["Devices"][deviceID][f"{carrier} Features"] else []
+    featureIDs = syscoData["Devices"][deviceID][f"{carrier} Features"]
     mainPlan = syscoData["Plans/Features"][mainPlanID]
     features = []
     for featureID in featureIDs:
-        features.append(syscoData["Plans/Features"][featureID.strip()])
+        features.append(syscoData["Plans/Features"][featureID])
     return mainPlan,features
 
 # Given a deviceID and a carrier, returns either a deviceID or None depending on specifications in the SyscoData
 # such as fallbacks and carrier orderability.
 def validateDeviceID(deviceID,carrier):
     carrier = validateCarrier(carrier)
-    deviceOrderableCarriers = syscoData["Devices"][deviceID]["Orderable Carriers"].split(",") if syscoData["Devices"][deviceID]["Orderable Carriers"] else []
-    deviceOrderableCarriers = [thisCarrier.strip() for thisCarrier in deviceOrderableCarriers]
+    deviceOrderableCarriers = syscoData["Devices"][deviceID]["Orderable Carriers"]
     # If the carrier is listed as orderable for this device, we're good to go and simply return the deviceID as is.
     if carrier in deviceOrderableCarriers:
         return deviceID
@@ -89,9 +91,7 @@ def validateAccessoryIDs(deviceID,carrier,accessoryIDs,removeDuplicateTypes=True
     # Now, we add in any extra "alwaysOrder" accessoryIDs as specified by the spreadsheet.
     fullAccessoryIDs = accessoryIDs
     if f"{carrier} AlwaysOrder Accessories" in syscoData["Devices"][deviceID].keys():
-        extraAccessories = syscoData["Devices"][deviceID][f"{carrier} AlwaysOrder Accessories"].split(",") if syscoData["Devices"][deviceID][f"{carrier} AlwaysOrder Accessories"] else []
-        extraAccessories = [extraAccessory.strip() for extraAccessory in extraAccessories]
-        fullAccessoryIDs.extend(extraAccessories)
+        fullAccessoryIDs.extend(syscoData["Devices"][deviceID][f"{carrier} AlwaysOrder Accessories"])
 
     # Helper methods to check availability and compatibility of a single accessoryID.
     def checkAccessoryAvailability(_accessoryID):
@@ -99,11 +99,9 @@ def validateAccessoryIDs(deviceID,carrier,accessoryIDs,removeDuplicateTypes=True
             error = ValueError(f"Invalid accessoryID in list: '{_accessoryID}'")
             log.error(error)
             raise error
-        return syscoData["Accessories"][_accessoryID][f"Available ({carrier})"] == "TRUE"
+        return syscoData["Accessories"][_accessoryID][f"Available ({carrier})"]
     def checkAccessoryCompatibility(_accessoryID):
-        compatibleDevices = syscoData["Accessories"][_accessoryID]["Compatible Devices"].split(",") if syscoData["Accessories"][_accessoryID]["Compatible Devices"] else []
-        compatibleDevices = [thisDevice.strip() for thisDevice in compatibleDevices]
-        return deviceID in compatibleDevices
+        return deviceID in syscoData["Accessories"][_accessoryID]["Compatible Devices"]
     # Helper method to handle accessory substitution.
     def substituteSingleAccessory(_accessoryID):
         targetAccessory = _accessoryID
@@ -192,45 +190,109 @@ def readVerizonOrder(verizonDriver : VerizonDriver,verizonOrderNumber,orderViewP
     result = verizonDriver.OrderViewer_ReadDisplayedOrder()
     return result.data
 
-# Searches up, and reads, a full Baka order number.
-def readBakaOrder(bakaDriver : BakaDriver,bakaOrderNumber):
+BAKA_INDEX_MAX_AGE = 300
+BAKA_FINAL_STATUSES = ("Complete","Cancelled","Canceled")
+# Searches up, and reads, a full Baka order number. Orders are first looked up in the local Baka order index, and an
+# indexed order is returned as long as the index is fresh or the order's status is final. Otherwise, if the index is
+# stale, it's refreshed with a single order history sweep, so that later lookups in the same batch stay local. An
+# order that still can't be served from the index is looked up directly (and indexed).
+def readBakaOrder(bakaDriver : BakaDriver,bakaOrderNumber,useIndex=True):
+    if useIndex:
+        indexIsStale = bakaOrderIndex.isStale(maxAgeSeconds=BAKA_INDEX_MAX_AGE)
+        indexedOrder = bakaOrderIndex.get(bakaOrderNumber)
+        if indexedOrder and (not indexIsStale or indexedOrder.get("Status") in BAKA_FINAL_STATUSES):
+            return indexedOrder
+        if indexIsStale:
+            maintenance.validateBaka(bakaDriver)
+            bakaDriver.readOrderHistory()
+            if bakaOrderNumber in bakaOrderIndex:
+                return bakaOrderIndex[bakaOrderNumber]
+
     maintenance.validateBaka(bakaDriver)
 
     bakaDriver.navToOrderHistory()
     bakaDriver.openOrder(bakaOrderNumber)
-    return bakaDriver.readOrder()
-
-def readRogersOrder(uplandOutlookDriver : OutlookDriver, sysOrdBoxOutlookDriver : OutlookDriver,
-                    rogersOrderNumber):
+    bakaOrder = bakaDriver.readOrder()
+    if useIndex:
+        bakaOrderIndex.addOrder(orderNumber=bakaOrderNumber,orderDict=bakaOrder)
+        bakaOrderIndex.save()
+    return bakaOrder
+
+ROGERS_ORDER_SENDER = "mheather@imaginewireless.net"
+ROGERS_INDEX_MAX_AGE = 300
+ROGERS_SYNC_OVERLAP = timedelta(days=1)
+# This helper method parses a raw Rogers order email string into a neat python dictionary.
+def parseRawRogersOrder(rogersOrderString):
+    rogersOrderParse = {
+        "OrderNumber": r"Order Number\s+(\d+)",
+        "OrderDate": r"Order Date\s+(.*)",
+        "OrderType": r"(?:.|\n)*Order Type\s+(.*)",
+        "TrackingNumber": r"Waybill No.\s+(\w+)",
+        "UserName": r"Subscriber Name\s+(.*)",
+        "WirelessNumber": r"Phone Number\s+(.*)",
+        "IMEI": r"IMEI\s+(\d+)"
+    }
+
+    returnDict = {}
+    for key, pattern in rogersOrderParse.items():
+        matches = re.findall(pattern, rogersOrderString)
+        if matches:
+            returnDict[key] = matches[0]
+    #TODO glue?
+    returnDict["Courier"] = "Purolator"
+    return returnDict
+# Sweeps the SysOrdBox for Rogers "Order ... Closed" emails, reading only the ones that aren't already in the local
+# Rogers order index, then saves the index. Returns the number of newly indexed orders. Once the index has synced
+# before, only emails back to the last sync (less ROGERS_SYNC_OVERLAP, rounded down to the day since Outlook's
+# summary timestamps are only accurate to the day) are scanned.
+def syncRogersOrderIndex(uplandOutlookDriver : OutlookDriver, sysOrdBoxOutlookDriver : OutlookDriver):
     maintenance.validateSysOrdBoxOutlook(sysOrdBoxOutlookDriver=sysOrdBoxOutlookDriver,uplandOutlookDriver=uplandOutlookDriver)
 
-    # This helper method parses a raw Rogers order email string into a neat python dictionary.
-    def parseRawRogersOrder(rogersOrderString):
-        rogersOrderParse = {
-            "OrderNumber": r"Order Number\s+(\d+)",
-            "OrderDate": r"Order Date\s+(.*)",
-            "OrderType": r"(?:.|\n)*Order Type\s+(.*)",
-            "TrackingNumber": r"Waybill No.\s+(\w+)",
-            "UserName": r"Subscriber Name\s+(.*)",
-            "WirelessNumber": r"Phone Number\s+(.*)",
-            "IMEI": r"IMEI\s+(\d+)"
-        }
-
-        returnDict = {}
-        for key, pattern in rogersOrderParse.items():
-            matches = re.findall(pattern, rogersOrderString)
-            if matches:
-                returnDict[key] = matches[0]
-        #TODO glue?
-        returnDict["Courier"] = "Purolator"
-        return returnDict
+    sysOrdBoxOutlookDriver.searchForTerm(searchTerm=f"from:{ROGERS_ORDER_SENDER} Closed")
+    untilDate = None
+    if rogersOrderIndex.lastSync:
+        untilDate = (rogersOrderIndex.lastSync - ROGERS_SYNC_OVERLAP).replace(hour=0,minute=0,second=0,microsecond=0)
+    searchResults = sysOrdBoxOutlookDriver.readAllEmailSummaries(untilDate=untilDate)
+
+    emailsToRead = []
+    for result in searchResults:
+        subjectMatch = re.fullmatch(r"Order (\d+) Closed",result.get("Subject","").strip())
+        if not subjectMatch or result.get("SenderEmail") != ROGERS_ORDER_SENDER:
+            continue
+        if rogersOrderIndex.hasConvID(result["ConvID"]):
+            continue
+        emailsToRead.append(result)
+
+    newlyIndexedCount = 0
+    for readEmail in sysOrdBoxOutlookDriver.readEmailsFullContent(emails=emailsToRead,parseFunction=parseRawRogersOrder,prefetch=True,useServiceCalls=True):
+        if not readEmail["Content"]:
+            continue
+        orderNumber = re.fullmatch(r"Order (\d+) Closed",readEmail["Summary"]["Subject"].strip()).group(1)
+        rogersOrderIndex.addOrder(orderNumber=orderNumber,orderDict=readEmail["Content"],convID=readEmail["Summary"]["ConvID"])
+        newlyIndexedCount += 1
+
+    rogersOrderIndex.markSynced()
+    rogersOrderIndex.save()
+    log.info(f"Synced Rogers order index, and indexed {newlyIndexedCount} new closed orders.")
+    return newlyIndexedCount
+# Reads a closed Rogers order, first from the local Rogers order index (syncing it if the order isn't there and the
+# index is stale), and otherwise by searching the SysOrdBox for the order directly.
+def readRogersOrder(uplandOutlookDriver : OutlookDriver, sysOrdBoxOutlookDriver : OutlookDriver,
+                    rogersOrderNumber,useIndex=True):
+    rogersOrderNumber = str(rogersOrderNumber).strip()
+    if useIndex:
+        if rogersOrderNumber not in rogersOrderIndex and rogersOrderIndex.isStale(maxAgeSeconds=ROGERS_INDEX_MAX_AGE):
+            syncRogersOrderIndex(uplandOutlookDriver=uplandOutlookDriver,sysOrdBoxOutlookDriver=sysOrdBoxOutlookDriver)
+        if rogersOrderNumber in rogersOrderIndex:
+            return rogersOrderIndex[rogersOrderNumber]
 
+    maintenance.validateSysOrdBoxOutlook(sysOrdBoxOutlookDriver=sysOrdBoxOutlookDriver,uplandOutlookDriver=uplandOutlookDriver)
     sysOrdBoxOutlookDriver.searchForTerm(searchTerm=rogersOrderNumber)
     searchResults = sysOrdBoxOutlookDriver.readAllVisibleEmailSummaries()
 
     targetEmail = None
     for result in searchResults:
-        if result["Subject"].strip() == f"Order {rogersOrderNumber} Closed" and result["SenderEmail"] == "mheather@imaginewireless.net":
+        if result["Subject"].strip() == f"Order {rogersOrderNumber} Closed" and result["SenderEmail"] == ROGERS_ORDER_SENDER:
             targetEmail = result
     if not targetEmail:
         return False
@@ -238,11 +300,32 @@ def readRogersOrder(uplandOutlookDriver : OutlookDriver, sysOrdBoxOutlookDriver
 
     sysOrdBoxOutlookDriver.openVisibleEmail(targetEmail)
     rawRogersOrderString = sysOrdBoxOutlookDriver.readOpenEmailFullContent()
-    return parseRawRogersOrder(rawRogersOrderString)
+    rogersOrder = parseRawRogersOrder(rawRogersOrderString)
+
+    # Remember this order, so it never needs to be searched for again.
+    rogersOrderIndex.addOrder(orderNumber=rogersOrderNumber,orderDict=rogersOrder,convID=targetEmail["ConvID"])
+    rogersOrderIndex.save()
+    return rogersOrder
 
 #endregion === Carrier Order Reading ===
 #region === Carrier Order Placing ===
 
+# Helper method to "clean" contact emails of special characters which break Verizon, dropping any invalid emails.
+def cleanVerizonContactEmails(contactEmails : str | list):
+    if type(contactEmails) is not list:
+        contactEmails = [contactEmails]
+    finalContactEmails = []
+    for contactEmail in contactEmails:
+        if contactEmail is None:
+            continue
+        contactEmail = contactEmail.lower().strip()
+        isValidEmail = True
+        for character in contactEmail:
+            if not (character.isalnum() or character in "._@"):
+                isValidEmail = False
+        if isValidEmail and contactEmail not in finalContactEmails:
+            finalContactEmails.append(contactEmail)
+    return finalContactEmails
 # Places an entire Verizon new install.
 def placeVerizonNewInstall(verizonDriver : VerizonDriver,deviceID : str,accessoryIDs : list,plan,features,
                            firstName,lastName,userEmail,
@@ -303,21 +386,7 @@ def placeVerizonNewInstall(verizonDriver : VerizonDriver,deviceID : str,accessor
     # This should send us to the checkout screen
 
     # "Clean" the contact emails for special characters which break Verizon.
-    if type(contactEmails) is not list:
-        contactEmails = [contactEmails]
-    finalContactEmails = []
-    for contactEmail in contactEmails:
-        if contactEmail is None:
-            continue
-        contactEmail = contactEmail.lower().strip()
-        isValidEmail = True
-        for character in contactEmail:
-            if not (character.isalnum() or character in "._@"):
-                isValidEmail = False
-        if isValidEmail:
-            finalContactEmails.append(contactEmail)
-
-
+    finalContactEmails = cleanVerizonContactEmails(contactEmails)
 
     # Fill in shipping information, then submit the order.
     verizonDriver.Checkout_AddAddressInfo(company=companyName,attention=f"{firstName} {lastName}",
@@ -336,6 +405,120 @@ def placeVerizonNewInstall(verizonDriver : VerizonDriver,deviceID : str,accessor
     # Order should now be placed!
 
     return orderInfo
+# Groups a list of new install orders (each a dict of placeVerizonNewInstall's arguments, plus a "SourceTask") into
+# batches that can share a single multi-line cart - that is, the same device, accessories, plan, features and shipping.
+def groupVerizonNewInstalls(orders : list,maxLinesPerOrder=10):
+    groupedOrders = {}
+    for order in orders:
+        groupKey = (order["deviceID"],order.get("deviceColor"),tuple(accessoryID for accessoryID in order["accessoryIDs"] if accessoryID),
+                    order["plan"]["Carrier Lookup Code"],tuple(feature["Carrier Lookup Code"] for feature in order["features"]),
+                    order["address1"].strip().lower(),str(order.get("address2","")).strip().lower(),order["city"].strip().lower(),
+                    convertStateFormat(stateString=order["state"],targetFormat="abbreviation"),order["zipCode"].split("-")[0].strip(),
+                    order["companyName"])
+        groupedOrders.setdefault(groupKey,[]).append(order)
+
+    # Split any groups larger than the max lines Verizon should get on a single order.
+    allBatches = []
+    for groupOrders in groupedOrders.values():
+        for i in range(0,len(groupOrders),maxLinesPerOrder):
+            allBatches.append(groupOrders[i:i + maxLinesPerOrder])
+    return allBatches
+# Places a batch of Verizon new installs, grouping orders that can share a cart into one multi-line checkout. Each order
+# is a dict of placeVerizonNewInstall's arguments, plus a "SourceTask" (EX: the SCTASK number) to map results back to.
+# Returns a list of dicts with the SourceTask, OrderNumber, WirelessNumber and raw OrderInfo for each order.
+def placeVerizonNewInstallBatch(verizonDriver : VerizonDriver,orders : list,reviewMode=True,maxLinesPerOrder=10):
+    allResults = []
+    for batch in groupVerizonNewInstalls(orders=orders,maxLinesPerOrder=maxLinesPerOrder):
+        firstOrder = batch[0]
+        print(f"Placing Verizon new install batch of {len(batch)} lines for: {[order['SourceTask'] for order in batch]}")
+
+        # Single orders just go through the standard, single line checkout.
+        if len(batch) == 1:
+            singleOrderArgs = {key: value for key,value in firstOrder.items() if key != "SourceTask"}
+            orderInfo = placeVerizonNewInstall(verizonDriver=verizonDriver,reviewMode=reviewMode,**singleOrderArgs)
+            orderNumbers = re.findall(r"MB\d+",str(orderInfo.data))
+            allResults.append({"SourceTask": firstOrder["SourceTask"],"OrderNumber": orderNumbers[0] if orderNumbers else None,
+                               "WirelessNumber": None,"OrderInfo": orderInfo.data})
+            continue
+
+        maintenance.validateVerizon(verizonDriver)
+        verizonDriver.emptyCart()
+        stateAbbrev = convertStateFormat(stateString=firstOrder["state"],targetFormat="abbreviation")
+        address2 = firstOrder.get("address2","")
+
+        # Add the device once, with a quantity of one per line.
+        verizonDriver.shopNewDevice()
+        verizonDriver.DeviceSelection_SearchSelectDevice(deviceID=firstOrder["deviceID"],orderPath="NewInstall")
+        verizonDriver.DeviceSelection_DeviceView_SelectSizeColor(deviceID=firstOrder["deviceID"],colorName=firstOrder.get("deviceColor"),orderPath="NewInstall")
+        if firstOrder["deviceID"] != "iPad11_128GB": #TODO glue
+            verizonDriver.DeviceSelection_DeviceView_Select2YearContract(orderPath="NewInstall")
+        verizonDriver.DeviceSelection_DeviceView_SelectQuantity(quantity=len(batch))
+        verizonDriver.DeviceSelection_DeviceView_AddToCartAndContinue(orderPath="NewInstall")
+
+        # Add each requested accessory once per line.
+        for accessoryID in firstOrder["accessoryIDs"]:
+            if accessoryID:
+                verizonDriver.AccessorySelection_SearchForAccessory(accessoryID=accessoryID)
+                for order in batch:
+                    verizonDriver.AccessorySelection_AddAccessoryToCart(accessoryID=accessoryID)
+        verizonDriver.AccessorySelection_Continue(orderPath="NewInstall")
+
+        # Plan and device protection apply to every line in the cart.
+        verizonDriver.PlanSelection_SelectPlan(planID=firstOrder["plan"]["Carrier Lookup Code"])
+        verizonDriver.PlanSelection_Continue()
+        verizonDriver.DeviceProtection_DeclineAndContinue()
+
+        # Assign numbers to all lines at once, then fill in user information line by line. Each saved line drops out of
+        # the "Add user information" buttons, so the next one always opens the next unassigned line.
+        verizonDriver.NumberSelection_SelectAreaCode(zipCode=firstOrder["zipCode"])
+        for order in batch:
+            verizonDriver.NumberSelection_NavToAddUserInformation()
+            verizonDriver.UserInformation_EnterBasicInfo(firstName=order["firstName"],lastName=order["lastName"],email=order["userEmail"])
+            verizonDriver.UserInformation_EnterAddressInfo(address1=order["address1"],address2=order.get("address2",""),city=order["city"],
+                                                           stateAbbrev=stateAbbrev,zipCode=order["zipCode"])
+            verizonDriver.UserInformation_SaveInfo()
+        assignedLines = verizonDriver.NumberSelection_ReadAssignedLines(userNames=[f"{order['firstName']} {order['lastName']}" for order in batch]).data
+        verizonDriver.NumberSelection_Continue()
+
+        # Add any necessary features, and make sure every line actually made it to the cart.
+        if firstOrder["features"]:
+            verizonDriver.ShoppingCart_AddFeatures(expectedLines=len(batch))
+            for feature in firstOrder["features"]:
+                verizonDriver.FeatureSelection_SelectFeature(featureName=feature["Carrier Lookup Code"])
+            verizonDriver.FeatureSelection_Continue()
+        lineCountResult = verizonDriver.ShoppingCart_ValidateLineCount(expectedLines=len(batch))
+        if not lineCountResult:
+            error = RuntimeError(f"Verizon cart doesn't have the expected {len(batch)} lines for batch {[order['SourceTask'] for order in batch]}.")
+            log.error(error)
+            raise error
+        verizonDriver.ShoppingCart_ContinueToCheckOut()
+
+        # Ship the whole batch to the shared address, notifying every line's contacts.
+        allContactEmails = []
+        for order in batch:
+            allContactEmails.extend(order["contactEmails"] if type(order["contactEmails"]) is list else [order["contactEmails"]])
+        verizonDriver.Checkout_AddAddressInfo(company=firstOrder["companyName"],attention=f"{firstOrder['firstName']} {firstOrder['lastName']}",
+                                              address1=firstOrder["address1"],address2=address2,city=firstOrder["city"],zipCode=firstOrder["zipCode"],
+                                              stateAbbrev=stateAbbrev,contactPhone=mainConfig["misc"]["contactPhone"],
+                                              notificationEmails=cleanVerizonContactEmails(allContactEmails))
+        if reviewMode:
+            playsoundAsync(paths["media"] / "shaman_order_ready.mp3")
+            userResponse = input(f"Order with {len(batch)} lines is ready to be submitted. Please review, then press enter to place. Type anything else to cancel.")
+            if userResponse:
+                error = ValueError("User cancelled submission of order.")
+                log.error(error)
+                raise error
+        maintenance.validateVerizon(verizonDriver)
+        orderInfo = verizonDriver.Checkout_PlaceOrder(billingAccountNum=syscoData["Carriers"]["Verizon Wireless"]["Account Number"])
+
+        # Map the order and each line's number back to its source task.
+        orderNumbers = re.findall(r"MB\d+",str(orderInfo.data))
+        for lineIndex,order in enumerate(batch):
+            allResults.append({"SourceTask": order["SourceTask"],"OrderNumber": orderNumbers[0] if orderNumbers else None,
+                               "WirelessNumber": assignedLines[lineIndex] if assignedLines else None,
+                               "OrderInfo": orderInfo.data})
+
+    return allResults
 # Places an entire Verizon new install.
 def placeVerizonUpgrade(verizonDriver : VerizonDriver,serviceID,deviceID : str,accessoryIDs : list,
                            firstName,lastName,
@@ -349,8 +532,10 @@ def placeVerizonUpgrade(verizonDriver : VerizonDriver,serviceID,deviceID : str,a
     # Pull up the line and click "upgrade"
     verizonDriver.pullUpLine(serviceID=serviceID)
     upgradeStatus = verizonDriver.LineViewer_UpgradeLine()
-    if upgradeStatus in ["NotETFEligible", "MTNPending"]:
-        return upgradeStatus
+    if upgradeStatus.status == StatusCode.VERIZON_EARLY_UPGRADE_NO_ETF:
+        return ActionResult(status=upgradeStatus.status,data="NotETFEligible")
+    elif upgradeStatus.status == StatusCode.VERIZON_MTN_PENDING:
+        return ActionResult(status=upgradeStatus.status,data="MTNPending")
     # This should send us to the device selection page.
 
     # Search for the device, click on it, select contract, and add to cart.
@@ -379,17 +564,7 @@ def placeVerizonUpgrade(verizonDriver : VerizonDriver,serviceID,deviceID : str,a
 
 
     # "Clean" the contact emails for special characters which break Verizon.
-    if type(contactEmails) is not list:
-        contactEmails = [contactEmails]
-    finalContactEmails = []
-    for contactEmail in contactEmails:
-        contactEmail = contactEmail.lower().strip()
-        isValidEmail = True
-        for character in contactEmail:
-            if not (character.isalnum() or character in "._@"):
-                isValidEmail = False
-        if isValidEmail:
-            finalContactEmails.append(contactEmail)
+    finalContactEmails = cleanVerizonContactEmails(contactEmails)
 
     # Fill in shipping information, then submit the order.
     verizonDriver.Checkout_AddAddressInfo(company=companyName,attention=f"{firstName} {lastName}",
@@ -409,6 +584,96 @@ def placeVerizonUpgrade(verizonDriver : VerizonDriver,serviceID,deviceID : str,a
 
     return orderInfo
 
+# Given a list of serviceIDs, this method pulls up each line once and builds a table of upgrade eligibility
+# before any ordering begins, so that known failures never enter the checkout funnel. The line viewer itself
+# is read in a single script, and a line already showing a pending order/change banner is marked MTNPending
+# right away. Otherwise, MTN Pending and ETF waiver eligibility only surface once "upgrade" is clicked, so if
+# probeUpgrade is True, each found line is also walked through LineViewer_UpgradeLine (which stops at Shop
+# Devices, well before the cart). As that walks every eligible line through the upgrade wizard twice, it's off
+# by default. Lines that can't be read are left as "Unknown" rather than stopping the batch.
+# Returns a dict of serviceID -> row, where Status is one of "Ready", "NotFound", "NotETFEligible", "MTNPending"
+# or "Unknown".
+def prefetchVerizonUpgradeEligibility(verizonDriver : VerizonDriver,serviceIDs : list,probeUpgrade=False):
+    maintenance.validateVerizon(verizonDriver)
+
+    eligibilityTable = {}
+    for serviceID in serviceIDs:
+        thisRow = {"Status": "Unknown","UpgradeEligible": None,"UpgradeDate": None,"RequiresETF": None,"MTNPending": None}
+        eligibilityTable[serviceID] = thisRow
+
+        try:
+            pullUpResult = verizonDriver.pullUpLine(serviceID=serviceID)
+            if pullUpResult.status == StatusCode.NO_RESULTS:
+                thisRow["Status"] = "NotFound"
+                continue
+            upgradeInfoResult = verizonDriver.LineViewer_ReadUpgradeInfo()
+        except Exception as e:
+            log.warning(f"Couldn't read upgrade info for line '{serviceID}', leaving it as Unknown: {e}")
+            continue
+        if not upgradeInfoResult:
+            log.warning(f"Couldn't read upgrade info for line '{serviceID}' ({upgradeInfoResult.status}), leaving it as Unknown.")
+            continue
+
+        upgradeInfo = upgradeInfoResult.data
+        thisRow["UpgradeEligible"] = upgradeInfo["UpgradeEligible"]
+        thisRow["UpgradeDate"] = upgradeInfo["UpgradeDate"]
+        thisRow["RequiresETF"] = None if upgradeInfo["UpgradeEligible"] is None else not upgradeInfo["UpgradeEligible"]
+
+        if upgradeInfo["HasPendingBanner"]:
+            thisRow["Status"] = "MTNPending"
+            thisRow["MTNPending"] = True
+        elif probeUpgrade:
+            try:
+                upgradeStatus = verizonDriver.LineViewer_UpgradeLine(useETFWaiver=True)
+            except Exception as e:
+                log.warning(f"Couldn't probe upgrade for line '{serviceID}', leaving it as Unknown: {e}")
+                continue
+            if upgradeStatus.status == StatusCode.VERIZON_MTN_PENDING:
+                thisRow["Status"] = "MTNPending"
+                thisRow["MTNPending"] = True
+            elif upgradeStatus.status == StatusCode.VERIZON_EARLY_UPGRADE_NO_ETF:
+                thisRow["Status"] = "NotETFEligible"
+                thisRow["MTNPending"] = False
+            elif upgradeStatus:
+                thisRow["Status"] = "Ready"
+                thisRow["MTNPending"] = False
+        elif upgradeInfo["UpgradeEligible"] is not None:
+            thisRow["Status"] = "Ready"
+
+        log.info(f"Prefetched upgrade eligibility for line '{serviceID}': {thisRow}")
+
+    return eligibilityTable
+
+# Places a batch of Verizon upgrades, where each entry in upgrades is a dict of the keyword arguments to
+# placeVerizonUpgrade. Eligibility is prefetched for every line up front (unless an existing eligibilityTable is
+# given), lines with known failures are skipped, and the remaining lines are ordered with straightforward eligible
+# upgrades first and ETF waiver upgrades after. Returns a dict of serviceID -> {Status, OrderInfo}.
+def placeVerizonUpgradeBatch(verizonDriver : VerizonDriver,upgrades : list,reviewMode=True,eligibilityTable : dict = None,probeUpgrade=False):
+    if eligibilityTable is None:
+        eligibilityTable = prefetchVerizonUpgradeEligibility(verizonDriver=verizonDriver,probeUpgrade=probeUpgrade,
+                                                             serviceIDs=[upgrade["serviceID"] for upgrade in upgrades])
+
+    allResults = {}
+    upgradesToPlace = []
+    for upgrade in upgrades:
+        thisStatus = eligibilityTable.get(upgrade["serviceID"],{}).get("Status","Unknown")
+        if thisStatus in ("NotFound","NotETFEligible","MTNPending"):
+            print(f"Skipping upgrade on line '{upgrade['serviceID']}' due to prefetched status '{thisStatus}'")
+            allResults[upgrade["serviceID"]] = {"Status": thisStatus,"OrderInfo": None}
+        else:
+            upgradesToPlace.append(upgrade)
+    upgradesToPlace.sort(key=lambda upgrade: 0 if eligibilityTable.get(upgrade["serviceID"],{}).get("UpgradeEligible") else 1)
+
+    for upgrade in upgradesToPlace:
+        print(f"Placing upgrade on line '{upgrade['serviceID']}'")
+        orderInfo = placeVerizonUpgrade(verizonDriver=verizonDriver,reviewMode=reviewMode,**upgrade)
+        if isinstance(orderInfo,ActionResult) and orderInfo.data in ("NotETFEligible","MTNPending"):
+            allResults[upgrade["serviceID"]] = {"Status": orderInfo.data,"OrderInfo": None}
+        else:
+            allResults[upgrade["serviceID"]] = {"Status": "Placed","OrderInfo": orderInfo.data if isinstance(orderInfo,ActionResult) else orderInfo}
+
+    return allResults
+
 # Places an entire Eyesafe order.
 def placeEyesafeOrder(eyesafeDriver : EyesafeDriver,eyesafeAccessoryID : str,
                       userFirstName : str, userLastName : str,
@@ -422,6 +687,68 @@ def placeEyesafeOrder(eyesafeDriver : EyesafeDriver,eyesafeAccessoryID : str,
                                            address1=address1,address2=address2,city=city,state=state,zipCode=zipCode,
                                            phoneNumber=phoneNumber)
 
+# Places a whole run's worth of Eyesafe orders, where each entry in orders is a dict of the keyword arguments to
+# placeEyesafeOrder plus a "SourceWorkorder" key. Orders shipping to the same person at the same address are combined
+# into a single checkout (starting from an emptied cart), and every checkout reuses the same logged-in session, loading
+# already-seen product pages directly instead of re-navigating the shop. If a cimplDriver is given, each checkout's
+# order number is written back to its workorders as soon as it's placed. A failing checkout doesn't stop the rest -
+# once every group has been tried, a RuntimeError naming the failed workorders is raised. Returns a dict of
+# SourceWorkorder -> Eyesafe order number.
+def placeEyesafeOrderBatch(eyesafeDriver : EyesafeDriver,orders : list,cimplDriver : CimplDriver = None):
+    maintenance.validateEyesafe(eyesafeDriver)
+
+    # Group orders by their full shipping destination.
+    shipmentGroups = {}
+    for order in orders:
+        shipmentKey = tuple(str(order.get(field) or "").strip().lower() for field in
+                            ("userFirstName","userLastName","address1","address2","city","state","zipCode","phoneNumber"))
+        shipmentGroups.setdefault(shipmentKey,[]).append(order)
+
+    allResults = {}
+    failedWorkorders = []
+    for shipmentGroup in shipmentGroups.values():
+        firstOrder = shipmentGroup[0]
+        groupWorkorders = [order['SourceWorkorder'] for order in shipmentGroup]
+        print(f"Placing Eyesafe order for {groupWorkorders}")
+
+        try:
+            # Start every checkout from an empty cart, so nothing left over from a failed checkout ships with this group.
+            eyesafeDriver.emptyCart()
+            for order in shipmentGroup:
+                itemName = syscoData["Accessories"][order["eyesafeAccessoryID"]]["Eyesafe Card Name"]
+                if itemName not in eyesafeDriver.productURLs:
+                    eyesafeDriver.navToShop()
+                eyesafeDriver.addItemToCart(itemName=itemName)
+            eyesafeDriver.checkOutFromCart()
+            eyesafeOrderNumber = eyesafeDriver.checkOutAndSubmit(firstName=firstOrder["userFirstName"],lastName=firstOrder["userLastName"],
+                                                                 address1=firstOrder["address1"],address2=firstOrder.get("address2"),
+                                                                 city=firstOrder["city"],state=firstOrder["state"],zipCode=firstOrder["zipCode"],
+                                                                 phoneNumber=firstOrder["phoneNumber"])
+        except Exception as e:
+            log.error(f"Failed to place Eyesafe order for Cimpl WOs {groupWorkorders}: {e}")
+            failedWorkorders.extend(groupWorkorders)
+            continue
+
+        groupResults = {}
+        for order in shipmentGroup:
+            groupResults[order["SourceWorkorder"]] = eyesafeOrderNumber
+            log.info(f"Ordered Eyesafe device '{order['eyesafeAccessoryID']}' for Cimpl WO {order['SourceWorkorder']} per '{eyesafeOrderNumber}'")
+        allResults.update(groupResults)
+
+        # Document this checkout right away, so a later failure can't leave a placed order undocumented.
+        if cimplDriver is not None:
+            try:
+                writeEyesafeOrdersToCimpl(cimplDriver=cimplDriver,eyesafeResults=groupResults)
+            except Exception as e:
+                log.error(f"Placed Eyesafe order '{eyesafeOrderNumber}' for Cimpl WOs {groupWorkorders}, but couldn't write it to Cimpl: {e}")
+                failedWorkorders.extend(groupWorkorders)
+
+    if failedWorkorders:
+        error = RuntimeError(f"Eyesafe orders couldn't be placed or documented for Cimpl WOs: {failedWorkorders}")
+        log.error(error)
+        raise error
+    return allResults
+
 # Adds service information to Cimpl (service num, install date, account) and applies it.
 def writeServiceToCimplWorkorder(cimplDriver : CimplDriver,serviceNum,carrier,installDate):
     maintenance.validateCimpl(cimplDriver)
@@ -439,6 +766,31 @@ def writeServiceToCimplWorkorder(cimplDriver : CimplDriver,serviceNum,carrier,in
 
     cimplDriver.Workorders_ApplyChanges()
 
+# Crawls the Verizon catalog for every device (or just the given deviceIDs) with a configured new install card,
+# refreshing their cached product pages. Accessories are cached as they're ordered, since the accessory catalog can only
+# be reached with a device already in the cart.
+def refreshVerizonCatalog(verizonDriver : VerizonDriver,deviceIDs : list = None):
+    maintenance.validateVerizon(verizonDriver)
+    if deviceIDs is None:
+        deviceIDs = [deviceID for deviceID,deviceInfo in syscoData["Devices"].items()
+                     if str(deviceInfo.get("Verizon Wireless New Install Card Name","")).strip()]
+
+    # A device that fails (whether by status code or by raising) is just logged and skipped, so that one bad card
+    # doesn't stop the rest of the catalog from refreshing.
+    failedDeviceIDs = []
+    for deviceID in deviceIDs:
+        try:
+            verizonDriver.shopNewDevice()
+            searchResult = verizonDriver.DeviceSelection_SearchSelectDevice(deviceID=deviceID,orderPath="NewInstall",useCatalogCache=False)
+        except Exception as e:
+            log.warning(f"Refreshing Verizon catalog entry for device '{deviceID}' raised: {e}")
+            searchResult = None
+        if not searchResult:
+            failedDeviceIDs.append(deviceID)
+    if failedDeviceIDs:
+        log.warning(f"Couldn't refresh Verizon catalog entries for devices: {failedDeviceIDs}")
+    return failedDeviceIDs
+
 #endregion === Carrier Order Placing ===
 #region === Ticketing Service Management ===
 
@@ -447,6 +799,19 @@ def readSnowTask(snowDriver : SnowDriver,taskNumber):
     maintenance.validateSnow(snowDriver)
     snowDriver.navToRequest(requestNumber=taskNumber)
     return snowDriver.Tasks_ReadFullTask()
+# Reads every task in an assignment group's queue at once, straight from the list view. Tasks are already classified
+# from their descriptions, but have no activities - use readSnowTask for the full task.
+def readSnowQueue(snowDriver : SnowDriver,assignmentGroup,state=None):
+    maintenance.validateSnow(snowDriver)
+    return snowDriver.Tasks_ListQueue(assignmentGroup=assignmentGroup,state=state)
+# Reads every given SCTASK at once from the task list, then starts classifying all of their shipping addresses in the
+# background (as a single batch), so that processing each task never waits on ChatGPT.
+def prefetchSCTASKAddresses(snowDriver : SnowDriver,taskNumbers : list):
+    if not taskNumbers:
+        return []
+    maintenance.validateSnow(snowDriver)
+    scTasks = snowDriver.Tasks_ListByNumbers(taskNumbers=taskNumbers)
+    return prefetchAddresses(rawAddressStrings=[scTask["OrderShippingAddress"] for scTask in scTasks])
 # Extract and return a list of Verizon order numbers found in an SCTask.
 def getSCTaskOrders(scTask):
     verizonOrderPattern = r"MB\d+"
@@ -545,7 +910,7 @@ def documentTMANewInstall(tmaDriver : TMADriver,client,netID,serviceNum,installD
     for planFeature in planFeatures:
         newCost = TMACost(isBaseCost=planFeature["TMA IsBaseCost"], featureName=planFeature["TMA Feature Name"], gross=planFeature["TMA Gross Cost"],
                           discountFlat=planFeature["TMA Discount Flat"], discountPercentage=planFeature["TMA Discount Percent"])
-        if planFeature["TMA IsBaseCost"] == "TRUE":
+        if planFeature["TMA IsBaseCost"]:
             if baseCost is not None:
                 raise ValueError(f"Multiple base costs for a single equipment entry in equipment.toml: {costType}|{carrier}")
             else:
@@ -662,8 +1027,12 @@ def documentTMAUpgrade(tmaDriver : TMADriver,client,serviceNum,installDate,devic
 
 # Given a workorderNumber, this method examines it, tries to figure out the type of workorder it is, and whether
 # it is valid to submit automatically through the respective carrier.
+#
+# If an eyesafeOrderQueue list is given, any Eyesafe order is appended to it instead of being placed immediately, to
+# be placed later in one go with placeEyesafeOrderBatch and written back with writeEyesafeOrdersToCimpl.
 def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,verizonDriver : VerizonDriver,eyesafeDriver : EyesafeDriver,
-                             workorderNumber,reviewMode=True,referenceNumber=None,subjectLine : str = None):
+                             workorderNumber,reviewMode=True,referenceNumber=None,subjectLine : str = None,eyesafeOrderQueue : list = None,
+                             eligibilityTable : dict = None):
     # First, read the full workorder.
     print(f"Cimpl WO {workorderNumber}: Beginning automation")
     workorder = readCimplWorkorder(cimplDriver=cimplDriver,workorderNumber=workorderNumber)
@@ -682,6 +1051,8 @@ def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,ver
     else:
         print(f"Cimpl WO {workorderNumber}: Can't complete WO, as carrier is not Verizon ({workorder['Carrier']})")
         return False
+    # Start classifying the shipping address in the background while the rest of the WO is checked and prepared.
+    prefetchAddresses(rawAddressStrings=[workorder["UserShipping"]])
     # Test to ensure it hasn't already been placed
     if workorder.getLatestOrderNote() is not None:
         warningMessage = f"Cimpl WO {workorderNumber}: An order has already been submitted for this Cimpl WO."
@@ -722,7 +1093,7 @@ def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,ver
     basePlan, features = getPlansAndFeatures(deviceID=deviceID,carrier=workorder["Carrier"])
     featuresToBuildOnCarrier = []
     for feature in features:
-        if feature["BuildOnCarrier"] == "TRUE":
+        if feature["BuildOnCarrier"]:
             featuresToBuildOnCarrier.append(feature)
     # Get the eyesafe accessoryID or set to None
     if eyesafeAccessoryIDs:
@@ -771,12 +1142,23 @@ def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,ver
     # If op type is Upgrade
     elif workorder["OperationType"] == "Upgrade":
         print(f"Cimpl WO {workorderNumber}: Ordering upgrade ({workorder['DeviceID']}) and service for user {workorder['UserNetID']} with service {workorder['ServiceID']}")
-        results = placeVerizonUpgrade(verizonDriver=verizonDriver,deviceID=deviceID,serviceID=workorder['ServiceID'],accessoryIDs=accessoryIDs,
-                                          firstName=workorder["UserFirstName"],lastName=workorder["UserLastName"],companyName="Sysco",
-                                          address1=validatedAddress["Address1"],address2=validatedAddress.get("Address2", None),city=validatedAddress["City"],
-                                          state=validatedAddress["State"], zipCode=validatedAddress["ZipCode"],reviewMode=reviewMode,contactEmails=thisPerson.info_Email)
-        orderNumber = results.data
-        if orderNumber == "NotETFEligible":
+        upgradeArgs = {"deviceID": deviceID,"serviceID": workorder['ServiceID'],"accessoryIDs": accessoryIDs,
+                       "firstName": workorder["UserFirstName"],"lastName": workorder["UserLastName"],"companyName": "Sysco",
+                       "address1": validatedAddress["Address1"],"address2": validatedAddress.get("Address2", None),"city": validatedAddress["City"],
+                       "state": validatedAddress["State"],"zipCode": validatedAddress["ZipCode"],"contactEmails": thisPerson.info_Email}
+        # With a prefetched eligibilityTable, the upgrade goes through placeVerizonUpgradeBatch, so lines with known
+        # failures never enter the upgrade wizard.
+        if eligibilityTable is not None:
+            upgradeResult = placeVerizonUpgradeBatch(verizonDriver=verizonDriver,upgrades=[upgradeArgs],reviewMode=reviewMode,
+                                                     eligibilityTable=eligibilityTable)[workorder['ServiceID']]
+            orderNumber = upgradeResult["OrderInfo"] if upgradeResult["Status"] == "Placed" else upgradeResult["Status"]
+        else:
+            orderNumber = placeVerizonUpgrade(verizonDriver=verizonDriver,reviewMode=reviewMode,**upgradeArgs).data
+        if orderNumber == "NotFound":
+            playsoundAsync(paths["media"] / "shaman_attention.mp3")
+            input(f"Cimpl WO {workorderNumber}: Line {workorder['ServiceID']} couldn't be found on Verizon. Press any key to continue to next request.")
+            return False
+        elif orderNumber == "NotETFEligible":
             playsoundAsync(paths["media"] / "shaman_attention.mp3")
             input(f"Cimpl WO {workorderNumber}: Not yet eligible for ETF upgrade. Open SNow ticket and cancel request. Press any key to continue to next request.")
             return False
@@ -844,6 +1226,14 @@ def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,ver
             error = ValueError(f"Tried to place eyesafe order on a non New Install/Upgrade!")
             log.error(error)
             raise error
+        if eyesafeOrderQueue is not None:
+            eyesafeOrderQueue.append({"SourceWorkorder": workorderNumber,"eyesafeAccessoryID": eyesafeAccessoryID,
+                                      "userFirstName": thisPerson.info_FirstName,"userLastName": thisPerson.info_LastName,
+                                      "address1": validatedAddress["Address1"],"address2": validatedAddress["Address2"],
+                                      "city": validatedAddress["City"],"state": validatedAddress["State"],"zipCode": validatedAddress["ZipCode"],
+                                      "phoneNumber": eyesafePhoneNumberFieldEntry})
+            print(f"Cimpl WO {workorderNumber}: Queued Eyesafe order for '{eyesafeAccessoryID}'")
+            return True
         eyesafeOrderNumber = placeEyesafeOrder(eyesafeDriver=eyesafeDriver,eyesafeAccessoryID=eyesafeAccessoryID,
                                 userFirstName=thisPerson.info_FirstName,userLastName=thisPerson.info_LastName,
                                 address1=validatedAddress["Address1"],address2=validatedAddress["Address2"],
@@ -856,6 +1246,15 @@ def processPreOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,ver
 
     return True
 
+# Given the results of placeEyesafeOrderBatch (SourceWorkorder -> Eyesafe order number), this method writes each
+# Eyesafe order number back to its workorder in Cimpl.
+def writeEyesafeOrdersToCimpl(cimplDriver : CimplDriver,eyesafeResults : dict):
+    for workorderNumber,eyesafeOrderNumber in eyesafeResults.items():
+        readCimplWorkorder(cimplDriver=cimplDriver,workorderNumber=workorderNumber)
+        cimplDriver.Workorders_NavToSummaryTab()
+        cimplDriver.Workorders_WriteNote(subject="Eyesafe Order Placed", noteType="Information Only", status="Completed",content=eyesafeOrderNumber)
+        print(f"Cimpl WO {workorderNumber}: Wrote Eyesafe order '{eyesafeOrderNumber}'")
+
 # Given a workorderNumber, this method examines it, tries to figure out the type of workorder it is and whether
 # it has a relevant order number, looks up to see if order is completed, and then closes it in TMA.
 def processPostOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,vzwDriver : VerizonDriver,bakaDriver : BakaDriver,uplandOutlookDriver : OutlookDriver, sysOrdBoxOutlookDriver : OutlookDriver,
@@ -937,7 +1336,7 @@ def processPostOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,vz
     features.append(basePlan)
     featuresToBuildOnTMA = []
     for feature in features:
-        if feature["WriteToTMA"] == "TRUE":
+        if feature["WriteToTMA"]:
             featuresToBuildOnTMA.append(feature)
 
     # If operation type is a New Install
@@ -974,23 +1373,37 @@ def processPostOrderWorkorder(tmaDriver : TMADriver,cimplDriver : CimplDriver,vz
     print(f"Cimpl WO {workorderNumber}: Finished all Cimpl work")
     return True
 
+# Reads each of the given workorders, and prefetches Verizon upgrade eligibility for the lines of all Verizon upgrade
+# workorders among them at once. Returns the eligibility table (see prefetchVerizonUpgradeEligibility), to be passed to
+# processPreOrderWorkorder.
+def prefetchWorkorderUpgradeEligibility(cimplDriver : CimplDriver,verizonDriver : VerizonDriver,workorderNumbers : list):
+    upgradeServiceIDs = []
+    for workorderNumber in workorderNumbers:
+        workorder = readCimplWorkorder(cimplDriver=cimplDriver,workorderNumber=workorderNumber)
+        if workorder["OperationType"] == "Upgrade" and workorder["Carrier"].lower() == "verizon wireless" and workorder["ServiceID"]:
+            upgradeServiceIDs.append(workorder["ServiceID"])
+    if not upgradeServiceIDs:
+        return {}
+    return prefetchVerizonUpgradeEligibility(verizonDriver=verizonDriver,serviceIDs=upgradeServiceIDs)
+
 #endregion === Full Cimpl Workflows ===
 #region === Full SNow Workflows ===
 
-# This method takes and orders for one single new hire SCTASK.
-def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonDriver : VerizonDriver,
-                          taskNumber, assignTo,reviewMode=True):
+# This method reads, validates and claims a single new hire SCTASK, and returns its new install as a dict of
+# placeVerizonNewInstall's arguments (plus its "SourceTask"), or False if the SCTASK can't be ordered.
+def prepareSCTASKNewInstall(tmaDriver : TMADriver,snowDriver : SnowDriver,taskNumber,assignTo):
     print(f"{taskNumber}: Beginning automation")
 
-    # First, read the full SNow task.
+    # First, read the full SNow task, and start classifying its shipping address in the background (if it wasn't
+    # already prefetched).
     scTask = readSnowTask(snowDriver=snowDriver,taskNumber=taskNumber)
+    prefetchAddresses(rawAddressStrings=[scTask["OrderShippingAddress"]])
 
     # Make sure the note isn't assigned to somebody else, then assign it to assignTo
     if scTask["AssignedTo"] is not None and scTask["AssignedTo"] != "" and scTask["AssignedTo"].lower() != assignTo.lower():
         warningMessage = f"WARNING: This SCTASK is already assigned to '{scTask['AssignedTo']}'"
         if not consoleUserWarning(warningMessage):
             return False
-    snowDriver.Tasks_WriteAssignedTo(assignedTo=assignTo)
 
     foundVerizonOrders = getSCTaskOrders(scTask=scTask)
     if foundVerizonOrders:
@@ -998,14 +1411,9 @@ def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonD
         if not consoleUserWarning(warningMessage):
             return False
 
-    # Add the Upland/Cimpl tag to the SCTASK.
-    snowDriver.Tasks_AddTag("Upland/Cimpl")
-
-    # Set the order to WIP
-    snowDriver.Tasks_WriteState("Work in Progress")
-
-    # Update, then reopen to avoid doing duplicate orders with other people in the queue.
-    snowDriver.Tasks_Update()
+    # Assign the task to assignTo, add the Upland/Cimpl tag and set it to WIP in a single save, then reopen to avoid
+    # doing duplicate orders with other people in the queue.
+    snowDriver.Tasks_ApplyChanges({"AssignedTo": assignTo, "State": "Work in Progress", "Tags": ["Upland/Cimpl"]})
     snowDriver.navToRequest(requestNumber=taskNumber)
 
     # Classify the device intended to be ordered.
@@ -1021,7 +1429,7 @@ def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonD
 
     # Classify accessoryIDs depending on if accessories were requested.
     if scTask["OrderAccessoryBundle"]:
-        accessoryIDs = [DEFAULT_SNOW_CHARGER]
+        accessoryIDs = list(DEFAULT_SNOW_CHARGER)
         if scTask["OrderDevice"].lower() == "apple":
             accessoryIDs.append(DEFAULT_SNOW_IPHONE_CASE)
         else:
@@ -1035,7 +1443,7 @@ def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonD
     basePlan, features = getPlansAndFeatures(deviceID=deviceID,carrier="Verizon Wireless")
     featuresToBuildOnCarrier = []
     for feature in features:
-        if feature["BuildOnCarrier"] == "TRUE":
+        if feature["BuildOnCarrier"]:
             featuresToBuildOnCarrier.append(feature)
 
     # Try to determine the employee's info given the order's username and supervisor name.
@@ -1060,28 +1468,64 @@ def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonD
     print(f"{taskNumber}: Found validated address: {validatedAddress}")
 
     print(f"{taskNumber}: Determined as valid SCTASK for Shaman rituals.")
-
-    # Process the new install.
-    print(f"{taskNumber}: Ordering new device ({deviceID}) and service for user {userFirstName} {userLastName}")
-    orderResult = placeVerizonNewInstall(verizonDriver=verizonDriver,deviceID=deviceID,accessoryIDs=accessoryIDs,companyName="Sysco",plan=basePlan,features=featuresToBuildOnCarrier,
-                                        firstName=userFirstName,lastName=userLastName,userEmail=contactEmail if contactEmail is not None else "sysco_wireless_mac@cimpl.com",
-                                        address1=validatedAddress["Address1"],address2=validatedAddress.get("Address2",None),city=validatedAddress["City"],
-                                        state=validatedAddress["State"],zipCode=validatedAddress["ZipCode"],reviewMode=reviewMode,contactEmails=contactEmail)
-    fullOrderNumber = orderResult.data
+    return {"SourceTask": taskNumber,"deviceID": deviceID,"accessoryIDs": accessoryIDs,"companyName": "Sysco",
+            "plan": basePlan,"features": featuresToBuildOnCarrier,"firstName": userFirstName,"lastName": userLastName,
+            "userEmail": contactEmail if contactEmail is not None else "sysco_wireless_mac@cimpl.com",
+            "address1": validatedAddress["Address1"],"address2": validatedAddress.get("Address2",None),"city": validatedAddress["City"],
+            "state": validatedAddress["State"],"zipCode": validatedAddress["ZipCode"],"contactEmails": contactEmail}
+# Given a prepared SCTASK new install and the full order number it was placed under, writes the order to the SCTASK's
+# notes and documents it.
+def documentSCTASKNewInstall(snowDriver : SnowDriver,newInstall : dict,fullOrderNumber):
+    taskNumber = newInstall["SourceTask"]
+    userName = f"{newInstall['firstName']} {newInstall['lastName']}"
     verizonOrderNumber = re.search(r"(MB\d+)",fullOrderNumber).group(1).strip()
-    print(f"{taskNumber}: Finished ordering new device and service for user {userFirstName} {userLastName} ({verizonOrderNumber})")
+    print(f"{taskNumber}: Finished ordering new device and service for user {userName} ({verizonOrderNumber})")
 
     # Add workorder to SCTASK notes.
     maintenance.validateSnow(snowDriver)
+    snowDriver.navToRequest(requestNumber=taskNumber)
     snowDriver.Tasks_WriteNote(noteContent=fullOrderNumber)
     snowDriver.Tasks_Update()
 
     # Document the order.
-    storeResult = documentation.storeSCTASKToGoogle(taskNumber=taskNumber,orderNumber=verizonOrderNumber,userName=f"{userFirstName} {userLastName}",deviceID=deviceID,datePlaced=datetime.today().strftime("%H:%M:%S %d-%m-%Y"))
+    storeResult = documentation.storeSCTASKToGoogle(taskNumber=taskNumber,orderNumber=verizonOrderNumber,userName=userName,deviceID=newInstall["deviceID"],datePlaced=datetime.today().strftime("%H:%M:%S %d-%m-%Y"))
     if not storeResult:
         warningMessage = f"WARNING: Tried to store result of order 5 times, but google failed five times. Manually document?"
         if not consoleUserWarning(warningMessage):
             return False
+    return True
+# This method takes and orders for one single new hire SCTASK.
+def processPreOrderSCTASK(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonDriver : VerizonDriver,
+                          taskNumber, assignTo,reviewMode=True):
+    newInstall = prepareSCTASKNewInstall(tmaDriver=tmaDriver,snowDriver=snowDriver,taskNumber=taskNumber,assignTo=assignTo)
+    if not newInstall:
+        return False
+
+    # Process the new install.
+    print(f"{taskNumber}: Ordering new device ({newInstall['deviceID']}) and service for user {newInstall['firstName']} {newInstall['lastName']}")
+    orderResult = placeVerizonNewInstall(verizonDriver=verizonDriver,reviewMode=reviewMode,
+                                         **{key: value for key,value in newInstall.items() if key != "SourceTask"})
+    return documentSCTASKNewInstall(snowDriver=snowDriver,newInstall=newInstall,fullOrderNumber=orderResult.data)
+# This method takes and orders for a whole list of new hire SCTASKs at once. Every SCTASK is prepared up front, then
+# all new installs are placed through placeVerizonNewInstallBatch (so that SCTASKs that can share a cart are placed
+# as one multi-line order), and finally each SCTASK is documented with its order.
+def processPreOrderSCTASKBatch(tmaDriver : TMADriver,snowDriver : SnowDriver,verizonDriver : VerizonDriver,
+                               taskNumbers : list,assignTo,reviewMode=True):
+    newInstalls = {}
+    for taskNumber in taskNumbers:
+        newInstall = prepareSCTASKNewInstall(tmaDriver=tmaDriver,snowDriver=snowDriver,taskNumber=taskNumber,assignTo=assignTo)
+        if newInstall:
+            newInstalls[taskNumber] = newInstall
+    if not newInstalls:
+        return {}
+
+    batchResults = placeVerizonNewInstallBatch(verizonDriver=verizonDriver,orders=list(newInstalls.values()),reviewMode=reviewMode)
+    allResults = {}
+    for batchResult in batchResults:
+        taskNumber = batchResult["SourceTask"]
+        allResults[taskNumber] = documentSCTASKNewInstall(snowDriver=snowDriver,newInstall=newInstalls[taskNumber],
+                                                          fullOrderNumber=str(batchResult["OrderInfo"]))
+    return allResults
 
 # This method attempts to close an SCTASK (simply updating the ticket with tracking, and close) based
 # on the given SCTASK number.
@@ -1149,9 +1593,7 @@ def processPostOrdersSCTASK(snowDriver : SnowDriver,verizonDriver : VerizonDrive
                 trackingNote += f"Courier: {carrierOrder['Courier']}\nTracking Number: {carrierOrder['TrackingNumber']}"
 
             # Close the order.
-            snowDriver.Tasks_WriteState("Closed Complete")
-            snowDriver.Tasks_WriteAdditionalNote(noteContent=trackingNote)
-            snowDriver.Tasks_Update()
+            snowDriver.Tasks_ApplyChanges({"State": "Closed Complete", "AdditionalNote": trackingNote})
 
         # Archive the task in the Google sheet.
         if useDriveSCTasks:
@@ -1197,9 +1639,9 @@ if True:
                              "SCTASK1181714",
                              "SCTASK1181713"]
         postProcessSCTASKs = [] # Note that, if no postProcessSCTASKs are specified, all valid SCTASKs in the sheet will be closed. Input just "None" to NOT do this.
-        for task in preProcessSCTASKs:
-            processPreOrderSCTASK(tmaDriver=tma,snowDriver=snow,verizonDriver=vzw,
-                                  taskNumber=task,assignTo=mainConfig["snow"]["assignTo"],reviewMode=True)
+        prefetchSCTASKAddresses(snowDriver=snow,taskNumbers=preProcessSCTASKs)
+        processPreOrderSCTASKBatch(tmaDriver=tma,snowDriver=snow,verizonDriver=vzw,
+                                   taskNumbers=preProcessSCTASKs,assignTo=mainConfig["snow"]["assignTo"],reviewMode=True)
         #processPostOrdersSCTASK(snowDriver=snow,verizonDriver=vzw,taskNumber=postProcessSCTASKs,useDriveSCTasks=False)
 
 
@@ -1215,9 +1657,28 @@ if True:
         for wo in postProcessWOs:
             processPostOrderWorkorder(tmaDriver=tma,cimplDriver=cimpl,vzwDriver=vzw,bakaDriver=baka,uplandOutlookDriver=uplandOutlook,sysOrdBoxOutlookDriver=sysOrdBoxOutlook,
                                   workorderNumber=wo)
-        for wo in preProcessWOs:
-            processPreOrderWorkorder(tmaDriver=tma,cimplDriver=cimpl,verizonDriver=vzw,eyesafeDriver=eyesafe,
-                                  workorderNumber=wo,referenceNumber=mainConfig["cimpl"]["referenceNumber"],subjectLine=mainConfig["cimpl"]["subjectLine"],reviewMode=False)
+        # Upgrade eligibility is prefetched for every upgrade workorder up front, so known failures are skipped.
+        upgradeEligibilityTable = prefetchWorkorderUpgradeEligibility(cimplDriver=cimpl,verizonDriver=vzw,workorderNumbers=preProcessWOs)
+        # Eyesafe orders queued by workorders that already went through are still placed (and written back to Cimpl)
+        # if a later workorder raises, after which that workorder's exception is re-raised.
+        eyesafeOrderQueue = []
+        workorderError = None
+        try:
+            for wo in preProcessWOs:
+                processPreOrderWorkorder(tmaDriver=tma,cimplDriver=cimpl,verizonDriver=vzw,eyesafeDriver=eyesafe,
+                                      workorderNumber=wo,referenceNumber=mainConfig["cimpl"]["referenceNumber"],subjectLine=mainConfig["cimpl"]["subjectLine"],reviewMode=False,
+                                      eyesafeOrderQueue=eyesafeOrderQueue,eligibilityTable=upgradeEligibilityTable)
+        except Exception as e:
+            workorderError = e
+        if eyesafeOrderQueue:
+            try:
+                placeEyesafeOrderBatch(eyesafeDriver=eyesafe,orders=eyesafeOrderQueue,cimplDriver=cimpl)
+            except Exception as e:
+                if workorderError is None:
+                    raise e
+                log.error(f"Eyesafe batch also failed while handling a workorder error: {e}")
+        if workorderError is not None:
+            raise workorderError
 
     except Exception as e:
         playsoundAsync(paths["media"] / "shaman_error.mp3")
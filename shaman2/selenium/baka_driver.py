@@ -5,6 +5,7 @@ import time
 from shaman2.selenium.browser import Browser
 from shaman2.common.config import mainConfig
 from shaman2.common.logger import log
+from shaman2.data_storage.baka_storage import bakaOrderIndex
 
 class BakaDriver:
 
@@ -80,7 +81,63 @@ class BakaDriver:
         orderHeaderDetails = self.browser.find_element(by=By.XPATH,value="//article/header/h2[text()='Order Details']/parent::header/parent::article").text
         orderMainDetails = self.browser.find_element(by=By.XPATH,value="//article/div/h3[text()='Order Details']/parent::div/parent::article").text
 
-        fullDetails = orderHeaderDetails + orderMainDetails
+        return self.__parseOrderText(orderHeaderDetails + orderMainDetails)
+
+    # Fields that readOrderHistory needs for each order, and which trigger opening the order's detail page if the
+    # order history list doesn't show them.
+    orderHistoryRequiredFields = ["Status","OrderDate","IMEI","TrackingNumber","WirelessNumber"]
+    # This method sweeps the entire Order History list once, reading every order's summary text in a single script,
+    # and only opens an order's detail page when the list doesn't show all required fields (and the index doesn't
+    # already hold a detail read of the order at its current status). Every order is stored in the persistent Baka
+    # order index, keyed by reference number, which is then saved. Returns the dict of all orders read.
+    def readOrderHistory(self):
+        self.navToOrderHistory()
+        self.browser.searchForElement(by=By.XPATH,value="//article/div[@id]",timeout=15)
+
+        readOrderEntriesScript = """
+            var entries = [];
+            document.querySelectorAll("article > div[id]").forEach(function(entry) {
+                if (entry.querySelector("a")) {
+                    entries.push({"OrderNumber": entry.id,"Text": entry.innerText});
+                }
+            });
+            return entries;
+        """
+        orderEntries = self.browser.execute_script(readOrderEntriesScript) or []
+
+        allOrders = {}
+        detailReadCount = 0
+        for orderEntry in orderEntries:
+            # The entry's id is kept as-is for openOrder's XPath, and only uppercased as the index key.
+            entryID = orderEntry["OrderNumber"].strip()
+            orderNumber = entryID.upper()
+            thisOrder = self.__parseOrderText(orderEntry["Text"])
+            thisOrder["OrderNumber"] = orderNumber
+
+            missingFields = [field for field in self.orderHistoryRequiredFields if not thisOrder.get(field)]
+            if missingFields:
+                indexedOrder = bakaOrderIndex.get(orderNumber)
+                if indexedOrder and indexedOrder.get("Status") == thisOrder.get("Status"):
+                    thisOrder = indexedOrder
+                elif self.openOrder(entryID):
+                    thisOrder = {**thisOrder,**self.readOrder()}
+                    detailReadCount += 1
+                    self.navToOrderHistory()
+                    self.browser.searchForElement(by=By.XPATH,value="//article/div[@id]",timeout=15)
+                else:
+                    log.warning(f"Couldn't open Baka order '{orderNumber}' to read missing fields: {missingFields}")
+
+            bakaOrderIndex.addOrder(orderNumber=orderNumber,orderDict=thisOrder)
+            allOrders[orderNumber] = thisOrder
+
+        bakaOrderIndex.markSynced()
+        bakaOrderIndex.save()
+        log.info(f"Read {len(allOrders)} orders from Baka order history, opening {detailReadCount} detail pages.")
+        return allOrders
+
+    # Helper method to parse raw Baka order text (from either an order page or an order history entry) into
+    # a neatly formatted dictionary.
+    def __parseOrderText(self,fullDetails):
         returnDict = {}
         for line in fullDetails.splitlines():
             lowerLine = line.lower()
@@ -5,6 +5,7 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.remote.webelement import WebElement
 import time
+import json
 from typing import Callable
 from urllib.parse import urlparse
 from shaman2.common.logger import log
@@ -21,6 +22,8 @@ class Browser(uc.Chrome):
         # Setup simple options.
         chromeOptions = uc.ChromeOptions()
         chromeOptions.add_argument("--disable-popup-blocking")
+        # Network events are read back through the performance log, for waitForNetworkIdle.
+        chromeOptions.set_capability("goog:loggingPrefs",{"performance": "ALL"})
 
         # Build the actual Browser (headless=False just as an example; you can switch if desired)
         super().__init__(headless=False, options=chromeOptions)
@@ -34,6 +37,10 @@ class Browser(uc.Chrome):
         self.tabs["Base"] = self.window_handles[0]
         self.currentTab = "Base"
 
+        # Requests currently in flight, as tracked from CDP network events. Maps (targetID, requestId) -> the time the
+        # request was sent, so that each tab's requests are tracked separately.
+        self.__inFlightRequests = {}
+
         log.debug("Finished init for Browser object.")
 
     #region === Tab Management ===
@@ -692,6 +699,74 @@ class Browser(uc.Chrome):
             }
             """, element, text)
 
+    # Waits until the current page has had no network requests in flight (according to the CDP network events in the
+    # performance log) for idleTime seconds, AND every Angular app on the page reports itself stable. Only requests
+    # from the active tab count, since the performance log covers every tab (and Outlook/SNow hold long polls open).
+    # Requests that were sent longer than ignoreRequestsOlderThan ago (long polls, streams) don't block idleness.
+    def waitForNetworkIdle(self,timeout=10,idleTime=0.5,ignoreRequestsOlderThan=5,checkAngular=True,raiseError=False):
+        endTime = time.time() + timeout
+        idleSince = None
+        # Chromedriver window handles are the CDP target IDs of their tabs (older versions prefix them with "CDwindow-").
+        activeTargetID = self.current_window_handle.replace("CDwindow-","").upper()
+
+        testCount = 0
+        activeRequests = {}
+        while testCount < 1 or time.time() < endTime:
+            testCount += 1
+            now = time.time()
+
+            # Drain the performance log, tracking requests as they start and finish. Start times come from the event
+            # itself (wallTime, or the log entry's own timestamp), not from when we happened to read it.
+            try:
+                for entry in self.get_log("performance"):
+                    rawMessage = json.loads(entry["message"])
+                    message = rawMessage["message"]
+                    method = message.get("method","")
+                    # Events without a webview can't be attributed to a tab, so they're conservatively counted as ours.
+                    requestKey = (str(rawMessage.get("webview") or activeTargetID).upper(),message.get("params",{}).get("requestId"))
+                    if method == "Network.requestWillBeSent":
+                        sentTime = message["params"].get("wallTime") or entry["timestamp"] / 1000
+                        self.__inFlightRequests.setdefault(requestKey,sentTime)
+                    elif method in ("Network.loadingFinished","Network.loadingFailed"):
+                        self.__inFlightRequests.pop(requestKey,None)
+            except Exception as e:
+                log.debug(f"Couldn't read network events from the performance log: {e}")
+            for requestKey,sentTime in list(self.__inFlightRequests.items()):
+                if now - sentTime > ignoreRequestsOlderThan:
+                    self.__inFlightRequests.pop(requestKey)
+            activeRequests = {requestKey: sentTime for requestKey,sentTime in self.__inFlightRequests.items() if requestKey[0] == activeTargetID}
+            networkIdle = len(activeRequests) == 0
+
+            angularStable = True
+            if checkAngular:
+                try:
+                    angularStable = self.execute_script("""
+                        if (typeof window.getAllAngularTestabilities !== 'function') { return true; }
+                        return window.getAllAngularTestabilities().every(testability => testability.isStable());
+                    """)
+                except selenium.common.exceptions.JavascriptException:
+                    angularStable = True
+
+            # The page must stay idle for the full idleTime to count.
+            if networkIdle and angularStable:
+                if idleSince is None:
+                    idleSince = now
+                if now - idleSince >= idleTime:
+                    return True
+            else:
+                idleSince = None
+            time.sleep(0.1)
+
+        # If we've reached the endTime without the page going idle, the wait failed.
+        errorMessage = f"Waited for network and Angular idle, but page never settled after timeout of {timeout} ({len(activeRequests)} requests still in flight)"
+        if raiseError:
+            error = RuntimeError(errorMessage)
+            log.error(error,stack_info=True)
+            raise error
+        else:
+            log.warning(errorMessage)
+            return False
+
     #endregion === Utilities ===
 
 
@@ -28,6 +28,9 @@ class EyesafeDriver:
         self.currentTabIndex = 0
         self.previousTabIndex = 0
 
+        # Product page URLs of items already found in the shop this session, so repeat adds skip the shop entirely.
+        self.productURLs = {}
+
         log.debug(logMessage)
 
     #region === Site Navigation ===
@@ -112,17 +115,22 @@ class EyesafeDriver:
 
     #region === Ordering ===
 
-    # This method assumes we're on the shop screen, and adds the item with the given name (as it shows directly
-    # on eyesafe) to the cart.
+    # This method adds the item with the given name (as it shows directly on eyesafe) to the cart. If the item's
+    # product page was already found this session, it's loaded directly - otherwise, this assumes we're on the shop
+    # screen.
     def addItemToCart(self,itemName : str):
         self.browser.switchToTab("Eyesafe")
 
-        targetCardXPath = f"//article[@class='card ']//a[normalize-space(text())='{itemName}']"
-        self.browser.safeClick(by=By.XPATH,value=targetCardXPath,timeout=30)
+        if itemName in self.productURLs:
+            self.browser.get(self.productURLs[itemName])
+        else:
+            targetCardXPath = f"//article[@class='card ']//a[normalize-space(text())='{itemName}']"
+            self.browser.safeClick(by=By.XPATH,value=targetCardXPath,timeout=30)
 
         # This should bring us to the item details screen. We now find the "add to cart" button and click it.
         addToCartButtonXPath = "//input[@id='form-action-addToCart']"
         self.browser.safeClick(by=By.XPATH,value=addToCartButtonXPath,timeout=30,scrollIntoView=True)
+        self.productURLs.setdefault(itemName,self.browser.current_url)
 
         # NOw we navigate to the cart.
         viewEditCartButtonXPath = "//a[contains(text(),'View or edit your cart')]"
@@ -132,6 +140,30 @@ class EyesafeDriver:
         yourCartHeaderXPath = "//*[@class='page-heading'][contains(text(),'Your Cart')]"
         self.browser.searchForElement(by=By.XPATH,value=yourCartHeaderXPath,timeout=20,testClickable=True)
 
+    # This method navigates to the cart and removes every item in it, so that a checkout only ever contains the items
+    # added for it (and not leftovers from an earlier, failed checkout).
+    def emptyCart(self,maxItems=50):
+        self.browser.switchToTab("Eyesafe")
+        self.browser.get("https://shop.eyesafe.com/cart.php")
+
+        yourCartHeaderXPath = "//*[@class='page-heading'][contains(text(),'Your Cart')]"
+        self.browser.searchForElement(by=By.XPATH,value=yourCartHeaderXPath,timeout=20,testClickable=True)
+
+        removeItemButtonXPath = "//*[contains(@class,'cart-remove')]"
+        confirmRemoveButtonXPath = "//button[contains(@class,'swal2-confirm')]"
+        for i in range(maxItems):
+            removeItemButton = self.browser.searchForElement(by=By.XPATH,value=removeItemButtonXPath,timeout=3)
+            if not removeItemButton:
+                return True
+            self.browser.safeClick(element=removeItemButton,timeout=15,scrollIntoView=True)
+            # Eyesafe asks to confirm each removal, then reloads the cart content.
+            self.browser.safeClick(by=By.XPATH,value=confirmRemoveButtonXPath,timeout=10,raiseError=False)
+            self.browser.searchForElement(element=removeItemButton,invertedSearch=True,timeout=15)
+
+        error = RuntimeError(f"Eyesafe cart still wasn't empty after removing {maxItems} items.")
+        log.error(error)
+        raise error
+
     # This method assumes we're on the cart, and it simply clicks "check out"
     def checkOutFromCart(self):
         self.browser.switchToTab("Eyesafe")
@@ -163,9 +195,10 @@ class EyesafeDriver:
         self.checkOutFromCart()
     # One giant writeShipping method, as eyesafe's shipping validation is one of the strangest, most inconsistent
     # I've ever seen and needs to be handled very delicately.
-    def __checkout_writeShippingInformation(self,firstName,lastName,address1,city,state,zipCode,phoneNumber,address2=None):
+    def __checkout_writeShippingInformation(self,firstName,lastName,address1,city,state,zipCode,phoneNumber,address2=None,useBulkFill=True):
         # Fix zip code to be just 5 numbers
         zipCode = zipCode[:5]
+        stateName = convertStateFormat(state,targetFormat="Name")
 
         # This helper method simply waits until the loader is first found, THEN until it disappears.
         def waitForLoader(timeout=5):
@@ -228,13 +261,13 @@ class EyesafeDriver:
                 # Write State (just in case)
                 stateDropdownXPath = "//select[@id='provinceCodeInput']"
                 stateDropdown = Select(self.browser.searchForElement(by=By.XPATH, value=stateDropdownXPath, timeout=60, minSearchTime=5))
-                stateDropdown.select_by_visible_text(convertStateFormat(state,targetFormat="Name"))
+                stateDropdown.select_by_visible_text(stateName)
                 commitField(timeout=3)
 
                 # Test that it actually wrote.
                 stateDropdown = Select(self.browser.searchForElement(by=By.XPATH, value=stateDropdownXPath, timeout=60, minSearchTime=5))
                 stateValue = stateDropdown.first_selected_option.text
-                if stateValue.strip().lower() == state.strip().lower():
+                if stateValue.strip().lower() == stateName.strip().lower():
                     return True
             return False
         def writeShipping_Address1(retries=3):
@@ -385,7 +418,79 @@ class EyesafeDriver:
 
             # If we reached max retries, just return false.
             return False
+        # This helper method writes every plain shipping field (everything but the zip/city autocomplete) in a single
+        # script, firing the input/change/blur events Eyesafe's validation listens for, then waits for a single loader
+        # cycle and verifies every field in one read-back. Only fields that fail verification fall back to their own
+        # per-field retry loop.
+        def writeShipping_Bulk():
+            bulkFields = {"firstNameInput": (firstName,writeShipping_FirstName),
+                          "lastNameInput": (lastName,writeShipping_LastName),
+                          "provinceCodeInput": (stateName,writeShipping_State),
+                          "addressLine1Input": (address1,writeShipping_Address1),
+                          "phoneInput": (phoneNumber,writeShipping_Phone)}
+            if address2 is not None and address2 != "":
+                bulkFields["addressLine2Input"] = (address2,writeShipping_Address2)
+
+            bulkFillScript = """
+                var fields = arguments[0];
+                var written = {};
+                for (var fieldID in fields) {
+                    var field = document.getElementById(fieldID);
+                    if (!field) { written[fieldID] = false; continue; }
+                    field.focus();
+                    if (field.tagName === "SELECT") {
+                        var targetOption = Array.from(field.options).find(function(option) {
+                            return option.text.trim().toLowerCase() === fields[fieldID].trim().toLowerCase();
+                        });
+                        if (!targetOption) { written[fieldID] = false; continue; }
+                        Object.getOwnPropertyDescriptor(HTMLSelectElement.prototype,"value").set.call(field,targetOption.value);
+                    } else {
+                        Object.getOwnPropertyDescriptor(HTMLInputElement.prototype,"value").set.call(field,fields[fieldID]);
+                    }
+                    field.dispatchEvent(new Event("input",{bubbles: true}));
+                    field.dispatchEvent(new Event("change",{bubbles: true}));
+                    field.dispatchEvent(new Event("blur",{bubbles: true}));
+                    field.blur();
+                    written[fieldID] = true;
+                }
+                return written;
+            """
+            readBackScript = """
+                var values = {};
+                arguments[0].forEach(function(fieldID) {
+                    var field = document.getElementById(fieldID);
+                    if (!field) { values[fieldID] = null; }
+                    else if (field.tagName === "SELECT") { values[fieldID] = field.selectedIndex >= 0 ? field.options[field.selectedIndex].text : null; }
+                    else { values[fieldID] = field.value; }
+                });
+                return values;
+            """
+            self.browser.execute_script(bulkFillScript,{fieldID: fieldValue for fieldID,(fieldValue,_) in bulkFields.items()})
+            commitField()
+
+            # Address validation may pop up its "It Is Correct" box once for the whole form.
+            itIsCorrectButtonXPath = "//span[normalize-space(text())='It Is Correct']"
+            itIsCorrectButton = self.browser.searchForElement(by=By.XPATH,value=itIsCorrectButtonXPath,timeout=3,testClickable=True,scrollIntoView=True)
+            if itIsCorrectButton:
+                itIsCorrectButton.click()
+                commitField()
+
+            readBackValues = self.browser.execute_script(readBackScript,list(bulkFields.keys()))
+            for fieldID,(fieldValue,perFieldWriter) in bulkFields.items():
+                readBackValue = readBackValues.get(fieldID)
+                if readBackValue is not None and readBackValue.strip().lower() == fieldValue.strip().lower():
+                    continue
+                log.debug(f"Eyesafe bulk fill didn't verify for '{fieldID}' (read back '{readBackValue}'), retrying field individually.")
+                if not perFieldWriter():
+                    return False
+            return True
+
         def writeShipping(promptUserOnIssue):
+            if useBulkFill:
+                if not writeShipping_ZipCity(cityToTry=city,promptUserOnIssue=promptUserOnIssue):
+                    return False
+                return writeShipping_Bulk()
+
             if not writeShipping_FirstName():
                 return False
             if not writeShipping_LastName():
@@ -438,7 +543,7 @@ class EyesafeDriver:
 
     # Single function to handle the actual clusterfuck that is the eyesafe checkout process in an intelligent, adaptable
     # way. Assumes we're on the checkout page to start.
-    def checkOutAndSubmit(self,firstName,lastName,address1,city,state,zipCode,phoneNumber,address2=None,debug=False):
+    def checkOutAndSubmit(self,firstName,lastName,address1,city,state,zipCode,phoneNumber,address2=None,debug=False,useBulkFill=True):
         shippingAddressOpenXPath = "//legend[@data-test='shipping-address-heading']"
         billingAddressOpenXPath = "//legend[@data-test='billing-address-heading']"
         submitOrderReadyXPath = "//button[@id='checkout-payment-continue']"
@@ -473,7 +578,7 @@ class EyesafeDriver:
                     writeShippingInfoSuccess = self.__checkout_writeShippingInformation(
                         firstName=firstName,lastName=lastName,address1=address1,
                         address2=address2,city=city,zipCode=zipCode,state=state,
-                        phoneNumber=phoneNumber)
+                        phoneNumber=phoneNumber,useBulkFill=useBulkFill)
                     if writeShippingInfoSuccess:
                         shippingEnteredSuccessfully = True
                         self.__checkout_continueFromShippingBilling()
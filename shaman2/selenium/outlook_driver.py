@@ -1,5 +1,8 @@
+import selenium.common.exceptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
+from datetime import datetime, timedelta
+import re
 import time
 from shaman2.selenium.browser import Browser
 from shaman2.common.logger import log
@@ -98,6 +101,7 @@ class OutlookDriver:
         else:
             return False
 
+    syscoOrdBoxAddress = "sysco_wireless_orders@cimpl.com"
     # This method logs in to the Sysco Ord Box, and sets this OutlookDriver to SyscoOrdBox type. This RELIES
     # on the Upland outlook instance already being open, and will fail without it.
     def logInToOutlook_SyscoOrdBox(self):
@@ -145,84 +149,308 @@ class OutlookDriver:
         self.browser.openNewTab(tabName="Outlook_SyscoOrdBox")
         self.browser.switchToTab(tabName="Outlook_SyscoOrdBox")
         self.outlookType = "SyscoOrdBox"
-        self.browser.get("https://outlook.office.com/mail/sysco_wireless_orders@cimpl.com/")
+        self.browser.get(f"https://outlook.office.com/mail/{self.syscoOrdBoxAddress}/")
 
     #endregion === Basic Navigation ===
 
     #region === Email Reading ===
 
     allVisibleMessagesXPath = "//div[@id='MailList']//div[contains(@class,'customScrollBar')]/div/div"
-    # This method simply reads all visible emails in the scroller, and returns them as a list.
+    # Relative XPaths (from a single message row) and the attribute to read for each email summary field, where None
+    # means the field's text is read instead.
+    emailSummaryFieldXPaths = {"ConvID": ("./div/div[@role='option']","data-convid"),
+                               "SenderEmail": ("./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[1]/div[1]/span","title"),
+                               "Subject": ("./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[2]/div[1]/span",None),
+                               "Timestamp": ("./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[2]/span",None),
+                               "ContentPreview": ("./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[3]/div/div[1]/span",None)}
+    # This method simply reads all visible emails in the scroller, and returns them as a list. All rendered rows are
+    # read in a single script.
     def readAllVisibleEmailSummaries(self):
         self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
 
-        # Helper function accepts a single email element, and returns the full content as an emailDict.
-        def readSingleEmailSummary(emailElement):
-            convIDXPath = "./div/div[@role='option']"
-            senderEmailXPath = "./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[1]/div[1]/span"
-            subjectXPath = "./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[2]/div[1]/span"
-            timestampXPath = "./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[2]/span"
-            contentXPath = "./div/div[@role='option']/div/div/div/div/div[2]/div[2]/div[3]/div/div[1]/span"
-
-            returnDict = {}
-
-            convIDElement = emailElement.find_elements(by=By.XPATH,value=convIDXPath)
-            if convIDElement:
-                returnDict["ConvID"] = convIDElement[0].get_attribute("data-convid")
-            senderEmailElement = emailElement.find_elements(by=By.XPATH, value=senderEmailXPath)
-            if senderEmailElement:
-                returnDict["SenderEmail"] = senderEmailElement[0].get_attribute("title")
-            subjectElement = emailElement.find_elements(by=By.XPATH, value=subjectXPath)
-            if subjectElement:
-                returnDict["Subject"] = subjectElement[0].text.strip()
-            timestampElement = emailElement.find_elements(by=By.XPATH, value=timestampXPath)
-            if timestampElement:
-                returnDict["Timestamp"] = timestampElement[0].text.strip()
-            contentElement = emailElement.find_elements(by=By.XPATH, value=contentXPath)
-            if contentElement:
-                returnDict["ContentPreview"] = contentElement[0].text.strip()
-
-            return returnDict
-
-        allVisibleMessages = self.browser.find_elements(by=By.XPATH,value=self.allVisibleMessagesXPath)
-
-        returnList = []
-        for visibleMessage in allVisibleMessages:
-            # Skip "invisible" messages.
-            thisStyleString = visibleMessage.get_attribute("style")
-            if "height: 0px;" in thisStyleString:
-                continue
-
-            emailDict = readSingleEmailSummary(visibleMessage)
-            # Skip "ghost" messages.
-            if emailDict and str(emailDict.get("Timestamp", "")).strip() != "":
-                returnList.append(emailDict)
-
-        return returnList
+        readSummariesScript = """
+            var rows = document.evaluate(arguments[0],document,null,XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,null);
+            var fieldXPaths = arguments[1];
+            var summaries = [];
+            for (var i = 0; i < rows.snapshotLength; i++) {
+                var row = rows.snapshotItem(i);
+                // Skip "invisible" messages.
+                if ((row.getAttribute("style") || "").indexOf("height: 0px;") !== -1) { continue; }
+
+                var summary = {};
+                for (var field in fieldXPaths) {
+                    var node = document.evaluate(fieldXPaths[field][0],row,null,XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue;
+                    if (node) {
+                        summary[field] = fieldXPaths[field][1] ? node.getAttribute(fieldXPaths[field][1]) : node.innerText.trim();
+                    }
+                }
+                // Skip "ghost" messages.
+                if (summary["Timestamp"] && summary["Timestamp"].trim() !== "") { summaries.push(summary); }
+            }
+            return summaries;
+        """
+        return self.browser.execute_script(readSummariesScript,self.allVisibleMessagesXPath,self.emailSummaryFieldXPaths) or []
+
+    # Scrolls Outlook's virtualized message list down by (roughly) a page, or back to the very top if toTop is given.
+    # Returns whether the list actually moved.
+    scrollMessageListScript = """
+        var scroller = document.querySelector("div#MailList div.customScrollBar");
+        if (!scroller) { return false; }
+        var previousTop = scroller.scrollTop;
+        scroller.scrollTop = arguments[0] ? 0 : previousTop + Math.max(scroller.clientHeight - 50,50);
+        return scroller.scrollTop !== previousTop;
+    """
+    # This method reads the summaries of ALL emails in the current folder or search, not just the rendered ones, by
+    # scrolling Outlook's virtualized message list and collecting new rows (deduped by ConvID) after each scroll.
+    # Stops once maxCount summaries are collected, once an email older than untilDate (a datetime) is reached, or once
+    # scrolling stops revealing new emails. Summaries are returned in list order.
+    def readAllEmailSummaries(self,maxCount : int = None,untilDate : datetime = None,maxScrolls=100,scrollTimeout=5):
+        self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
 
-    # Given the ConvID or an emailDict of a visible email summary, this method opens the email.
-    def openVisibleEmail(self,convID : (str,dict)):
+        allSummaries = {}
+        for i in range(maxScrolls + 1):
+            newSummaryFound = False
+            for summary in self.readAllVisibleEmailSummaries():
+                convID = summary.get("ConvID")
+                if not convID or convID in allSummaries:
+                    continue
+                allSummaries[convID] = summary
+                newSummaryFound = True
+
+                if maxCount is not None and len(allSummaries) >= maxCount:
+                    return list(allSummaries.values())
+                if untilDate is not None:
+                    summaryDate = self.parseSummaryTimestamp(summary.get("Timestamp"))
+                    if summaryDate is not None and summaryDate < untilDate:
+                        return list(allSummaries.values())
+
+            if i > 0 and not newSummaryFound:
+                break
+            if not self.browser.execute_script(self.scrollMessageListScript,False):
+                break
+
+            # Wait for the virtual list to render rows we haven't seen yet.
+            waitStart = time.time()
+            while time.time() - waitStart < scrollTimeout:
+                renderedConvIDs = [summary.get("ConvID") for summary in self.readAllVisibleEmailSummaries()]
+                if any(convID and convID not in allSummaries for convID in renderedConvIDs):
+                    break
+                time.sleep(0.2)
+
+        log.debug(f"Read {len(allSummaries)} email summaries from Outlook_{self.outlookType}.")
+        return list(allSummaries.values())
+
+    # Helper method to convert the timestamp Outlook shows on an email summary ("3:15 PM", "Yesterday",
+    # "Mon 3:15 PM", "Mon 10/14", "10/14/2024") into a datetime, or None if the format isn't recognized. Only the date
+    # is guaranteed to be accurate.
+    def parseSummaryTimestamp(self,timestampString : str):
+        if not timestampString:
+            return None
+        timestampString = timestampString.strip()
+        today = datetime.now().replace(hour=0,minute=0,second=0,microsecond=0)
+
+        for dateFormat in ("%m/%d/%Y","%Y-%m-%d","%m/%d/%y"):
+            try:
+                return datetime.strptime(timestampString,dateFormat)
+            except ValueError:
+                pass
+        if re.fullmatch(r"\d{1,2}:\d{2}\s*[AaPp][Mm]",timestampString):
+            return today
+        if timestampString.lower().startswith("yesterday"):
+            return today - timedelta(days=1)
+
+        weekdayMatch = re.match(r"(Mon|Tue|Wed|Thu|Fri|Sat|Sun)\w*\s+(.*)",timestampString)
+        if weekdayMatch:
+            monthDayMatch = re.fullmatch(r"(\d{1,2})/(\d{1,2})",weekdayMatch.group(2).strip())
+            if monthDayMatch:
+                try:
+                    thisDate = today.replace(month=int(monthDayMatch.group(1)),day=int(monthDayMatch.group(2)))
+                except ValueError:
+                    return None
+                return thisDate if thisDate <= today else thisDate.replace(year=today.year - 1)
+            targetWeekday = ["mon","tue","wed","thu","fri","sat","sun"].index(weekdayMatch.group(1).lower())
+            daysAgo = (today.weekday() - targetWeekday) % 7
+            return today - timedelta(days=daysAgo if daysAgo else 7)
+        return None
+
+    # Given the ConvID or an emailDict of a visible email summary, this method opens the email. If waitForLoad is True,
+    # this waits until the reading pane is actually showing that conversation.
+    def openVisibleEmail(self,convID : (str,dict),waitForLoad=True,timeout=10):
         self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
 
         if type(convID) is dict:
             convID = convID["ConvID"]
 
-        targetEmailCardXPath = f"{self.allVisibleMessagesXPath}//div[normalize-space(@data-convid)='{convID.strip()}']"
-        targetEmailCard = self.browser.searchForElement(by=By.XPATH,value=targetEmailCardXPath,timeout=10,scrollIntoView=True)
-        targetEmailCard.click()
-        time.sleep(2)
+        previousMessageElement = self.__clickVisibleEmail(convID)
+        if waitForLoad:
+            return self.__waitForOpenEmail(convID=convID,previousMessageElement=previousMessageElement,timeout=timeout)
+        return True
 
+    openEmailFullContentXPath = "//div[@aria-label='Email message']"
     # Reads and returns the full content of the currently open email.
     def readOpenEmailFullContent(self):
         self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
 
-        openEmailFullContentXPath = "//div[@aria-label='Email message']"
-        openEmailFullContent = self.browser.searchForElement(by=By.XPATH,value=openEmailFullContentXPath,timeout=5)
+        openEmailFullContent = self.browser.searchForElement(by=By.XPATH,value=self.openEmailFullContentXPath,timeout=5)
         if openEmailFullContent:
             return openEmailFullContent.text.strip()
         else:
             return None
 
+    # Given a list of ConvIDs or emailDicts of visible email summaries, this method reads the full content of each
+    # one and returns a list of {"Summary","Content"} dicts in the same order. If a parseFunction is given, Content
+    # is its result on the raw content. With prefetch, the next email is opened before the previous one is parsed,
+    # so Outlook renders while we parse. With useServiceCalls, bodies are first pulled in bulk through Outlook's own
+    # service calls (see readEmailBodiesViaService), and only emails it couldn't return are opened in the UI.
+    def readEmailsFullContent(self,emails : list,parseFunction=None,prefetch=True,useServiceCalls=False):
+        self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
+        emails = [email if type(email) is dict else {"ConvID": email} for email in emails]
+
+        contents = {}
+        if useServiceCalls:
+            for convID,body in self.readEmailBodiesViaService([email["ConvID"] for email in emails]).items():
+                if body:
+                    contents[convID] = parseFunction(body) if parseFunction is not None else body
+        emailsToOpen = [email for email in emails if email["ConvID"] not in contents]
+
+        previousMessageElement = None
+        for index,email in enumerate(emailsToOpen):
+            if not (prefetch and index > 0):
+                previousMessageElement = self.__clickVisibleEmail(email["ConvID"])
+            if not self.__waitForOpenEmail(convID=email["ConvID"],previousMessageElement=previousMessageElement):
+                log.warning(f"Outlook never showed email with ConvID '{email['ConvID']}' in the reading pane.")
+            thisContent = self.readOpenEmailFullContent()
+
+            # Open the next email first, then parse this one while Outlook renders it.
+            if prefetch and index + 1 < len(emailsToOpen):
+                previousMessageElement = self.__clickVisibleEmail(emailsToOpen[index + 1]["ConvID"])
+            contents[email["ConvID"]] = parseFunction(thisContent) if parseFunction is not None and thisContent else thisContent
+
+        return [{"Summary": email,"Content": contents.get(email["ConvID"])} for email in emails]
+
+    # Given a list of ConvIDs, this method pulls the text bodies of each conversation's latest message in bulk, by
+    # calling the same GetConversationItems service Outlook's web app uses (authenticated by the page's own session
+    # and canary cookie), without opening any emails. Requests are sent in chunks of at most chunkSize at once, to
+    # stay clear of OWA's throttling, and each request settles on its own. Returns a dict of ConvID -> body text, with
+    # None for any conversation whose body couldn't be pulled, so callers can fall back to the UI per ConvID.
+    def readEmailBodiesViaService(self,convIDs : list,chunkSize=8):
+        self.browser.switchToTab(tabName=f"Outlook_{self.outlookType}")
+
+        getConversationBodiesScript = """
+            var convIDs = arguments[0];
+            var mailbox = arguments[1];
+            var done = arguments[arguments.length - 1];
+            var canaryMatch = document.cookie.match(/X-OWA-CANARY=([^;]+)/);
+            if (!canaryMatch) { done({"error": "No OWA canary cookie found"}); return; }
+
+            var headers = {"action": "GetConversationItems","content-type": "application/json; charset=utf-8","x-owa-canary": canaryMatch[1]};
+            if (mailbox) { headers["X-AnchorMailbox"] = mailbox; }
+            var serviceURL = "/owa/" + (mailbox ? mailbox + "/" : "") + "service.svc?action=GetConversationItems&app=Mail";
+
+            Promise.allSettled(convIDs.map(function(convID) {
+                var requestBody = {
+                    "__type": "GetConversationItemsJsonRequest:#Exchange",
+                    "Header": {"__type": "JsonRequestHeaders:#Exchange","RequestServerVersion": "V2018_01_08"},
+                    "Body": {
+                        "__type": "GetConversationItemsRequest:#Exchange",
+                        "Conversations": [{"__type": "ConversationRequestType:#Exchange","ConversationId": {"__type": "ItemId:#Exchange","Id": convID}}],
+                        "ItemShape": {"__type": "ItemResponseShape:#Exchange","BaseShape": "IdOnly",
+                                      "AdditionalProperties": [{"__type": "PropertyUri:#Exchange","FieldURI": "UniqueBody"}]},
+                        "SortOrder": "DateOrderDescending",
+                        "MaxItemsToReturn": 1
+                    }
+                };
+                return fetch(serviceURL,{method: "POST",headers: headers,body: JSON.stringify(requestBody),credentials: "include"})
+                    .then(function(response) { return response.ok ? response.json() : null; })
+                    .then(function(data) {
+                        try {
+                            var item = data.Body.ResponseMessages.Items[0].Conversation.ConversationNodes[0].Items[0];
+                            var html = item.UniqueBody.Value;
+                            return [convID,new DOMParser().parseFromString(html,"text/html").body.innerText.trim()];
+                        } catch (e) { return [convID,null]; }
+                    })
+                    .catch(function() { return [convID,null]; });
+            })).then(function(results) {
+                var bodies = {};
+                results.forEach(function(result,i) { bodies[convIDs[i]] = result.status === "fulfilled" ? result.value[1] : null; });
+                done(bodies);
+            });
+        """
+        mailbox = self.syscoOrdBoxAddress if self.outlookType == "SyscoOrdBox" else None
+        convIDs = list(convIDs)
+        bodies = {convID: None for convID in convIDs}
+        for chunkStart in range(0,len(convIDs),chunkSize):
+            chunkConvIDs = convIDs[chunkStart:chunkStart + chunkSize]
+            try:
+                chunkBodies = self.browser.execute_async_script(getConversationBodiesScript,chunkConvIDs,mailbox)
+            except Exception as e:
+                log.warning(f"Couldn't pull a chunk of {len(chunkConvIDs)} email bodies through Outlook service calls: {e}")
+                continue
+            if not chunkBodies or "error" in chunkBodies:
+                log.warning(f"Couldn't pull email bodies through Outlook service calls: {chunkBodies.get('error') if chunkBodies else None}")
+                break
+            bodies.update({convID: chunkBodies.get(convID) for convID in chunkConvIDs})
+
+        log.debug(f"Pulled {len([body for body in bodies.values() if body])}/{len(convIDs)} email bodies through Outlook service calls.")
+        return bodies
+
+    # Helper method that clicks on the email card with the given ConvID, returning the message element that was open
+    # beforehand (if any) so callers can wait for it to be replaced. Since the message list is virtualized, rows that
+    # were scrolled away are no longer rendered - if the card isn't rendered, the list is scrolled back to the top and
+    # then down a page at a time until it is.
+    def __clickVisibleEmail(self,convID : str,maxScrolls=100):
+        previousMessageElement = self.browser.searchForElement(by=By.XPATH,value=self.openEmailFullContentXPath)
+        targetEmailCardXPath = f"{self.allVisibleMessagesXPath}//div[normalize-space(@data-convid)='{convID.strip()}']"
+
+        targetEmailCard = self.browser.searchForElement(by=By.XPATH,value=targetEmailCardXPath,timeout=1,scrollIntoView=True)
+        if not targetEmailCard:
+            self.browser.execute_script(self.scrollMessageListScript,True)
+            for i in range(maxScrolls + 1):
+                targetEmailCard = self.browser.searchForElement(by=By.XPATH,value=targetEmailCardXPath,timeout=2,scrollIntoView=True)
+                if targetEmailCard or not self.browser.execute_script(self.scrollMessageListScript,False):
+                    break
+        if not targetEmailCard:
+            error = ValueError(f"Couldn't find email with ConvID '{convID}' anywhere in the Outlook_{self.outlookType} message list.")
+            log.error(error)
+            raise error
+
+        targetEmailCard.click()
+        return previousMessageElement if previousMessageElement else None
+    # Helper method that waits until the open email is the conversation with the given ConvID, instead of sleeping for
+    # a fixed time. That's either when the reading pane itself reports the ConvID, or (when the pane doesn't carry one)
+    # when the selected row is the ConvID and the previously shown message (if given) has been replaced, since
+    # Outlook can also update the existing message element in place. Replacement is tested from Python, as
+    # chromedriver can't pass a detached element into a script at all.
+    def __waitForOpenEmail(self,convID,previousMessageElement=None,timeout=10):
+        readOpenConvIDScript = """
+            var readingPaneConv = document.querySelector("#ReadingPaneContainerId [data-convid]");
+            var selectedConv = document.querySelector("#MailList div[role='option'][aria-selected='true']");
+            var openMessage = document.evaluate(arguments[0],document,null,XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue;
+            return {"PaneConvID": readingPaneConv ? readingPaneConv.getAttribute("data-convid") : null,
+                    "SelectedConvID": selectedConv ? selectedConv.getAttribute("data-convid") : null,
+                    "MessageShown": openMessage !== null && openMessage.innerText.trim() !== ""};
+        """
+        # Helper to test whether the previously shown message has been detached from the page.
+        def previousReplaced():
+            if previousMessageElement is None:
+                return True
+            try:
+                previousMessageElement.tag_name
+                return False
+            except selenium.common.exceptions.StaleElementReferenceException:
+                return True
+
+        waitStart = time.time()
+        while time.time() - waitStart < timeout:
+            openState = self.browser.execute_script(readOpenConvIDScript,self.openEmailFullContentXPath)
+            paneShowsConv = (openState["PaneConvID"] or "").strip() == convID.strip()
+            selectedAndReplaced = (not openState["PaneConvID"] and (openState["SelectedConvID"] or "").strip() == convID.strip()
+                                   and previousReplaced())
+            if openState["MessageShown"] and (paneShowsConv or selectedAndReplaced):
+                return True
+            time.sleep(0.1)
+        return False
+
     #endregion === Email Reading ===
 
     #region === Inbox Management ===
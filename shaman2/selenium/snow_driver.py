@@ -1,3 +1,5 @@
+import re
+from urllib.parse import quote
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 from selenium.webdriver.common.keys import Keys
@@ -105,8 +107,50 @@ class SnowDriver:
                 naturalPause()
                 break
 
-    # Nav method to pull up a specific request number.
-    def navToRequest(self,requestNumber : str):
+    # Maps the prefix of a record number to the SNow table that stores it, for direct record navigation.
+    recordTablesByPrefix = {"SCTASK": "sc_task", "RITM": "sc_req_item", "REQ": "sc_request", "INC": "incident"}
+    # Nav method to pull up a specific request number. Tries to load the record directly by URL first, only falling
+    # back to the global search UI if the direct load doesn't land on the expected record.
+    def navToRequest(self,requestNumber : str,useDirectURL=True):
+        self.browser.switchToTab("Snow")
+        requestNumber = requestNumber.strip()
+
+        if useDirectURL and self.__navToRequestByURL(requestNumber=requestNumber):
+            return True
+        log.warning(f"Couldn't load request '{requestNumber}' directly by URL, falling back to global search.")
+        return self.__navToRequestBySearch(requestNumber=requestNumber)
+
+    # Helper method to load a record straight from its number, inside the standard SNow shell so that the task frame
+    # is still available. Returns True only once the loaded record's number has been verified.
+    def __navToRequestByURL(self,requestNumber : str,timeout=30):
+        recordPrefix = re.match(r"[A-Za-z]+",requestNumber)
+        recordTable = self.recordTablesByPrefix.get(recordPrefix.group(0).upper()) if recordPrefix else None
+        if recordTable is None:
+            log.warning(f"No known SNow table for request number '{requestNumber}'.")
+            return False
+
+        recordTarget = quote(f"{recordTable}.do?sysparm_query=number={requestNumber}",safe="")
+        self.browser.switch_to.default_content()
+        self.browser.get(f"https://sysco.service-now.com/now/nav/ui/classic/params/target/{recordTarget}")
+        self.__lastUsedTaskFrame = None
+
+        # Verify that the record that actually loaded is the one we asked for.
+        try:
+            self.Tasks_ScopeToTaskFrame()
+            recordNumberFieldXPath = f"//input[@id='sys_readonly.{recordTable}.number']"
+            recordNumberField = self.browser.searchForElement(by=By.XPATH,value=recordNumberFieldXPath,timeout=timeout,
+                                                              extraElementTests=[lambda el: el.get_attribute("value").strip().upper() == requestNumber.upper()])
+        except Exception as e:
+            log.warning(e)
+            recordNumberField = False
+        finally:
+            self.browser.switch_to.default_content()
+            self.browser.switchToTab("Snow")
+
+        return bool(recordNumberField)
+
+    # Helper method to pull up a request number through the global search typeahead.
+    def __navToRequestBySearch(self,requestNumber : str):
         self.browser.switchToTab("Snow")
         self.navToFavoritesMenuOption("Home")
 
@@ -154,6 +198,7 @@ class SnowDriver:
         if exactMatch:
             exactMatch.click()
             naturalPause()
+            return True
         # Sometimes, SNow randomly goes straight to the task. Here we test for a task frame to see if we're already there,
         # if we couldn't locate the exactMatch header.
         else:
@@ -168,6 +213,13 @@ class SnowDriver:
 
     #region === Task Management ===
 
+    validTaskStates = ["On Hold - With Customer","Pending","Open","Work in Progress",
+                       "Closed Complete","Closed Incomplete","Closed Skipped"]
+    # Backend values of the standard task states, used to filter by state server side in encoded queries. States that
+    # aren't listed here (like Sysco's custom On Hold state) are only filtered client side.
+    taskStateValues = {"Pending": "-5","Open": "1","Work in Progress": "2",
+                       "Closed Complete": "3","Closed Incomplete": "4","Closed Skipped": "7"}
+
     # This helper method handles scoping into the task frame of the (assumed currently open) task, simply
     # returning true if it's already open.
     def Tasks_ScopeToTaskFrame(self):
@@ -187,6 +239,80 @@ class SnowDriver:
         self.__lastUsedTaskFrame = taskFrame
         return True
 
+    allActivitiesXPath = "//ul[contains(@class,'activities-form')]/li"
+    # Script that reads every activity card in the (currently scoped) task frame at once. Returns a list of dicts
+    # with CreatedBy, Timestamp, BaseContent, HasEmail and EmailContent (null if the email iframe isn't rendered).
+    __readAllActivitiesScript = """
+        let allActivities = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        let readText = function(element) {
+            return element ? element.innerText.trim() : "";
+        };
+        let readEmailFrame = function(emailFrame) {
+            if (!emailFrame) {
+                return null;
+            }
+            try {
+                let frameDocument = emailFrame.contentDocument;
+                if (frameDocument && frameDocument.body && frameDocument.body.innerText.trim() !== "") {
+                    return frameDocument.body.innerText.trim();
+                }
+            } catch (e) {}
+            if (emailFrame.srcdoc) {
+                let parsedDocument = new DOMParser().parseFromString(emailFrame.srcdoc, "text/html");
+                return parsedDocument.body ? parsedDocument.body.textContent.trim() : null;
+            }
+            return null;
+        };
+
+        let activities = [];
+        for (let i = 0; i < allActivities.snapshotLength; i++) {
+            let activity = allActivities.snapshotItem(i);
+            let hasEmail = activity.querySelector("a[action-type='show-email'], a[action-type='hide-email']") !== null;
+            activities.push({
+                "CreatedBy": readText(activity.querySelector("span.sn-card-component-createdby")),
+                "Timestamp": readText(activity.querySelector("div.date-calendar")),
+                "BaseContent": readText(activity.querySelector(":scope > div:nth-of-type(3)")),
+                "HasEmail": hasEmail,
+                "EmailContent": hasEmail ? readEmailFrame(activity.querySelector("iframe.activity-stream-email-iframe")) : null
+            });
+        }
+        return activities;
+        """
+    # Helper method for reading the email of a single activity card whose iframe isn't rendered until it's opened.
+    # Assumes we're already scoped into the task frame, and toggles the card entirely via script so that the browser
+    # never has to switch frames.
+    def __readUnrenderedActivityEmail(self,activityIndex,timeout=10):
+        activityXPath = f"{self.allActivitiesXPath}[{activityIndex + 1}]"
+        toggleEmailScript = """
+            let activity = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            let toggleButton = activity ? activity.querySelector("a[action-type='" + arguments[1] + "']") : null;
+            if (toggleButton) {
+                toggleButton.click();
+            }
+            """
+        readEmailScript = """
+            let activity = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            let emailFrame = activity ? activity.querySelector("iframe.activity-stream-email-iframe") : null;
+            if (!emailFrame || !emailFrame.contentDocument || !emailFrame.contentDocument.body) {
+                return null;
+            }
+            let emailContent = emailFrame.contentDocument.body.innerText.trim();
+            return emailContent !== "" ? emailContent : null;
+            """
+
+        self.browser.execute_script(toggleEmailScript,activityXPath,"show-email")
+        emailContent = None
+        endTime = time.time() + timeout
+        while emailContent is None and time.time() < endTime:
+            emailContent = self.browser.execute_script(readEmailScript,activityXPath)
+            if emailContent is None:
+                time.sleep(0.2)
+        self.browser.execute_script(toggleEmailScript,activityXPath,"hide-email")
+
+        if emailContent is None:
+            log.warning(f"Couldn't read the email of activity {activityIndex + 1} after {timeout} seconds.")
+        return emailContent
+
     # This method assumes a task is currently open, and it reads the full task into a task object.
     def Tasks_ReadFullTask(self):
         self.browser.switchToTab("Snow")
@@ -206,35 +332,17 @@ class SnowDriver:
         newTask["ShortDescription"] = self.browser.find_element(by=By.XPATH,value="//input[@id='sc_task.short_description']").get_attribute("value")
         newTask["Description"] = self.browser.find_element(by=By.XPATH,value="//textarea[@id='sc_task.description']").get_attribute("value")
 
-        # Read all activities
-        allActivitiesXPath = "//ul[contains(@class,'activities-form')]/li"
-        allActivities = self.browser.find_elements(by=By.XPATH,value=allActivitiesXPath)
-        for i in range(len(allActivities)):
-            createdBy = self.browser.find_element(by=By.XPATH,value=f"{allActivitiesXPath}[{i+1}]//span[@class='sn-card-component-createdby']").text
-            timestamp = self.browser.find_element(by=By.XPATH,value=f"{allActivitiesXPath}[{i+1}]//div[@class='date-calendar']").text
-            baseContent = self.browser.find_element(by=By.XPATH,value=f"{allActivitiesXPath}[{i+1}]/div[3]").text
-
-            # Check if there's an attached email and, if so, temporarily connect to iframe and add it to the activity.
-            showEmailButton = self.browser.searchForElement(by=By.XPATH,value=f"{allActivitiesXPath}[{i+1}]//a[@action-type='show-email']")
-            if showEmailButton:
-                showEmailButton.click()
-
-                emailFrameXPath = f"{allActivitiesXPath}[{i+1}]//iframe[@class='card activity-stream-email-iframe']"
-                emailFrame = self.browser.searchForElement(by=By.XPATH,value=emailFrameXPath,timeout=10)
-                self.browser.switch_to.frame(emailFrame)
-                emailContent = self.browser.searchForElement(by=By.XPATH,value="//body",timeout=10).text
-                self.browser.switch_to.default_content()
-                self.browser.switchToTab("Snow")
-
-                # Scope back to task frame.
-                self.Tasks_ScopeToTaskFrame()
-
-                hideEmailButton = self.browser.searchForElement(by=By.XPATH,value=f"{allActivitiesXPath}[{i + 1}]//a[@action-type='hide-email']",timeout=10)
-                hideEmailButton.click()
-            else:
-                emailContent = None
+        # Read all activities in a single pass. Email bodies are read straight out of each card's email iframe
+        # (either its live document or its srcdoc), so the UI never has to be toggled.
+        allActivities = self.browser.execute_script(self.__readAllActivitiesScript,self.allActivitiesXPath)
+        for i,activity in enumerate(allActivities):
+            emailContent = activity["EmailContent"]
+            # Some cards only render their email iframe once opened - only these fall back to the slow path.
+            if activity["HasEmail"] and emailContent is None:
+                emailContent = self.__readUnrenderedActivityEmail(activityIndex=i)
 
-            newTask.addActivity(createdBy=createdBy,timestamp=timestamp,baseContent=baseContent,emailContent=emailContent)
+            newTask.addActivity(createdBy=activity["CreatedBy"],timestamp=activity["Timestamp"],
+                                baseContent=activity["BaseContent"],emailContent=emailContent)
 
         # Return the browser to default frame.
         self.browser.switch_to.default_content()
@@ -242,6 +350,88 @@ class SnowDriver:
         naturalPause()
         return newTask
 
+    # Script that pulls every record matching an encoded query straight from a table's list view, in a single request
+    # through the JSONv2 processor. Display values are included alongside raw values (prefixed with "dv_").
+    __readListRecordsScript = """
+        let callback = arguments[arguments.length - 1];
+        let listURL = "/" + arguments[0] + "_list.do?JSONv2&displayvalue=all&sysparm_query=" + encodeURIComponent(arguments[1]);
+        fetch(listURL, {credentials: "same-origin", headers: {"Accept": "application/json"}})
+            .then(response => response.json())
+            .then(data => callback(data.records || []))
+            .catch(error => callback({"error": String(error)}));
+    """
+    # Reads every task in the given assignmentGroup's queue (optionally only those in the given state) from the sc_task
+    # list view, and builds a SnowTask for each without ever opening the task itself. Activities are NOT read here.
+    def Tasks_ListQueue(self,assignmentGroup,state=None):
+        self.browser.switchToTab("Snow")
+        self.browser.switch_to.default_content()
+
+        if state is not None:
+            state = state.strip()
+            if state not in self.validTaskStates:
+                error = ValueError(f"Tried to list task queue with invalid State: '{state}'")
+                log.error(error)
+                raise error
+        # The state is filtered server side whenever its backend value is known, and closed tasks are filtered out
+        # server side unless a closed state was specifically requested.
+        listQuery = f"assignment_group.name={assignmentGroup.strip()}"
+        if state is not None and state in self.taskStateValues:
+            listQuery += f"^state={self.taskStateValues[state]}"
+        if state is None or not state.startswith("Closed"):
+            listQuery += "^active=true"
+        listQuery += "^ORDERBYnumber"
+
+        allTasks = self.__listTasks(listQuery=listQuery,state=state)
+
+        log.info(f"Read {len(allTasks)} tasks from the '{assignmentGroup}' queue{f' with state {state}' if state else ''}.")
+        return allTasks
+
+    # Reads every task on the given taskNumbers from the sc_task list view in a single request, the same way as
+    # Tasks_ListQueue. Tasks are returned in the order given, and any task that couldn't be found is skipped.
+    def Tasks_ListByNumbers(self,taskNumbers : list):
+        self.browser.switchToTab("Snow")
+        self.browser.switch_to.default_content()
+
+        taskNumbers = [str(taskNumber).strip().upper() for taskNumber in taskNumbers]
+        listQuery = f"numberIN{','.join(taskNumbers)}^ORDERBYnumber"
+        allTasks = {task["Number"]: task for task in self.__listTasks(listQuery=listQuery)}
+
+        log.info(f"Read {len(allTasks)} of {len(taskNumbers)} requested tasks from the task list.")
+        return [allTasks[taskNumber] for taskNumber in taskNumbers if taskNumber in allTasks]
+    # Helper method to open the sc_task list view for the given listQuery, then read every record on it into a SnowTask.
+    def __listTasks(self,listQuery,state=None):
+        # Open the list view itself, so that the queue is visible and the request is made from within SNow's session.
+        listTarget = quote(f"sc_task_list.do?sysparm_query={listQuery}",safe="")
+        self.browser.get(f"https://sysco.service-now.com/now/nav/ui/classic/params/target/{listTarget}")
+        self.browser.searchForElement(by=By.CSS_SELECTOR,value="#gsft_main",timeout=30,
+                                      shadowRootStack=[{"by": By.XPATH,"value": "//*[@global-navigation-config]"}],raiseError=True)
+        self.__lastUsedTaskFrame = None
+
+        allRecords = self.browser.execute_async_script(self.__readListRecordsScript,"sc_task",listQuery)
+        if type(allRecords) is dict:
+            error = RuntimeError(f"Couldn't read task list for query '{listQuery}': {allRecords['error']}")
+            log.error(error)
+            raise error
+
+        allTasks = []
+        for record in allRecords:
+            # Guard for states that couldn't be filtered server side.
+            if state is not None and record.get("dv_state") != state:
+                continue
+            newTask = SnowTask()
+            newTask["Number"] = record.get("number")
+            newTask["AssignmentGroup"] = record.get("dv_assignment_group")
+            newTask["AssignedTo"] = record.get("dv_assigned_to")
+            newTask["Request"] = record.get("dv_request")
+            newTask["RequestItem"] = record.get("dv_request_item")
+            newTask["Priority"] = record.get("dv_priority")
+            newTask["State"] = record.get("dv_state")
+            newTask["ShortDescription"] = record.get("short_description")
+            newTask["Description"] = record.get("description") or ""
+            allTasks.append(newTask)
+
+        return allTasks
+
     # Various write methods for each relevant part of the task
     def Tasks_WriteAssignmentGroup(self,assignmentGroup):
         self.browser.switchToTab("Snow")
@@ -270,9 +460,7 @@ class SnowDriver:
         self.Tasks_ScopeToTaskFrame()
         state = state.strip()
 
-        validStates = ["On Hold - With Customer","Pending","Open","Work in Progress",
-                       "Closed Complete","Closed Incomplete","Closed Skipped"]
-        if state not in validStates:
+        if state not in self.validTaskStates:
             error = ValueError(f"Tried to set task's State to invalid value: '{state}'")
             log.error(error)
             raise error
@@ -386,4 +574,94 @@ class SnowDriver:
         self.browser.switch_to.default_content()
         self.browser.switchToTab("Snow")
 
+    # Maps each supported key of Tasks_ApplyChanges to its form field, and to the table its display value is looked up
+    # in for reference fields (None for plain/choice fields).
+    applyChangesFields = {"AssignmentGroup": {"Field": "assignment_group", "ReferenceTable": "sys_user_group"},
+                          "AssignedTo": {"Field": "assigned_to", "ReferenceTable": "sys_user"},
+                          "State": {"Field": "state", "ReferenceTable": None},
+                          "Priority": {"Field": "priority", "ReferenceTable": None},
+                          "Note": {"Field": "work_notes", "ReferenceTable": None},
+                          "AdditionalNote": {"Field": "comments", "ReferenceTable": None}}
+    # Script that writes all given field changes through g_form at once, skipping any that already hold the target value.
+    # Choice fields are given by label and matched against their dropdown options. Returns the keys that actually
+    # changed, and any choice labels that couldn't be found.
+    __applyFormChangesScript = """
+        let allChanges = arguments[0];
+        let changedKeys = [];
+        let missingKeys = [];
+        for (let change of allChanges) {
+            let newValue = change.Value;
+            if (change.Label !== null) {
+                let control = g_form.getControl(change.Field);
+                let option = control ? Array.from(control.options).find(o => o.text.trim() === change.Label) : null;
+                if (!option) { missingKeys.push(change.Key); continue; }
+                newValue = option.value;
+            }
+            if (g_form.getValue(change.Field) === newValue) { continue; }
+            if (change.DisplayValue !== null) { g_form.setValue(change.Field, newValue, change.DisplayValue); }
+            else { g_form.setValue(change.Field, newValue); }
+            changedKeys.push(change.Key);
+        }
+        return {"Changed": changedKeys, "Missing": missingKeys};
+    """
+    # This method applies a whole set of changes to the currently open task and saves it once. changes is a dict using
+    # the keys of applyChangesFields (plus "Tags", a list of tag names), EX: {"State": "Work in Progress", "Tags": ["Upland/Cimpl"]}.
+    # Returns the list of keys that actually changed on the task.
+    def Tasks_ApplyChanges(self,changes : dict,update=True):
+        self.browser.switchToTab("Snow")
+        changes = dict(changes)
+        tagNames = changes.pop("Tags",[])
+
+        for key in changes.keys():
+            if key not in self.applyChangesFields.keys():
+                error = ValueError(f"Tried to apply change to unsupported task field: '{key}'")
+                log.error(error)
+                raise error
+        if "State" in changes.keys() and changes["State"].strip() not in self.validTaskStates:
+            error = ValueError(f"Tried to set task's State to invalid value: '{changes['State']}'")
+            log.error(error)
+            raise error
+
+        self.Tasks_ScopeToTaskFrame()
+
+        # Build the full list of form changes, resolving reference fields (groups, users) to their sys_ids first.
+        formChanges = []
+        for key,value in changes.items():
+            value = value.strip()
+            thisField = self.applyChangesFields[key]
+            thisChange = {"Key": key, "Field": thisField["Field"], "Value": value, "DisplayValue": None, "Label": None}
+            if thisField["ReferenceTable"]:
+                foundRecords = self.browser.execute_async_script(self.__readListRecordsScript,thisField["ReferenceTable"],f"name={value}^active=true")
+                if type(foundRecords) is dict or len(foundRecords) == 0:
+                    error = ValueError(f"Couldn't find a '{thisField['ReferenceTable']}' record named '{value}' to write to {key}.")
+                    log.error(error)
+                    raise error
+                thisChange["Value"] = foundRecords[0]["sys_id"]
+                thisChange["DisplayValue"] = value
+            elif key in ["State","Priority"]:
+                thisChange["Label"] = value
+            formChanges.append(thisChange)
+
+        changeResults = self.browser.execute_script(self.__applyFormChangesScript,formChanges)
+        if changeResults["Missing"]:
+            error = ValueError(f"Couldn't find options for task fields {changeResults['Missing']} when applying changes: {changes}")
+            log.error(error)
+            raise error
+        changedKeys = changeResults["Changed"]
+
+        # Tags aren't form fields, so they still go through the tag menu (which doesn't save on its own).
+        for tagName in tagNames:
+            self.Tasks_AddTag(tagName)
+        if tagNames:
+            changedKeys.append("Tags")
+
+        if update and changedKeys:
+            self.Tasks_Update()
+        else:
+            self.browser.switch_to.default_content()
+            self.browser.switchToTab("Snow")
+
+        log.info(f"Applied changes to task, and changed fields: {changedKeys}")
+        return changedKeys
+
     #endregion === Task Management ===
\ No newline at end of file
@@ -11,6 +11,7 @@ from shaman2.utilities.async_sound import playsoundAsync
 from shaman2.utilities.shaman_utils import convertServiceIDFormat,normalizeName, BAD_ELEMENT_EXCEPTIONS
 from shaman2.utilities.action_handler import action,ActionResult,StatusCode
 from shaman2.network.sheets_sync import syscoData
+from shaman2.data_storage.verizon_storage import verizonCatalog, areaCodeCache
 
 
 class VerizonDriver:
@@ -278,7 +279,8 @@ class VerizonDriver:
         # Wait for the Order header to become clickable again (meaning loading has finished.) Yes, the typo is
         # intentional lmfao
         viewOrdersHeaderXPath = "//div[contains(@class,'view-orders-conatiner')]//h2[contains(text(),'Orders')]"
-        self.browser.searchForElement(by=By.XPATH, value=viewOrdersHeaderXPath, minSearchTime=3,timeout=120,
+        self.browser.waitForNetworkIdle()
+        self.browser.searchForElement(by=By.XPATH, value=viewOrdersHeaderXPath,timeout=120,
                                       testClickable=True, testLiteralClick=True)
 
         foundOrderLocator = self.browser.searchForElement(by=By.XPATH,value=f"//div[text()='{orderNumber}']",timeout=1)
@@ -407,7 +409,8 @@ class VerizonDriver:
 
                 # Try to let the upgrade page load back before giving control back.
                 upgradeDateHeaderXPath = "//sub[text()='Upgrade date']"
-                self.browser.searchForElement(by=By.XPATH,value=upgradeDateHeaderXPath,testClickable=True,testLiteralClick=True,timeout=30,minSearchTime=2)
+                self.browser.waitForNetworkIdle()
+                self.browser.searchForElement(by=By.XPATH,value=upgradeDateHeaderXPath,testClickable=True,testLiteralClick=True,timeout=30)
                 log.warning("Line has the MTN Pending error - can't upgrade at the moment.")
                 return ActionResult(status=StatusCode.VERIZON_MTN_PENDING)
             # Handle navigating the early upgrade options and ETF waiver application
@@ -440,8 +443,9 @@ class VerizonDriver:
             # If we get to the "Shop Devices" screen, we've completed getting from the line viewer to upgrade wizard
             elif alias == "ShopDevices":
                 # We make sure it's literally clickable before proceeding.
+                self.browser.waitForNetworkIdle()
                 self.browser.searchForElement(element=foundElement, testClickable=True,
-                                              testLiteralClick=True, timeout=30, minSearchTime=3,raiseError=True)
+                                              testLiteralClick=True, timeout=30,raiseError=True)
                 return ActionResult(status=StatusCode.SUCCESS,data={"UpgradeEligible" : upgradeEligible})
 
         # If we've exited the loop, that means we went through 10 iterations of logic without finding end condition,
@@ -449,6 +453,44 @@ class VerizonDriver:
         log.error(f"Went through more than 10 iterations of logic without exiting - review process.",exc_info=True)
         return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
 
+    # Assumes we're on the line viewer for a specific line, and reads all upgrade-relevant info off of the page
+    # in a single script, without clicking anything. Returns a dict with UpgradeEligible (True/False/None if neither
+    # upgrade button is present), the raw UpgradeDate text, and whether Verizon is already showing a pending
+    # order or change on the line.
+    @action()
+    def LineViewer_ReadUpgradeInfo(self):
+        readUpgradeInfoScript = """
+            function findByXPath(xpath) {
+                return document.evaluate(xpath,document,null,XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue;
+            }
+            var eligibleButton = findByXPath("//button[contains(text(),'Upgrade device')]");
+            var ineligibleButton = findByXPath("//a[@type='button'][contains(text(),'Upgrade Options')]");
+            var upgradeDateHeader = findByXPath("//sub[text()='Upgrade date']");
+            var upgradeDate = null;
+            if (upgradeDateHeader && upgradeDateHeader.parentElement) {
+                upgradeDate = upgradeDateHeader.parentElement.textContent.replace('Upgrade date','').trim();
+            }
+            // Only alert/banner containers on the line viewer itself count, not nav items, help text or order rows.
+            var pendingBanner = Array.from(document.querySelectorAll("[role='alert'], [class*='alert'], [class*='banner']")).find(function(container) {
+                return !container.closest("nav, header, footer, table") && /pending (order|change)/i.test(container.innerText || "");
+            });
+            return {
+                "HasUpgradeDateHeader": upgradeDateHeader !== null,
+                "UpgradeEligible": eligibleButton ? true : (ineligibleButton ? false : null),
+                "UpgradeDate": upgradeDate,
+                "HasPendingBanner": pendingBanner !== undefined
+            };
+        """
+        upgradeInfo = self.browser.execute_script(readUpgradeInfoScript)
+        if not upgradeInfo or not upgradeInfo["HasUpgradeDateHeader"]:
+            log.error("Couldn't find the upgrade date header while reading upgrade info - are we on the line viewer?")
+            return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
+
+        upgradeDateMatch = re.search(r"\d{1,2}/\d{1,2}/\d{4}",upgradeInfo["UpgradeDate"] or "")
+        return ActionResult(status=StatusCode.SUCCESS,data={"UpgradeEligible" : upgradeInfo["UpgradeEligible"],
+                                                            "UpgradeDate" : upgradeDateMatch.group(0) if upgradeDateMatch else None,
+                                                            "HasPendingBanner" : upgradeInfo["HasPendingBanner"]})
+
 
     #endregion === Line Viewer ===
 
@@ -465,7 +507,8 @@ class VerizonDriver:
 
         # Now we wait to ensure that we've fully navigated to the newDevice screen.
         shopDevicesHeaderXPath = "//h2[contains(text(),'Shop Devices')]"
-        testResult = self.browser.searchForElement(by=By.XPATH,value=shopDevicesHeaderXPath,timeout=120,minSearchTime=5,
+        self.browser.waitForNetworkIdle()
+        testResult = self.browser.searchForElement(by=By.XPATH,value=shopDevicesHeaderXPath,timeout=120,
                                       testClickable=True,testLiteralClick=True)
         if testResult:
             return ActionResult(status=StatusCode.SUCCESS)
@@ -495,7 +538,8 @@ class VerizonDriver:
         haveClearedCart = False
         for i in range(10):
             # First, get the current page we're on.
-            foundElement, elementName = self.browser.searchForElement(by=By.XPATH, value=clearCartPagesMap,minSearchTime=5,
+            self.browser.waitForNetworkIdle()
+            foundElement, elementName = self.browser.searchForElement(by=By.XPATH, value=clearCartPagesMap,
                                                                    testClickable=True,timeout=60, raiseError=True, logError=False)
 
             # If the cart is empty, we're done.
@@ -530,11 +574,22 @@ class VerizonDriver:
         # we assume it errored out and that we're now on an ambiguous page
         return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
 
+    # Helper method to pull a product SKU out of a Verizon product page URL, if it has one.
+    def __readSKUFromURL(self,productURL):
+        skuMatch = re.search(r"sku(?:id)?[=/]([A-Za-z0-9-]+)",productURL,re.IGNORECASE)
+        return skuMatch.group(1) if skuMatch else None
+    productPageRoutePattern = r"#/(?:device|accessory)-(?:details|pdp)\b|/pdp[/?#]"
+    # Helper method to test whether a URL actually identifies a single product page (by SKU or by route), as opposed
+    # to a gridwall or search page that just happens to be showing a product's quick view, so that only the former
+    # get cached.
+    def __isProductPageURL(self,url):
+        return bool(self.__readSKUFromURL(url) or re.search(self.productPageRoutePattern,url,re.IGNORECASE))
+
     # Assumes we're on the device selection page. Given a Universal Device ID, searches for that
     # device (if supported) on Verizon. # TODO move the search term stuff to higher level - shouldn't need syscoSheet in this file technically
     # TODO this function is getting quite slow, which is pretty first world problem esque, but still
     @action()
-    def DeviceSelection_SearchSelectDevice(self,deviceID,orderPath="NewInstall",searchAttempts = 3):
+    def DeviceSelection_SearchSelectDevice(self,deviceID,orderPath="NewInstall",searchAttempts = 3,useCatalogCache=True):
         targetDeviceCardXPath = f"//div/div[contains(@class,'device-name')][normalize-space(translate(text(),'ABCDEFGHIJKLMNOPQRSTUVWXYZ','abcdefghijklmnopqrstuvwxyz'))='{syscoData["Devices"][deviceID]["Verizon Wireless New Install Card Name"].strip().lower()}']"
         targetDeviceOpenButtonXPath = f"{targetDeviceCardXPath}/following-sibling::div//button[contains(@class,'quick-view-btn')]"
         if orderPath == "NewInstall":
@@ -543,6 +598,19 @@ class VerizonDriver:
             deviceDetailsXPath = f"//div[contains(@class,'pdp-header-section')]//div[normalize-space(text())='{syscoData["Devices"][deviceID]["Verizon Wireless Upgrade Card Name"]}']"
         shopDevicesHeaderXPath = "//h2[contains(text(),'Shop Devices')]"
 
+        # If this device's product page is cached, load it directly. Only NewInstalls are cached, as the upgrade device
+        # pages are tied to the line being upgraded.
+        if useCatalogCache and orderPath == "NewInstall":
+            cachedDevice = verizonCatalog.getDevice(deviceID,orderPath=orderPath)
+            if cachedDevice:
+                self.browser.get(cachedDevice["URL"])
+                if self.browser.searchForElement(by=By.XPATH,value=deviceDetailsXPath,timeout=30,testClickable=True):
+                    return ActionResult(status=StatusCode.SUCCESS,data="Cached")
+                # If the cached page didn't load properly, forget it and fall back to searching.
+                log.warning(f"Cached Verizon product page for device '{deviceID}' failed to load, falling back to search.")
+                verizonCatalog.removeDevice(deviceID,orderPath=orderPath)
+                self.shopNewDevice()
+
         # Helper method to search for a device one time, and wait until (roughly) the loading screen is gone.
         def searchDevice(clearFilters=False):
             if clearFilters:
@@ -557,7 +625,8 @@ class VerizonDriver:
             self.browser.safeClick(element=searchButton,timeout=60)
 
             # We wait for the "shop devices" header to be clickable again, to roughly assume its finished loading.
-            self.browser.searchForElement(by=By.XPATH,value=shopDevicesHeaderXPath,timeout=20,minSearchTime=4,testClickable=True,testLiteralClick=True)
+            self.browser.waitForNetworkIdle()
+            self.browser.searchForElement(by=By.XPATH,value=shopDevicesHeaderXPath,timeout=20,testClickable=True,testLiteralClick=True)
         # Helper method to try to select the device by its card.
         def selectDevice():
             clickResult = self.browser.safeClick(by=By.XPATH,value=targetDeviceOpenButtonXPath, timeout=10,scrollIntoView=True,raiseError=False)
@@ -576,8 +645,6 @@ class VerizonDriver:
         for attempt in range(searchAttempts):
             # Search device.
             searchDevice(clearFilters=tryClearFilters)
-            # Add a small post-search wait to avoid weird Verizon shit
-            time.sleep(3)
             # Try to select the device card.
             selectResult = selectDevice()
 
@@ -592,6 +659,14 @@ class VerizonDriver:
                 continue
 
         if selectionSuccessful:
+            # Remember this device's product page for next time, once we're sure it's actually loaded and that the
+            # URL points at this product rather than at the search results behind a quick view.
+            if orderPath == "NewInstall" and self.browser.searchForElement(by=By.XPATH,value=deviceDetailsXPath,timeout=15,testClickable=True):
+                productURL = self.browser.current_url
+                if self.__isProductPageURL(productURL):
+                    verizonCatalog.addDevice(deviceID,url=productURL,orderPath=orderPath,sku=self.__readSKUFromURL(productURL))
+                else:
+                    log.debug(f"Not caching Verizon page for device '{deviceID}', as '{productURL}' doesn't identify a product.")
             return ActionResult(status=StatusCode.SUCCESS)
         # Otherwise, raise an error.
         else:
@@ -660,7 +735,8 @@ class VerizonDriver:
             foundColor = False
             for colorboxOption in allColorboxOptions:
                 # First, test if the previous selected color was correct:
-                currentlySelectedColor = self.browser.searchForElement(by=By.XPATH,value=currentColorHeaderXPath,timeout=30,testClickable=True,minSearchTime=1).text.strip().lower()
+                self.browser.waitForNetworkIdle()
+                currentlySelectedColor = self.browser.searchForElement(by=By.XPATH,value=currentColorHeaderXPath,timeout=30,testClickable=True).text.strip().lower()
                 if currentlySelectedColor == colorName.lower():
                     foundColor = True
                     break
@@ -670,6 +746,8 @@ class VerizonDriver:
                     continue
 
             if foundColor:
+                if deviceID:
+                    verizonCatalog.setDeviceOptions(deviceID,orderPath=orderPath,color=colorName,size=sizeString)
                 return ActionResult(status=StatusCode.SUCCESS)
             else:
                 log.warning(f"Supplied color '{colorName}' does not seem to exist in Verizon Wireless for the searched device!")
@@ -689,6 +767,29 @@ class VerizonDriver:
                 #TODO GLUUUUEEEE
                 raise
                 return ActionResult(status=StatusCode.VERIZON_MISSING_COLOR)
+    # Sets the quantity of the currently viewed device, for multi-line new installs. Verizon uses either a dropdown or
+    # a plain input for this, depending on the device.
+    @action()
+    def DeviceSelection_DeviceView_SelectQuantity(self,quantity : int):
+        quantitySelectXPath = "//select[contains(@id,'quantity') or contains(@formcontrolname,'quantity')]"
+        quantityInputXPath = "//input[contains(@id,'quantity') or contains(@formcontrolname,'quantity')]"
+        foundElement,elementName = self.browser.searchForElement(by=By.XPATH,value={quantitySelectXPath: "Select", quantityInputXPath: "Input"},
+                                                                  timeout=30,testClickable=True,scrollIntoView=True,raiseError=True)
+        if elementName == "Select":
+            Select(foundElement).select_by_visible_text(str(quantity))
+        else:
+            foundElement.send_keys(Keys.CONTROL + "a")
+            foundElement.send_keys(Keys.BACKSPACE)
+            foundElement.send_keys(str(quantity))
+            foundElement.send_keys(Keys.TAB)
+
+        # Confirm that Verizon actually took the new quantity.
+        confirmedQuantity = foundElement.get_attribute("value").strip()
+        if confirmedQuantity == str(quantity):
+            return ActionResult(status=StatusCode.SUCCESS)
+        else:
+            log.warning(f"Tried to set device quantity to {quantity}, but Verizon shows '{confirmedQuantity}'.")
+            return ActionResult(status=StatusCode.VERIZON_CART_INCONSISTENCY)
     @action()
     def DeviceSelection_DeviceView_AddToCartAndContinue(self,orderPath="NewInstall"):
         if orderPath == "NewInstall":
@@ -714,7 +815,8 @@ class VerizonDriver:
             self.browser.safeClick(element=buyNowButton,timeout=120,scrollIntoView=True)
 
             # Wait for Shopping Cart page to load to confirm successful device add
-            testResult = self.browser.searchForElement(by=By.XPATH,value=self.shoppingCartHeaderXPaths,timeout=60,minSearchTime=5)
+            self.browser.waitForNetworkIdle()
+            testResult = self.browser.searchForElement(by=By.XPATH,value=self.shoppingCartHeaderXPaths,timeout=60)
         if testResult:
             return ActionResult(status=StatusCode.SUCCESS)
         else:
@@ -723,7 +825,12 @@ class VerizonDriver:
     # Assumes we're on the accessory selection page. Given a Universal Accessory ID, searches
     # for that accessory (if supported) on Verizon.
     @action()
-    def AccessorySelection_SearchForAccessory(self,accessoryID):
+    def AccessorySelection_SearchForAccessory(self,accessoryID,useCatalogCache=True):
+        # Accessories with a cached product page don't need to be searched for at all, as AddAccessoryToCart will
+        # load the page directly.
+        if useCatalogCache and verizonCatalog.getAccessory(accessoryID):
+            return ActionResult(status=StatusCode.SUCCESS,data="Cached")
+
         searchBox = self.browser.searchForElement(by=By.XPATH,value="//input[@id='search']",timeout=15,testClickable=True)
         searchButton = self.browser.searchForElement(by=By.XPATH,value="//span[@class='onedicon icon-search']",timeout=15,testClickable=True)
 
@@ -739,10 +846,34 @@ class VerizonDriver:
         else:
             return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
     @action()
-    def AccessorySelection_AddAccessoryToCart(self,accessoryID):
-        targetAccessoryCardXPath = f"//app-accessory-tile/div/div/div[contains(@class,'product-name')][contains(text(),'{syscoData["Accessories"][accessoryID]["Verizon Wireless Card Name"]}')]//ancestor::div[contains(@class,'accessory-card')]"
-        targetAccessoryCard = self.browser.searchForElement(by=By.XPATH,value=targetAccessoryCardXPath,timeout=30,testClickable=True,scrollIntoView=True)
-        targetAccessoryCard.click()
+    def AccessorySelection_AddAccessoryToCart(self,accessoryID,useCatalogCache=True):
+        addToCartButtonXPath = "//button[contains(@class,'addToCartBtn')]"
+        shopAccessoriesHeaderXPath = "//section[contains(@class,'top-section')]//div[contains(text(),'Shop Accessories')]"
+
+        # Try to open the accessory straight from its cached product page first.
+        openedFromCache = False
+        cachedAccessory = verizonCatalog.getAccessory(accessoryID) if useCatalogCache else None
+        if cachedAccessory:
+            self.browser.get(cachedAccessory["URL"])
+            if self.browser.searchForElement(by=By.XPATH,value=addToCartButtonXPath,timeout=30,testClickable=True):
+                openedFromCache = True
+            else:
+                # If the cached page didn't load properly, forget it and fall back to searching.
+                log.warning(f"Cached Verizon product page for accessory '{accessoryID}' failed to load, falling back to search.")
+                verizonCatalog.removeAccessory(accessoryID)
+                self.browser.back()
+                self.browser.searchForElement(by=By.XPATH,value=shopAccessoriesHeaderXPath,timeout=60,testClickable=True,testLiteralClick=True)
+                self.AccessorySelection_SearchForAccessory(accessoryID=accessoryID,useCatalogCache=False)
+
+        if not openedFromCache:
+            targetAccessoryCardXPath = f"//app-accessory-tile/div/div/div[contains(@class,'product-name')][contains(text(),'{syscoData["Accessories"][accessoryID]["Verizon Wireless Card Name"]}')]//ancestor::div[contains(@class,'accessory-card')]"
+            targetAccessoryCard = self.browser.searchForElement(by=By.XPATH,value=targetAccessoryCardXPath,timeout=30,testClickable=True,scrollIntoView=True)
+            targetAccessoryCard.click()
+            # Remember this accessory's product page for next time, if its URL actually identifies the product.
+            if (self.browser.searchForElement(by=By.XPATH,value=addToCartButtonXPath,timeout=30,testClickable=True) and
+                    self.__isProductPageURL(self.browser.current_url)):
+                verizonCatalog.addAccessory(accessoryID,url=self.browser.current_url,sku=self.__readSKUFromURL(self.browser.current_url),
+                                            color=syscoData["Accessories"][accessoryID]["Verizon Wireless Color"].strip() or None)
 
         # If color is specified, handle that here.
         colorName = syscoData["Accessories"][accessoryID]["Verizon Wireless Color"].strip()
@@ -769,11 +900,11 @@ class VerizonDriver:
                 return ActionResult(status=StatusCode.VERIZON_MISSING_COLOR)
 
         # Click add to cart button
-        addToCartButtonXPath = "//button[contains(@class,'addToCartBtn')]"
         addToCartButton = self.browser.searchForElement(by=By.XPATH,value=addToCartButtonXPath,timeout=30,testClickable=True,scrollIntoView=True)
         addToCartButton.click()
 
-        time.sleep(4)
+        # Wait for the add to cart request to actually finish.
+        self.browser.waitForNetworkIdle()
 
         # Wait for confirmation that it was added to the cart.
         #addedToCartConfirmationXPath = "//div[contains(text(),'Your new accessory has been added to your cart.')]"
@@ -788,7 +919,6 @@ class VerizonDriver:
         self.browser.safeClick(by=By.XPATH,value=backButtonXPath,timeout=30,scrollIntoView=True)
 
         # Wait for accessories base page to load
-        shopAccessoriesHeaderXPath = "//section[contains(@class,'top-section')]//div[contains(text(),'Shop Accessories')]"
         testResult = self.browser.searchForElement(by=By.XPATH,value=shopAccessoriesHeaderXPath,timeout=60,
                                                    testClickable=True,testLiteralClick=True)
 
@@ -809,7 +939,8 @@ class VerizonDriver:
             testResult = self.browser.searchForElement(by=By.XPATH,value=selectPlanHeaderXPath,timeout=120,testClickable=True,testLiteralClick=True)
         else:
             # If this is an upgrade, the next page should be back on the shopping cart.
-            testResult = self.browser.searchForElement(by=By.XPATH,value=self.shoppingCartHeaderXPaths,timeout=60,minSearchTime=5)
+            self.browser.waitForNetworkIdle()
+            testResult = self.browser.searchForElement(by=By.XPATH,value=self.shoppingCartHeaderXPaths,timeout=60)
 
         if testResult:
             return ActionResult(status=StatusCode.SUCCESS)
@@ -883,8 +1014,8 @@ class VerizonDriver:
         else:
             return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
 
-    # Assumes we're on the number selection page. Given an initial zip code, tests zip code and sequential
-    # zip codes to determine, select, and apply the first available.
+    # Assumes we're on the number selection page. Given an initial zip code, tests the zip code and then learned and
+    # sequential nearby zip codes (see AreaCodeCache) to determine, select, and apply the first available.
     @action()
     def NumberSelection_SelectAreaCode(self,zipCode):
         # First we check for the number assignment page header to load, meaning we're on the right page.
@@ -893,68 +1024,85 @@ class VerizonDriver:
 
         # Then, we check to ensure the spinner is gone, to make sure the page has "settled" before interacting with it.
         zipCodeSpinnerXPath = "//div[contains(@class,'spinner')]"
-        self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True,minSearchTime=3)
+        self.browser.waitForNetworkIdle()
+        self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True)
 
-        zipCode = zipCode.split("-")[0].strip()
+        zipCode = zipCode.split("-")[0].strip().zfill(5)
         zipCodeFormXPath = "//input[@id='zip']"
-        zipCodeForm = self.browser.searchForElement(by=By.XPATH,value=zipCodeFormXPath,timeout=60,testClickable=True)
         areaCodeDropdownXPath = "//div[contains(@class,'area-dropdown')]"
         areaCodeScrollAreaXPath = "//div[contains(@class,'dropdown-scroll') or contains(@class,'dd-list')]"
-        areaCodeResultsXPath = f"{areaCodeDropdownXPath}//div/ul/li[@class='ng-star-inserted'][1]"
+        areaCodeResultsXPath = f"{areaCodeDropdownXPath}//div/ul/li[@class='ng-star-inserted']"
         noNumbersAvailableXPath = "//div[contains(text(),'The city or zip code you entered has no numbers available')]"
 
-        # Wait for the spinner to disappear if it's there again.
-        self.browser.searchForElement(by=By.XPATH,value=zipCodeSpinnerXPath,timeout=30,invertedSearch=True,minSearchTime=3)
-        zipCodeSpinnerXPath = ""
-        zipCodeForm.clear()
-        zipCodeForm.send_keys(f"{zipCode:05}")
+        # This helper function is used to bring stability to a website that is truly and deeply broken. Tries to select
+        # an area code for the given candidateZip, preferring any area code already known to work for it. Returns the
+        # selected area code, "NoNumbers" if Verizon has none for this zip, or None if the dropdown misbehaved.
+        def selectAreaCode(candidateZip):
+            # Wait for the spinner to disappear if it's there again, then write the zip.
+            self.browser.waitForNetworkIdle()
+            self.browser.searchForElement(by=By.XPATH,value=zipCodeSpinnerXPath,timeout=30,invertedSearch=True)
+            zipCodeForm = self.browser.searchForElement(by=By.XPATH,value=zipCodeFormXPath,timeout=60,testClickable=True)
+            zipCodeForm.clear()
+            zipCodeForm.send_keys(candidateZip)
 
-        # This helper function is used to bring stability to a website that is truly and deeply broken.
-        def selectAreaCode():
             # First, open the dropdown. Wait until either the scrollArea is found (meaning area codes should be listed)
             # or Verizon says that there's no area codes available.
             initialClickResult = self.browser.safeClick(by=By.XPATH,value=areaCodeDropdownXPath,timeout=20,raiseError=False,
                                    successfulClickCondition=lambda b:
                                    (b.searchForElement(by=By.XPATH,value=areaCodeScrollAreaXPath) or b.searchForElement(by=By.XPATH,value=noNumbersAvailableXPath)))
             if not initialClickResult:
-                return False
+                return None
 
             # Wait for the spinner.
-            self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True,minSearchTime=3)
+            self.browser.waitForNetworkIdle()
+            self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True)
 
             # Handle the case where Verizon says no numbers are available
             if self.browser.searchForElement(by=By.XPATH, value=noNumbersAvailableXPath, timeout=3, testClickable=True):
-                playsoundAsync(paths["media"] / "shaman_attention.mp3")
-                userResponse = input(f"Verizon is saying there are no area codes available for the given zip '{zipCode}'. Please manually select an area code, and press enter to continue. Press any key to cancel.")
-                if userResponse:
-                    error = ValueError("No zip codes found, and user cancelled manual input.")
-                    log.error(error)
-                    raise error
-                else:
-                    # Assume the user successfully manually selected an areaCode and return True.
-                    return True
-            # Otherwise, try to find the list of area codes.
-            else:
-                # Get area code results.
-                areaCodeResults = self.browser.searchForElements(by=By.XPATH, value=areaCodeResultsXPath, timeout=10)
-
-                # Check if any area code results are found, if not, try another zip code.
-                if areaCodeResults:
-                    self.browser.safeClick(element=areaCodeResults[0],timeout=10)
-                    # Wait for the spinner one final time
-                    self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True,minSearchTime=1)
-                    return True
-                else:
-                    return False
-
-        # Try to select an areaCode 3 times.
-        selectionStatus = False
-        for i in range(3):
-            selectionStatus = selectAreaCode()
-            if selectionStatus:
+                return "NoNumbers"
+
+            # Otherwise, get the listed area codes and pick a known-good one if it's listed, or the first otherwise.
+            areaCodeResults = self.browser.searchForElements(by=By.XPATH, value=areaCodeResultsXPath, timeout=10)
+            if not areaCodeResults:
+                return None
+            knownAreaCodes = areaCodeCache.getAreaCodes(candidateZip)
+            targetAreaCodeResult = areaCodeResults[0]
+            for areaCodeResult in areaCodeResults:
+                areaCodeMatch = re.search(r"\d{3}",areaCodeResult.text)
+                if areaCodeMatch and areaCodeMatch.group(0) in knownAreaCodes:
+                    targetAreaCodeResult = areaCodeResult
+                    break
+            areaCodeMatch = re.search(r"\d{3}",targetAreaCodeResult.text)
+            selectedAreaCode = areaCodeMatch.group(0) if areaCodeMatch else targetAreaCodeResult.text.strip()
+
+            self.browser.safeClick(element=targetAreaCodeResult,timeout=10)
+            # Wait for the spinner one final time
+            self.browser.waitForNetworkIdle()
+            self.browser.searchForElement(by=By.XPATH, value=zipCodeSpinnerXPath, timeout=30, invertedSearch=True)
+            return selectedAreaCode
+
+        # Try each candidate zip in order (the zip itself, then learned and nearby fallbacks), giving each zip up to 3
+        # attempts if the dropdown misbehaves, and learning from every result.
+        candidateZips = areaCodeCache.getCandidateZips(zipCode)
+        cachedFirstChoice = areaCodeCache.getAreaCodes(candidateZips[0])
+        selectedAreaCode = None
+        for candidateZip in candidateZips:
+            for i in range(3):
+                selectionResult = selectAreaCode(candidateZip)
+                if selectionResult is not None:
+                    break
+            if selectionResult == "NoNumbers":
+                log.info(f"Verizon has no numbers available for zip '{candidateZip}', trying the next nearby zip.")
+                areaCodeCache.recordNoNumbers(candidateZip)
+            elif selectionResult is not None:
+                selectedAreaCode = selectionResult
+                areaCodeCache.recordAreaCode(candidateZip,selectedAreaCode,originalZipCode=zipCode)
+                areaCodeCache.recordLookup(hit=(candidateZip == candidateZips[0] and selectedAreaCode in cachedFirstChoice))
                 break
-        if not selectionStatus:
-            log.error(f"Couldn't successfully select an area code after 3 attempts!")
+        log.info(areaCodeCache.getStatsReport())
+        if selectedAreaCode is None:
+            areaCodeCache.recordLookup(hit=False)
+            log.error(f"Couldn't successfully select an area code for zip '{zipCode}' or any of its nearby zips: {candidateZips}")
             return ActionResult(status=StatusCode.VERIZON_ZIP_SELECTION_FAILURE)
 
         assignNumbersButtonXPath = "//button[text()='Assign numbers to all']"
@@ -1063,6 +1211,36 @@ class VerizonDriver:
             return ActionResult(status=StatusCode.SUCCESS)
         else:
             return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
+    # Assumes we're on the number selection page with numbers assigned and user info saved. Reads the "Your devices"
+    # list, and returns a list with the wireless number listed nearest to each of the given userNames, in the same
+    # order (None if no number could be matched to that line). Users sharing a name are matched to that name's
+    # occurrences in list order, and no number is matched to more than one line.
+    @action()
+    def NumberSelection_ReadAssignedLines(self,userNames : list):
+        yourDevicesSectionXPath = "//div[contains(text(),'Your devices')]/parent::div"
+        yourDevicesSection = self.browser.searchForElement(by=By.XPATH,value=yourDevicesSectionXPath,timeout=30,testClickable=True,scrollIntoView=True)
+        if not yourDevicesSection:
+            return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
+        yourDevicesText = yourDevicesSection.text
+
+        unclaimedNumberMatches = list(re.finditer(r"\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}",yourDevicesText))
+        nameOccurrencesSeen = {}
+        assignedLines = []
+        for userName in userNames:
+            normalizedUserName = normalizeName(userName).strip().lower()
+            occurrenceIndex = nameOccurrencesSeen.get(normalizedUserName,0)
+            nameOccurrencesSeen[normalizedUserName] = occurrenceIndex + 1
+
+            nameMatches = list(re.finditer(re.escape(normalizedUserName),yourDevicesText,re.IGNORECASE))
+            if occurrenceIndex >= len(nameMatches) or not unclaimedNumberMatches:
+                assignedLines.append(None)
+                continue
+            nameMatch = nameMatches[occurrenceIndex]
+            closestNumberMatch = min(unclaimedNumberMatches,key=lambda numberMatch: abs(numberMatch.start() - nameMatch.start()))
+            unclaimedNumberMatches.remove(closestNumberMatch)
+            assignedLines.append(convertServiceIDFormat(closestNumberMatch.group(0),targetFormat="dashed"))
+
+        return ActionResult(status=StatusCode.SUCCESS,data=assignedLines)
     # Continues to the next screen from the Number Selection screen, assuming a number has been
     # selected and all user inputted.
     @action()
@@ -1075,7 +1253,8 @@ class VerizonDriver:
         addressDoesntExistXPath = "//div[contains(text(),'The address you entered could not be validated.')]"
         aliasDict = {self.shoppingCartHeaderXPath1 : "ShoppingCart",addressDoesntExistXPath : "AddressDoesntExist"}
 
-        foundElement,alias = self.browser.searchForElement(by=By.XPATH, value=aliasDict, timeout=60, minSearchTime=5,testClickable=True)
+        self.browser.waitForNetworkIdle()
+        foundElement,alias = self.browser.searchForElement(by=By.XPATH, value=aliasDict, timeout=60,testClickable=True)
         if alias == "ShoppingCart":
             return ActionResult(status=StatusCode.SUCCESS)
         elif alias == "AddressDoesntExist":
@@ -1111,7 +1290,8 @@ class VerizonDriver:
         self.browser.safeClick(element=continueButton,timeout=30)
 
         # Test to make sure we've arrived back at the shopping cart.
-        testResult = self.browser.searchForElement(by=By.XPATH, value=self.shoppingCartHeaderXPaths, timeout=60, minSearchTime=5)
+        self.browser.waitForNetworkIdle()
+        testResult = self.browser.searchForElement(by=By.XPATH, value=self.shoppingCartHeaderXPaths, timeout=60)
         if testResult:
             return ActionResult(status=StatusCode.SUCCESS)
         else:
@@ -1157,6 +1337,20 @@ class VerizonDriver:
             log.error(f"Attempted to validate a single line in the shopping cart, but found {len(allCartLines)} lines instead!")
             raise ValueError(f"Attempted to validate a single line in the shopping cart, but found {len(allCartLines)} lines instead!")
             #return ActionResult(status=StatusCode.SUCCESS)
+    # Helper method verifies that exactly expectedLines lines are listed in the shopping cart, for multi-line orders.
+    @action()
+    def ShoppingCart_ValidateLineCount(self,expectedLines : int):
+        if expectedLines == 1:
+            return self.ShoppingCart_ValidateSingleLine()
+
+        allCartLinesXPath1 = "//*[contains(@class,'dsc-line-list')]/*[@class='ng-star-inserted']"
+        allCartLinesXPath2 = "//app-line-group//span[starts-with(normalize-space(@class),'line-name')]"
+        allCartLines = self.browser.searchForElements(by=By.XPATH,value=[allCartLinesXPath2,allCartLinesXPath1],timeout=15)
+        if len(allCartLines) == expectedLines:
+            return ActionResult(status=StatusCode.SUCCESS)
+        else:
+            log.error(f"Expected {expectedLines} lines in the shopping cart, but found {len(allCartLines)} lines instead!")
+            return ActionResult(status=StatusCode.VERIZON_CART_INCONSISTENCY)
     # From shopping cart, clicks back to add accessories to the given order. For use with upgrades,
     # which ATM bypass the accessory selection screen by default.
     @action()
@@ -1169,7 +1363,8 @@ class VerizonDriver:
         # Then, click on "Add accessories"
         addAccessoriesXPath1 = "//div[contains(@class,'dsc-add-accessories-btn')]/a[contains(text(),'Add accessories')]"
         addAccessoriesXPath2 = "//div[contains(@class,'dsc-add-accessories-btn')]/button[contains(text(),'Shop accessories')]"
-        addAccessories = self.browser.searchForElement(by=By.XPATH,value=[addAccessoriesXPath1,addAccessoriesXPath2],timeout=30,testClickable=True,minSearchTime=3)
+        self.browser.waitForNetworkIdle()
+        addAccessories = self.browser.searchForElement(by=By.XPATH,value=[addAccessoriesXPath1,addAccessoriesXPath2],timeout=30,testClickable=True)
         self.browser.safeClick(element=addAccessories,scrollIntoView=True,timeout=10)
 
         # Finally, wait for Accessories screen to load.
@@ -1182,9 +1377,11 @@ class VerizonDriver:
             return ActionResult(status=StatusCode.AMBIGUOUS_PAGE)
     # From shopping cart, clicks back to add features to the given order.
     @action()
-    def ShoppingCart_AddFeatures(self):
-        # First, validate that they're only one line added.
-        self.ShoppingCart_ValidateSingleLine()
+    def ShoppingCart_AddFeatures(self,expectedLines=1):
+        # First, validate that the cart has the lines we expect.
+        validateLinesResult = self.ShoppingCart_ValidateLineCount(expectedLines=expectedLines)
+        if not validateLinesResult:
+            return ActionResult(status=validateLinesResult.status)
 
         # Then, click on "Manage features"
         addFeaturesXPath = "//a[normalize-space(translate(text(),'ABCDEFGHIJKLMNOPQRSTUVWXYZ','abcdefghijklmnopqrstuvwxyz'))='manage features']"
@@ -1314,8 +1511,9 @@ class VerizonDriver:
         zipCodeField.send_keys(zipCode)
 
         # Test again for the clickable checkout header, to ensure all loading is done
+        self.browser.waitForNetworkIdle()
         self.browser.searchForElement(by=By.XPATH, value=checkoutHeaderXPath, timeout=60, testClickable=True,scrollIntoView=True,
-                                      testLiteralClick=True, minSearchTime=3)
+                                      testLiteralClick=True)
 
         # Finally, we continue back to payment.
         continueToPaymentButtonXPath = "//button[contains(text(),'Continue to Payment')]"
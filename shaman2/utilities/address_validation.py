@@ -1,18 +1,30 @@
 import requests
 import re
 import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from openai import OpenAI
 from shaman2.common.logger import log
 from shaman2.common.paths import paths
 from shaman2.common.config import mainConfig
+from shaman2.data_storage.address_storage import addressValidationCache, normalizeAddressText
+from shaman2.data_storage.postal_gazetteer import postalGazetteer
 from shaman2.utilities.async_sound import playsoundAsync
 from shaman2.utilities.misc import isNumber
 
 
 #region === OSM Nominatim Validation ===
 
-# Uses OSMN to simply get a state, given a zip code. (Canada OR US)
+# Gets a state, given a zip code (Canada OR US). This is resolved locally through the postal gazetteer whenever
+# possible, and only falls back to OSMN for prefixes the gazetteer doesn't know.
 def getStateFromZip(zip_code):
+    localState = postalGazetteer.getRegionName(zip_code)
+    if localState is not None:
+        return localState
+    return osmnGetStateFromZip(zip_code)
+# Uses OSMN to simply get a state, given a zip code. (Canada OR US)
+def osmnGetStateFromZip(zip_code):
     # Define the OSM Nominatim URL and parameters for searching by postal code
     url = "https://nominatim.openstreetmap.org/search"
     params = {
@@ -69,6 +81,162 @@ def osmnValidateAddress(_address):
 
 #endregion === OSM Nominatim Validation ===
 
+#region === Rule-Based Parsing ===
+
+# Addresses parsed by the rule-based parser with at least this confidence skip ChatGPT entirely.
+RULE_PARSER_CONFIDENCE_THRESHOLD = 0.8
+
+streetSuffixes = {"st","street","ave","av","avenue","rd","road","blvd","boulevard","dr","drive","ln","lane","way","ct",
+                  "court","pl","place","pkwy","parkway","hwy","highway","cir","circle","ter","terrace","trl","trail",
+                  "sq","square","loop","pike","row","cres","crescent","fwy","freeway","expy","expressway","plz","plaza",
+                  "run","path","walk","xing","crossing","tpke","turnpike","broadway","rue","ch","chemin","rte","route",
+                  "line","sideroad","concession","gate","grove","cv","cove","pt","point","aly","alley","ctr","center","centre"}
+unitPattern = r"(?:suite|ste|apt|apartment|unit|bldg|building|floor|fl|room|rm|dept|lot|space|spc|door|dock)\.?\s*#?\s*[\w-]+|#\s*[\w-]+"
+noisePattern = r"\b(?:attn|attention|c/o|care of|phone|ph|tel|cell|deliver|delivery|leave|front desk|reception|please|call)\b|\(?\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}"
+countryPattern = r"[,\s]*\b(?:usa|u\.s\.a\.|u\.s\.|united states(?: of america)?|canada)\.?$"
+postalCodePattern = r"[,\s]*\b(\d{5}(?:-\d{4})?|[a-z]\d[a-z]\s?\d[a-z]\d)$"
+streetLinePattern = r"^(?:\d+[a-z]?(?:-\d+[a-z]?)?\s+\S|p\.?\s?o\.?\s*box\s+\d+)"
+
+# Deterministically parses a well-formed US/Canada address (like "123 Main St, Suite 4, Houston, TX 77002") into the
+# same format as extractAddressFromGPTResponse. Returns a tuple of (addressDict, confidence), where confidence runs
+# from 0 (couldn't parse, or looks too messy to trust) to 1 (every part found and cross-checked against the gazetteer).
+def ruleParseAddress(rawAddressString : str):
+    parsedAddress = {"Address1": None, "Address2": None, "City": None, "State": None, "ZipCode": None}
+    if not rawAddressString:
+        return parsedAddress, 0.0
+    confidence = 1.0
+
+    # Messy addresses with attention lines, phone numbers or delivery instructions are left to ChatGPT.
+    if re.search(noisePattern,rawAddressString,re.IGNORECASE):
+        confidence *= 0.4
+    addressText = re.sub(r"\s+"," ",re.sub(r"[\r\n;]+",", ",rawAddressString)).strip(" ,.")
+    addressText = re.sub(countryPattern,"",addressText,flags=re.IGNORECASE).strip(" ,")
+
+    # Zip/postal code, which must be at the very end.
+    postalCodeMatch = re.search(postalCodePattern,addressText,re.IGNORECASE)
+    if not postalCodeMatch:
+        return parsedAddress, 0.0
+    zipCode = postalCodeMatch.group(1).upper()
+    if re.fullmatch(r"[A-Z]\d[A-Z]\d[A-Z]\d",zipCode):
+        zipCode = f"{zipCode[:3]} {zipCode[3:]}"
+    parsedAddress["ZipCode"] = zipCode
+    addressText = addressText[:postalCodeMatch.start()].strip(" ,")
+
+    # State/province, just before the zip, as either a code or a full name known to the gazetteer.
+    zipStateCode = postalGazetteer.getRegionCode(zipCode)
+    stateNames = {}
+    for regionCode,regionName,_ in postalGazetteer.regions:
+        stateNames[regionCode.lower()] = regionCode
+        stateNames[regionName.lower()] = regionCode
+    stateAlternatives = "|".join(re.escape(stateName) for stateName in sorted(stateNames,key=len,reverse=True))
+    stateMatch = re.search(rf"(?:^|[,\s])({stateAlternatives})\.?$",addressText,re.IGNORECASE)
+    if stateMatch:
+        parsedAddress["State"] = stateNames[stateMatch.group(1).lower()]
+        addressText = addressText[:stateMatch.start(1)].strip(" ,")
+        if zipStateCode is not None and parsedAddress["State"] != zipStateCode:
+            confidence *= 0.2
+    elif zipStateCode is not None:
+        parsedAddress["State"] = zipStateCode
+        confidence *= 0.9
+    else:
+        return parsedAddress, 0.0
+
+    # City is the last remaining segment. If the city isn't comma separated from the street, it can only be split off
+    # using the gazetteer's known cities for this zip.
+    segments = [segment.strip() for segment in addressText.split(",") if segment.strip()]
+    knownCities = postalGazetteer.getCities(zipCode)
+    if len(segments) >= 2:
+        parsedAddress["City"] = segments.pop()
+    elif len(segments) == 1:
+        for knownCity in sorted(knownCities,key=len,reverse=True):
+            cityMatch = re.search(rf"\s({re.escape(knownCity)})$",segments[0],re.IGNORECASE)
+            if cityMatch:
+                parsedAddress["City"] = knownCity
+                segments[0] = segments[0][:cityMatch.start()].strip()
+                break
+    if parsedAddress["City"] is None:
+        return parsedAddress, 0.0
+    if re.search(r"\d",parsedAddress["City"]):
+        confidence *= 0.3
+    elif knownCities and parsedAddress["City"].lower() not in (knownCity.lower() for knownCity in knownCities):
+        confidence *= 0.8
+
+    # Everything else should be a single street line, optionally with unit lines (or a trailing unit on the street).
+    streetSegments = []
+    unitSegments = []
+    for segment in segments:
+        if re.fullmatch(unitPattern,segment,re.IGNORECASE):
+            unitSegments.append(segment)
+        elif re.match(streetLinePattern,segment,re.IGNORECASE):
+            streetSegments.append(segment)
+        elif not streetSegments and not re.search(r"\d",segment):
+            # A leading name line (like a company or site name) is dropped, just as ChatGPT would.
+            confidence *= 0.85
+        else:
+            confidence *= 0.4
+    if not streetSegments:
+        return parsedAddress, 0.0
+    if len(streetSegments) > 1:
+        confidence *= 0.5
+
+    # A trailing unit is only split off if what's left still looks like a street, and the "unit" isn't really the
+    # street's own name and suffix (like "500 Dock St" or "1 Main Unit Rd").
+    streetLine = streetSegments[0]
+    trailingUnitMatch = re.search(rf"\s({unitPattern})$",streetLine,re.IGNORECASE)
+    if trailingUnitMatch:
+        remainingStreetLine = streetLine[:trailingUnitMatch.start()].strip(" ,")
+        unitIdentifier = re.split(r"[\s#.]+",trailingUnitMatch.group(1))[-1].lower()
+        if re.match(streetLinePattern,remainingStreetLine,re.IGNORECASE) and unitIdentifier not in streetSuffixes:
+            unitSegments.insert(0,trailingUnitMatch.group(1))
+            streetLine = remainingStreetLine
+    if re.fullmatch(r"\d+[a-z]?(?:-\d+[a-z]?)?",streetLine,re.IGNORECASE):
+        return parsedAddress, 0.0
+    if not re.match(r"p\.?\s?o\.?\s*box",streetLine,re.IGNORECASE):
+        streetWords = [word.strip(".").lower() for word in streetLine.split()[1:]]
+        if not any(streetWord in streetSuffixes for streetWord in streetWords):
+            confidence *= 0.85
+
+    parsedAddress["Address1"] = streetLine
+    parsedAddress["Address2"] = ", ".join(unitSegments) if unitSegments else None
+    return parsedAddress, round(confidence,3)
+# Returns the rule-parsed address for rawAddressString if the parser is confident enough to skip ChatGPT, or None.
+def ruleClassifyAddress(rawAddressString : str,confidenceThreshold=RULE_PARSER_CONFIDENCE_THRESHOLD):
+    parsedAddress, confidence = ruleParseAddress(rawAddressString)
+    return parsedAddress if confidence >= confidenceThreshold else None
+
+# Runs the rule-based parser over a benchmark corpus (a json list of {"Raw": ..., "Expected": {...}}, where Expected
+# is the correct parse), and returns a simple report string of how many addresses would skip ChatGPT, how many of
+# those were parsed correctly, and how long parsing took.
+def benchmarkRuleParser(corpusFilePath=None,confidenceThreshold=RULE_PARSER_CONFIDENCE_THRESHOLD):
+    corpusFilePath = corpusFilePath if corpusFilePath else paths["assets"] / "benchmarks" / "address_corpus.json"
+    with open(corpusFilePath,"r",encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    skippedCount = 0
+    correctCount = 0
+    incorrectAddresses = []
+    startTime = time.perf_counter()
+    for corpusEntry in corpus:
+        parsedAddress, confidence = ruleParseAddress(corpusEntry["Raw"])
+        if confidence < confidenceThreshold:
+            continue
+        skippedCount += 1
+        expectedAddress = corpusEntry.get("Expected") or {}
+        if all(normalizeAddressText(parsedAddress.get(field) or "") == normalizeAddressText(expectedAddress.get(field) or "")
+               for field in ("Address1","Address2","City","State","ZipCode")):
+            correctCount += 1
+        else:
+            incorrectAddresses.append(corpusEntry["Raw"])
+    totalTime = time.perf_counter() - startTime
+
+    for incorrectAddress in incorrectAddresses:
+        log.warning(f"Rule-based parser confidently misparsed benchmark address: '{incorrectAddress}'")
+    return (f"Rule-based address parser: {skippedCount}/{len(corpus)} addresses ({skippedCount / len(corpus) * 100:.1f}%) "
+            f"skip ChatGPT, {correctCount}/{skippedCount} of those parsed correctly. Parsed in {totalTime * 1000:.2f}ms "
+            f"({totalTime / len(corpus) * 1000000:.1f}us each).")
+
+#endregion === Rule-Based Parsing ===
+
 #region === ChatGPT Validation ===
 
 client = OpenAI(api_key=mainConfig["authentication"]["openAIKey"])
@@ -114,7 +282,9 @@ def extractAddressFromGPTResponse(gptResponseString):
     pattern = r'```(.*?)```'
     match = re.findall(pattern, gptResponseString, re.DOTALL)
     rawAddressDict = json.loads(match[0].strip())
-
+    return cleanGPTAddressDict(rawAddressDict)
+# Cleans a single raw address dict returned by GPT into our standard address format.
+def cleanGPTAddressDict(rawAddressDict : dict):
     cleanedAddressDict = {"Address1": rawAddressDict["Address1"],
                           "Address2": rawAddressDict["Address2"],
                           "City": rawAddressDict["City"],
@@ -134,18 +304,149 @@ def extractAddressFromGPTResponse(gptResponseString):
 
     return cleanedAddressDict
 
+# Uses ChatGPT to classify a whole list of addresses in a single request, rather than one request per address.
+classifyAddressBatchQuery = """You are an address classifier bot, who specializes in identifying the various parts of shipping addresses given to you by our users for ordering. Our users often make mistakes or inconsistencies when writing their shipping addresses, including putting Street Name and Unit/Apt Number out of order, forgetting a state, or writing their city in it twice.
+
+Your job is simply to classify the various parts of each numbered raw user address string below into its parts, using this json format for each address:
+
+{returnAddressFormat}
+
+If anything seems to be missing, instead map it to a json "null" like this: "City": null
+
+Put the whole result into a single code block using 3 `, containing one json list with exactly one object per address, in the same order as the addresses are numbered. Do not provide any explanation. Note that some users may add a lot of extraneous information that can simply be removed, such as Attention To, Company Names, PHone Numbers, or even Devliery Instructions. Your only focus is on finding the 5 parts listed in the example, and ignoring everything else.
+
+Here are the addresses below:
+
+{rawAddresses}
+"""
+def gptClassifyAddressBatch(_rawAddresses : list):
+    numberedAddresses = "\n".join(f"{i + 1}. {_rawAddress}" for i,_rawAddress in enumerate(_rawAddresses))
+    _response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are an address validation assistant."},
+            {"role": "user", "content": classifyAddressBatchQuery.format(returnAddressFormat=returnAddressFormat,
+                                                                         rawAddresses=numberedAddresses)}
+        ],
+        temperature=0
+    )
+
+    return _response.choices[0].message.content
+# Extracts the list of address dicts from GPT's batch response, raising a ValueError if it doesn't contain exactly
+# expectedCount addresses.
+def extractAddressListFromGPTResponse(gptResponseString,expectedCount : int):
+    pattern = r'```(?:json)?(.*?)```'
+    match = re.findall(pattern, gptResponseString, re.DOTALL)
+    rawAddressList = json.loads(match[0].strip()) if match else None
+    if type(rawAddressList) is not list or len(rawAddressList) != expectedCount:
+        error = ValueError(f"ChatGPT returned a malformed batch of addresses (expected {expectedCount}): '{gptResponseString}'")
+        log.error(error)
+        raise error
+    return [cleanGPTAddressDict(rawAddressDict) for rawAddressDict in rawAddressList]
+
 #endregion === ChatGPT Validation ===
 
-# Main function, simply accepts an address string, handles edge cases, and spits out a refined address.
-#TODO handle these in GUI later, to avoid crashing program and instead prompt user for decision making
-def validateAddress(rawAddressString : str):
-    # First, we take a raw address string given by a user and classify it using ChatGPT.
+#region === Address Prefetching ===
+
+# Pool for classifying addresses in the background, while the ordering loop carries on with browser work.
+addressClassificationPool = ThreadPoolExecutor(max_workers=4,thread_name_prefix="AddressClassifier")
+# Normalized address text -> Future of its classified address, for every address classification that's been started.
+pendingAddressClassifications = {}
+pendingAddressClassificationsLock = threading.Lock()
+
+# Starts classifying every given raw address in the background, so that validateAddress can later pick up the result
+# without waiting on ChatGPT. Addresses are deduplicated, anything already cached or in progress is skipped, anything
+# the rule-based parser is confident about is resolved immediately, and the rest are sent in batches of batchSize addresses per request, with requests running concurrently on the pool.
+# Returns a list of Futures (or None for addresses that needed no classification), in the same order as given.
+def prefetchAddresses(rawAddressStrings : list,batchSize=10):
+    addressFutures = []
+    newAddresses = {}
+    with pendingAddressClassificationsLock:
+        for rawAddressString in rawAddressStrings:
+            addressKey = normalizeAddressText(rawAddressString) if rawAddressString else None
+            if not addressKey or addressKey in addressValidationCache:
+                addressFutures.append(None)
+                continue
+            if addressKey not in pendingAddressClassifications:
+                pendingAddressClassifications[addressKey] = Future()
+                # Well-formed addresses are resolved by the rule-based parser on the spot, without ChatGPT.
+                ruleParsedAddress = ruleClassifyAddress(rawAddressString)
+                if ruleParsedAddress is not None:
+                    pendingAddressClassifications[addressKey].set_result(ruleParsedAddress)
+                else:
+                    newAddresses[addressKey] = rawAddressString
+            addressFutures.append(pendingAddressClassifications[addressKey])
+
+    newAddressKeys = list(newAddresses.keys())
+    for batchStart in range(0,len(newAddressKeys),batchSize):
+        batchKeys = newAddressKeys[batchStart:batchStart + batchSize]
+        addressClassificationPool.submit(__classifyAddressBatch,[newAddresses[addressKey] for addressKey in batchKeys],
+                                         [pendingAddressClassifications[addressKey] for addressKey in batchKeys])
+    if newAddressKeys:
+        log.info(f"Prefetching classification of {len(newAddressKeys)} addresses in {-(-len(newAddressKeys) // batchSize)} batches.")
+    return addressFutures
+# Classifies every given raw address, prefetching them as a batch, and returns the classified (but not yet validated)
+# addresses in the same order. Cached addresses are returned from the cache.
+def classifyAddresses(rawAddressStrings : list,batchSize=10):
+    addressFutures = prefetchAddresses(rawAddressStrings=rawAddressStrings,batchSize=batchSize)
+    return [addressFuture.result() if addressFuture is not None else addressValidationCache.get(rawAddressString)
+            for rawAddressString,addressFuture in zip(rawAddressStrings,addressFutures)]
+
+# Helper function, run on the pool, that classifies a single batch of addresses and resolves each of their futures. If
+# the batch response is unusable, each address falls back to its own classification request.
+def __classifyAddressBatch(rawAddressStrings : list,addressFutures : list):
+    try:
+        classifiedAddresses = extractAddressListFromGPTResponse(gptResponseString=gptClassifyAddressBatch(_rawAddresses=rawAddressStrings),
+                                                                expectedCount=len(rawAddressStrings))
+    except Exception as e:
+        log.warning(f"Batch address classification failed, falling back to classifying addresses one at a time: {e}")
+        classifiedAddresses = None
+
+    for i,(rawAddressString,addressFuture) in enumerate(zip(rawAddressStrings,addressFutures)):
+        try:
+            if classifiedAddresses is not None:
+                addressFuture.set_result(classifiedAddresses[i])
+            else:
+                addressFuture.set_result(extractAddressFromGPTResponse(gptResponseString=gptClassifyAddress(_rawAddress=rawAddressString)))
+        except Exception as e:
+            addressFuture.set_exception(e)
+# Helper function that returns the classified address for rawAddressString, using a prefetched classification if one
+# was started (waiting for it only if it's still running), and otherwise classifying it directly - through the
+# rule-based parser if it's confident enough, or ChatGPT if not.
+def getClassifiedAddress(rawAddressString : str):
+    with pendingAddressClassificationsLock:
+        addressFuture = pendingAddressClassifications.pop(normalizeAddressText(rawAddressString),None)
+    if addressFuture is not None:
+        try:
+            return addressFuture.result()
+        except Exception as e:
+            log.warning(f"Prefetched classification of address '{rawAddressString}' failed, classifying it again: {e}")
+
+    ruleParsedAddress = ruleClassifyAddress(rawAddressString)
+    if ruleParsedAddress is not None:
+        return ruleParsedAddress
     classifiedAddressResponse = gptClassifyAddress(_rawAddress=rawAddressString)
-    classifiedAddress = extractAddressFromGPTResponse(gptResponseString=classifiedAddressResponse)
+    return extractAddressFromGPTResponse(gptResponseString=classifiedAddressResponse)
+
+#endregion === Address Prefetching ===
+
+# Main function, simply accepts an address string, handles edge cases, and spits out a refined address. With useCache,
+# addresses that have already been validated are returned straight from the address validation cache.
+#TODO handle these in GUI later, to avoid crashing program and instead prompt user for decision making
+def validateAddress(rawAddressString : str,useCache=True):
+    if useCache:
+        cachedAddress = addressValidationCache.get(rawAddressString)
+        if cachedAddress is not None:
+            log.info(addressValidationCache.getStatsReport())
+            return cachedAddress
+
+    # First, we take a raw address string given by a user and classify it using ChatGPT (or pick up its prefetched
+    # classification).
+    classifiedAddress = getClassifiedAddress(rawAddressString=rawAddressString)
 
     # If specifically the state is missing, we can easily resolve this by querying OSMN one extra time.
     if classifiedAddress.get("State") is None and classifiedAddress.get("ZipCode") is not None:
-        classifiedAddress["State"] = getStateFromZip(classifiedAddress["ZipCode"][:5])
+        classifiedAddress["State"] = getStateFromZip(classifiedAddress["ZipCode"])
 
     # Now, we check the address with OSMN (along with removing the address2 to avoid confusion).
     osmnAddressToTest = f"{classifiedAddress['Address1']}, " if classifiedAddress["Address1"] is not None else ""
@@ -169,5 +470,8 @@ def validateAddress(rawAddressString : str):
         userResponse = input(f"The user's shipping address is missing a ZIPCODE. Please enter a zipcode name, then press enter to continue.")
         classifiedAddress["ZipCode"] = userResponse.strip().capitalize()
 
-    # Finally, we return our classified, validated address.
+    # Finally, we cache and return our classified, validated address.
+    if useCache:
+        addressValidationCache.addAddress(rawAddressString,classifiedAddress)
+        log.info(addressValidationCache.getStatsReport())
     return classifiedAddress
\ No newline at end of file